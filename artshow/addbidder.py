@@ -6,7 +6,6 @@ from django.apps import apps
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
 from django.core.exceptions import ValidationError
-from django.db.models import Q
 from django.db.transaction import atomic
 from django.forms.formsets import formset_factory
 from django.shortcuts import get_object_or_404, render, redirect
@@ -228,9 +227,7 @@ def find_bidder(request):
         form = BidderSearchForm(request.POST)
         if form.is_valid():
             text = form.cleaned_data['text']
-            bidders = Bidder.objects.filter(Q(person__name__icontains=text)
-                                            | Q(person__reg_id__icontains=text)
-                                            | Q(bidderid__id=text)).distinct()
+            bidders = Bidder.search(text).select_related('person').prefetch_related('bidderid_set')
             search_executed = True
         else:
             bidders = []
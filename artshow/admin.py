@@ -1,21 +1,17 @@
 # Artshow Jockey
 # Copyright (C) 2009, 2010 Chris Cogdon
 # See file COPYING for licence details
-import smtplib
 
 from ajax_select import make_ajax_form
 from ajax_select.admin import AjaxSelectAdmin, AjaxSelectAdminTabularInline
 from ajax_select.fields import AutoCompleteSelectField
 from django import forms
-from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin import helpers
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
 from django.db.models import IntegerField, Max
 from django.db.models.functions import Cast, Substr
-from django.http import HttpResponse
-from django.shortcuts import render
+from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.utils.html import format_html
 
@@ -23,6 +19,7 @@ import json
 
 from . import email1
 from . import processbatchscan
+from . import tasks
 from .models import (
     Agent, Allocation, Artist, BatchScan, Bid, Bidder, BidderId, Checkoff,
     ChequePayment, EmailSignature, EmailTemplate, Invoice, InvoiceItem,
@@ -167,21 +164,17 @@ class ArtistAdmin(AjaxSelectAdmin):
                 selected_template = EmailTemplate.objects.get(pk=template_id)
                 signature = EmailSignature.objects.get(pk=signature_id).signature if signature_id else ""
                 if request.POST.get('send_email'):
-                    for a in queryset:
-                        email = a.person.email
-                        body = email1.make_email(a, selected_template.template, signature)
-                        try:
-                            send_mail(selected_template.subject, body, settings.ARTSHOW_EMAIL_SENDER, [email],
-                                      fail_silently=False)
-                            self.message_user(request, "Mail to %s succeeded" % email)
-                        except smtplib.SMTPException as x:
-                            # Note: ModelAdmin message_user only supports sending info-level messages.
-                            messages.error(request, "Mail to %s failed: %s" % (email, x))
+                    count = tasks.email_artists(list(queryset.values_list('pk', flat=True)),
+                                                selected_template.subject, selected_template.template, signature)
+                    self.message_user(request, format_html(
+                        'Sending {} e-mails. Follow their progress on the <a href="{}">bulk messaging</a> page.',
+                        count, reverse('artshow-workflow-bulk-messaging')))
                     return None
                 else:
-                    for a in queryset:
+                    template = email1.compile_template(selected_template.template)
+                    for a in email1.prefetch_artists(queryset):
                         emails.append({'to': a.person.email,
-                                       'body': email1.make_email(a, selected_template.template, signature)})
+                                       'body': email1.render_email(template, email1.artist_context(a, signature))})
         templates = EmailTemplate.objects.all()
         signatures = EmailSignature.objects.all()
         context = {
@@ -210,12 +203,14 @@ class ArtistAdmin(AjaxSelectAdmin):
     print_bidsheets.short_description = "Print Bid Sheets"
 
     def print_mailing_labels(self, request, queryset):
-        from . import bidsheets
+        from . import pdfjobs
 
-        response = HttpResponse(content_type="application/pdf")
-        bidsheets.generate_mailing_labels(output=response, artists=queryset)
-        self.message_user(request, "Mailing labels printed.")
-        return response
+        artist_ids = sorted(queryset.values_list('artistid', flat=True))
+        version = list(Artist.objects.filter(artistid__in=artist_ids).order_by('artistid').values_list(
+            'publicname', 'person__name', 'person__address1', 'person__address2', 'person__city',
+            'person__state', 'person__postcode', 'person__country'))
+        job = pdfjobs.request_pdf('mailing_labels', 'mailing-labels.pdf', {'artist_ids': artist_ids}, version)
+        return redirect('artshow-pdf-job', job_id=job.pk)
 
     print_mailing_labels.short_description = "Print Mailing Labels"
 
@@ -331,11 +326,14 @@ class PieceAdmin(admin.ModelAdmin):
     clickable_invoice.short_description = "invoice"
 
     def top_bid(self, obj):
-        return obj.bid_set.exclude(invalid=True).order_by('-amount')[0:1].get().amount
+        return obj.top_bid_amount
+
+    top_bid.admin_order_field = "top_bid_amount"
 
     def top_bid_detail(self, obj):
-        top_bid = obj.bid_set.exclude(invalid=True).order_by('-amount')[0:1].get()
-        return "$%s by %s" % (top_bid.amount, top_bid.bidder)
+        if obj.top_bidder is None:
+            return None
+        return "$%s by %s" % (obj.top_bid_amount, obj.top_bidder)
 
     top_bid_detail.short_description = "Top bid"
 
@@ -612,9 +610,10 @@ class SquareTerminalAdmin(admin.ModelAdmin):
 
 @admin.register(SquareWebhook)
 class SquareWebhookAdmin(admin.ModelAdmin):
-    list_display = ('webhook_event_id', 'timestamp', 'webhook_type', 'webhook_data_id')
-    fields = ('timestamp', 'pretty_json')
-    readonly_fields = ('timestamp', 'pretty_json')
+    list_display = ('webhook_event_id', 'timestamp', 'webhook_type', 'webhook_data_id', 'processed', 'failed')
+    list_filter = ('failed',)
+    fields = ('timestamp', 'ordering_key', 'processed', 'failed', 'error', 'pretty_json')
+    readonly_fields = fields
 
     @admin.display(description='ID')
     def webhook_event_id(self, webhook):
@@ -645,9 +644,10 @@ class SquareWebhookAdmin(admin.ModelAdmin):
 @admin.register(TelegramWebhook)
 class TelegramWebhookAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'webhook_message_sender',
-                    'webhook_message_text')
-    fields = ('timestamp', 'pretty_json')
-    readonly_fields = ('timestamp', 'pretty_json')
+                    'webhook_message_text', 'processed', 'failed')
+    list_filter = ('failed',)
+    fields = ('timestamp', 'ordering_key', 'processed', 'failed', 'error', 'pretty_json')
+    readonly_fields = fields
 
     @admin.display(description='Message Sender')
     def webhook_message_sender(self, webhook):
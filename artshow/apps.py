@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class ArtshowConfig(AppConfig):
+    name = 'artshow'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -66,12 +66,13 @@ class ConfirmationForm(forms.Form):
 @login_required(login_url=LOGIN_URL)
 def index(request):
     try:
-        bidder = Bidder.objects.get(person__user=request.user)
+        bidder = Bidder.objects.select_related('person').prefetch_related('bidderid_set') \
+            .get(person__user=request.user)
     except Bidder.DoesNotExist:
         return redirect('artshow-bid-register')
 
-    pieces_won, pieces_not_won, pieces_in_voice_auction = bidder.get_results()
-    show_has_bids = Bid.objects.filter(invalid=False).exists()
+    pieces_won, pieces_not_won, pieces_in_voice_auction = bidder.cached_results()
+    show_has_bids = Bid.show_has_bids()
 
     email_confirmation_form = None
     if bidder.person.email_confirmation_code:
@@ -2,9 +2,11 @@ from decimal import Decimal
 from django.contrib.auth.decorators import permission_required
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Q
 from django.http import JsonResponse
 from django.shortcuts import render
 from django.utils import timezone
+from django.views.decorators.http import require_POST
 import json
 
 from .models import Artist, Bid, BidderId, Piece
@@ -16,14 +18,24 @@ def bid_entry(request):
                   {'bid_slots': list(range(1, 7))})
 
 
-def error_response(field, message, index=None):
+def error_dict(field, message, index=None):
     error = {
         'field': field,
         'message': message,
     }
     if index is not None:
         error['index'] = index
-    return JsonResponse({'error': error})
+    return error
+
+
+def error_response(field, message, index=None):
+    return JsonResponse({'error': error_dict(field, message, index)})
+
+
+class BidEntryError(Exception):
+    def __init__(self, field, message, index=None):
+        super().__init__(message)
+        self.error = error_dict(field, message, index)
 
 
 @permission_required('artshow.is_artshow_staff')
@@ -44,75 +56,241 @@ def bids(request, artist_id, piece_id):
         return set_bids(piece, json.loads(request.body.decode('utf-8')))
 
 
-def get_bids(piece):
-    bids = piece.bid_set.exclude(invalid=True).order_by('amount')
-
+def bids_dict(piece, bids):
     bids_updated = None
     if piece.bids_updated:
         bids_updated = piece.bids_updated.isoformat()
 
-    return JsonResponse({
+    return {
         'bids': [{
-            'bidder': bid.bidderid.id,
+            'bidder': bid.bidderid_id,
             'bid': float(bid.amount),
             'buy_now_bid': bid.buy_now_bid,
         } for bid in bids],
         'last_updated': bids_updated,
         'location': piece.location,
-        'locations': piece.artist.assigned_locations(),
-        'buy_now': None if piece.buy_now is None else float(piece.buy_now),
-    })
+    }
 
 
-def set_bids(piece, data):
-    existing_bids = piece.bid_set.exclude(invalid=True).order_by('amount')
+def get_bids(piece):
+    bids = piece.bid_set.exclude(invalid=True).order_by('amount')
+    return JsonResponse(dict(
+        bids_dict(piece, bids),
+        locations=piece.artist.assigned_locations(),
+        buy_now=None if piece.buy_now is None else float(piece.buy_now),
+    ))
+
 
+def set_bids(piece, data):
     try:
         with transaction.atomic():
+            # Lock the piece and its bids before reading them, so that bids
+            # entered for the piece at the same time are planned one after
+            # the other rather than against the same existing bids.
+            piece = Piece.objects.select_for_update(of=('self',)).select_related('artist').get(pk=piece.pk)
+            existing_bids = list(piece.bid_set.select_for_update().exclude(invalid=True).order_by('amount'))
+            entries = parse_bid_entries(data['bids'])
+            bidderids = BidderId.objects.select_related('bidder').in_bulk(
+                {bidder for bidder, amount, buy_now_bid in entries})
+
             # Update piece first so that it is marked as InShow.
             piece.bids_updated = timezone.now()
             piece.location = data['location'].upper()
+            piece.update_status_from_location()
+            deleted, created, bids = plan_bids(piece, existing_bids, entries, bidderids)
+
             piece.save()
+            if deleted:
+                Bid.objects.filter(pk__in=[bid.pk for bid in deleted]).bulk_delete()
+            if created:
+                Bid.objects.bulk_create(created)
+    except BidEntryError as e:
+        return JsonResponse({'error': e.error})
+
+    return get_bids(piece)
+
+
+def plan_bids(piece, existing_bids, entries, bidderids):
+    """Work out the changes needed to turn the existing valid bids on a piece
+    into the entered ones, validating the new sequence in memory.
+
+    entries is a list of (bidder ID, amount, buy now) tuples, and bidderids
+    maps bidder IDs to BidderId objects with their bidder loaded. Returns the
+    bids to delete, the bids to create and the resulting list of bids. Raises
+    BidEntryError if a bid is invalid."""
+    bids = []
+    for i, (bidder, amount, buy_now_bid) in enumerate(entries):
+        bidderid = bidderids.get(bidder)
+        if bidderid is None:
+            raise BidEntryError('bidder', 'Invalid bidder ID', i)
+        if not bidderid.bidder_id:
+            raise BidEntryError('bidder', 'Unassigned bidder ID', i)
+        bids.append(Bid(piece=piece, bidder=bidderid.bidder, bidderid=bidderid,
+                        amount=amount, buy_now_bid=buy_now_bid))
+
+    bids, deleted, created = diff_bids(existing_bids, bids)
+    for bid in bids:
+        # Kept bids are validated against this piece object, not a fresh copy
+        # from the database.
+        bid.piece = piece
 
-            bids = data['bids']
-            for i in range(len(bids)):
+    # Every bid from the first change onwards is checked against the bid
+    # before it, as though they were being placed in order.
+    first_change = next((i for i, bid in enumerate(bids)
+                         if i >= len(existing_bids) or existing_bids[i] is not bid), len(bids))
+    top_bid_amount = piece.top_bid_amount
+    top_bid_is_buy_now = piece.top_bid_is_buy_now
+    try:
+        for i in range(first_change, len(bids)):
+            previous = bids[i - 1] if i else None
+            piece.top_bid_amount = previous and previous.amount
+            piece.top_bid_is_buy_now = bool(previous and previous.buy_now_bid)
+            try:
+                bids[i].validate(as_new=True)
+            except ValidationError as e:
+                raise BidEntryError('bid', e.message, i)
+    finally:
+        piece.top_bid_amount = top_bid_amount
+        piece.top_bid_is_buy_now = top_bid_is_buy_now
+
+    return deleted, created, bids
+
+
+def bid_key(bid):
+    return (bid.bidderid_id, bid.amount, bid.buy_now_bid)
+
+
+def diff_bids(existing_bids, new_bids):
+    """Match up the existing bids with the entered ones, keeping as many of
+    the existing bids as possible.
+
+    The common prefix and suffix are kept as they are, and the longest common
+    subsequence of what is left between them is found, so that only the bids
+    that were actually added or removed are written. Returns the resulting
+    list of bids, using the existing Bid objects where they are kept, along
+    with the bids to delete and the bids to create."""
+    start = 0
+    while start < len(existing_bids) and start < len(new_bids) and \
+            bid_key(existing_bids[start]) == bid_key(new_bids[start]):
+        start += 1
+    existing_end, new_end = len(existing_bids), len(new_bids)
+    while existing_end > start and new_end > start and \
+            bid_key(existing_bids[existing_end - 1]) == bid_key(new_bids[new_end - 1]):
+        existing_end -= 1
+        new_end -= 1
+
+    old = [bid_key(bid) for bid in existing_bids[start:existing_end]]
+    new = [bid_key(bid) for bid in new_bids[start:new_end]]
+    # lengths[i][j] is the length of the longest common subsequence of
+    # old[i:] and new[j:].
+    lengths = [[0] * (len(new) + 1) for _ in range(len(old) + 1)]
+    for i in reversed(range(len(old))):
+        for j in reversed(range(len(new))):
+            if old[i] == new[j]:
+                lengths[i][j] = lengths[i + 1][j + 1] + 1
+            else:
+                lengths[i][j] = max(lengths[i + 1][j], lengths[i][j + 1])
+
+    bids = existing_bids[:start]
+    deleted, created = [], []
+    i = j = 0
+    while i < len(old) or j < len(new):
+        if i < len(old) and j < len(new) and old[i] == new[j]:
+            bids.append(existing_bids[start + i])
+            i += 1
+            j += 1
+        elif j == len(new) or (i < len(old) and lengths[i + 1][j] >= lengths[i][j + 1]):
+            deleted.append(existing_bids[start + i])
+            i += 1
+        else:
+            bids.append(new_bids[start + j])
+            created.append(new_bids[start + j])
+            j += 1
+    bids.extend(existing_bids[existing_end:])
+    return bids, deleted, created
+
+
+def parse_bid_entries(bids):
+    return [(str(bid['bidder']), Decimal(str(bid['bid'])), bool(bid['buy_now_bid']))
+            for bid in bids]
+
+
+@require_POST
+@permission_required('artshow.is_artshow_staff')
+def save_all_bids(request):
+    """Save the bids for many pieces at once.
+
+    The request body is {"pieces": [{"artist_id": 1, "piece_id": 2,
+    "location": "A1", "bids": [...]}, ...]}, with the bids in the same form as
+    posted to bids(). The response has one result per piece, in the same
+    order, holding either its saved bids or an error. Pieces with errors are
+    left unchanged, and the rest are saved."""
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        submitted = [(int(item['artist_id']), int(item['piece_id']),
+                      str(item['location']).upper(), parse_bid_entries(item['bids']))
+                     for item in data['pieces']]
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        return JsonResponse({'error': error_dict('pieces', 'Invalid request')}, status=400)
+
+    # Lock the pieces and their bids before reading them, as set_bids() does.
+    with transaction.atomic():
+        keys = Q(pk__in=[])
+        for artist_id, piece_id, location, entries in submitted:
+            keys |= Q(artist__artistid=artist_id, pieceid=piece_id)
+        pieces = {(piece.artist.artistid, piece.pieceid): piece
+                  for piece in Piece.objects.filter(keys).select_related('artist')
+                  .select_for_update(of=('self',))}
+        artist_ids = set(Artist.objects.filter(
+            artistid__in={artist_id for artist_id, *rest in submitted}).values_list('artistid', flat=True))
+        bidderids = BidderId.objects.select_related('bidder').in_bulk(
+            {bidder for *rest, entries in submitted for bidder, amount, buy_now_bid in entries})
+        existing = {}
+        for bid in Bid.objects.filter(piece__in=pieces.values(), invalid=False) \
+                .select_for_update().order_by('amount'):
+            existing.setdefault(bid.piece_id, []).append(bid)
+
+        now = timezone.now()
+        results = []
+        seen = set()
+        to_delete, to_create, updated_pieces = [], [], []
+        for artist_id, piece_id, location, entries in submitted:
+            piece = pieces.get((artist_id, piece_id))
+            try:
+                if piece is None:
+                    if artist_id in artist_ids:
+                        raise BidEntryError('piece_id', 'Invalid piece ID')
+                    raise BidEntryError('artist_id', 'Invalid artist ID')
+                if piece.pk in seen:
+                    raise BidEntryError('piece_id', 'Piece entered more than once')
+                seen.add(piece.pk)
+
+                # Update the piece first so that it is marked as In Show.
+                old_location, old_status = piece.location, piece.status
+                piece.location = location
+                piece.update_status_from_location()
                 try:
-                    bidderid = BidderId.objects.get(id=bids[i]['bidder'])
-                except BidderId.DoesNotExist:
-                    return error_response('bidder', 'Invalid bidder ID', i)
-
-                if not bidderid.bidder:
-                    return error_response('bidder', 'Unassigned bidder ID', i)
-
-                amount = Decimal(bids[i]['bid'])
-                buy_now_bid = bool(bids[i]['buy_now_bid'])
-
-                if i < len(existing_bids):
-                    # Skip this bid if it is unchanged. Otherwise delete it and
-                    # all following bids so that the new set can be
-                    # re-validated.
-                    existing_bid = existing_bids[i]
-                    if existing_bid.bidderid is bidderid and \
-                       existing_bid.amount == amount and \
-                       existing_bid.but_now_bid == buy_now_bid:
-                        continue  # Next bid
-                    else:
-                        for j in range(i, len(existing_bids)):
-                            existing_bids[j].delete()
-                        existing_bids = existing_bids[:i]
-
-                new_bid = Bid(piece=piece,
-                              bidder=bidderid.bidder,
-                              bidderid=bidderid,
-                              amount=amount,
-                              buy_now_bid=buy_now_bid)
-                new_bid.validate()
-                new_bid.save()
-
-            # Handle bids that have been deleted.
-            for i in range(len(bids), len(existing_bids)):
-                existing_bids[i].delete()
+                    deleted, created, bids = plan_bids(piece, existing.get(piece.pk, []), entries, bidderids)
+                except BidEntryError:
+                    piece.location, piece.status = old_location, old_status
+                    raise
+            except BidEntryError as e:
+                results.append({'error': e.error})
+                continue
 
-        return get_bids(piece)
-    except ValidationError as e:
-        return error_response('bid', e.message, i)
+            piece.bids_updated = now
+            piece.updated = now
+            updated_pieces.append(piece)
+            to_delete.extend(deleted)
+            to_create.extend(created)
+            results.append(bids_dict(piece, bids))
+
+        if updated_pieces:
+            # bulk_update() does not set auto_now fields itself.
+            Piece.objects.bulk_update(updated_pieces, ['location', 'status', 'bids_updated', 'updated'])
+        if to_delete:
+            Bid.objects.filter(pk__in=[bid.pk for bid in to_delete]).bulk_delete()
+        if to_create:
+            Bid.objects.bulk_create(to_create)
+
+    return JsonResponse({'results': results})
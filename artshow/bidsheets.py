@@ -1,33 +1,45 @@
 #! /usr/bin/env python
 
 from .conf import settings
-from .models import Piece
+from .models import Artist, Piece
+from .profiling import timer
 
 preprint = __import__(settings.ARTSHOW_PREPRINT_MODULE, globals(), locals(),
                       ['bid_sheets', 'control_forms', 'piece_stickers', 'mailing_labels'])
 
 
+@timer('pdf')
 def generate_bidsheets_for_artists(output, artists):
     pieces = Piece.objects.filter(artist__in=artists).order_by('artist__artistid', 'pieceid')
     preprint.bid_sheets(pieces, output)
 
 
+@timer('pdf')
 def generate_bidsheets(output, pieces):
     preprint.bid_sheets(pieces, output)
 
 
+@timer('pdf')
 def generate_mailing_labels(output, artists):
     preprint.mailing_labels(artists, output)
 
 
+def render_mailing_labels(output, artist_ids):
+    artists = Artist.objects.filter(artistid__in=artist_ids).order_by('artistid').select_related('person')
+    generate_mailing_labels(output, artists)
+
+
+@timer('pdf')
 def generate_control_forms(output, artists):
     pieces = Piece.objects.filter(artist__in=artists).order_by('artist__artistid', 'pieceid')
     preprint.control_forms(pieces, output)
 
 
+@timer('pdf')
 def generate_control_forms_for_pieces(output, pieces):
     preprint.control_forms(pieces, output)
 
 
+@timer('pdf')
 def generate_piece_stickers(output, pieces):
     preprint.piece_stickers(pieces, output)
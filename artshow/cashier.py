@@ -11,7 +11,6 @@ from .models import (
     SquareTerminal
 )
 from django import forms
-from django.db.models import Q
 from django.forms import ModelForm
 from .conf import settings
 from django.core.exceptions import ValidationError
@@ -52,9 +51,7 @@ def cashier(request):
         form = BidderSearchForm(request.POST)
         if form.is_valid():
             text = form.cleaned_data['text']
-            bidders = Bidder.objects.filter(Q(person__name__icontains=text)
-                                            | Q(person__reg_id__icontains=text)
-                                            | Q(bidderid__id=text)).distinct()
+            bidders = Bidder.search(text).select_related('person').prefetch_related('bidderid_set')
             search_executed = True
         else:
             bidders = []
@@ -95,7 +92,9 @@ class SelectPieceForm (forms.Form):
 @permission_required('artshow.add_invoice')
 def cashier_bidder(request, bidder_id):
 
-    bidder = get_object_or_404(Bidder, pk=bidder_id)
+    bidder = get_object_or_404(
+        Bidder.objects.select_related('person').prefetch_related('bidderid_set'),
+        pk=bidder_id)
 
     all_bids = bidder.top_bids(unsold_only=True)
     available_bids = []
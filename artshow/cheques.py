@@ -4,11 +4,15 @@
 # See file COPYING for licence details
 
 from decimal import Decimal
+from io import StringIO
 
 from .conf import settings
 
 from num2words import num2words
 from .email1 import wrap
+from .models import ChequePayment
+from .profiling import timer
+from .text2pdf import text_to_pdf
 
 
 class PRINT_GRID:
@@ -41,7 +45,7 @@ def dotpad(s, max_length):
     if length >= max_length:
         return s
     s += " " * ((max_length - length) % 4)
-    s += "  .." * ((max_length - length) / 4)
+    s += "  .." * ((max_length - length) // 4)
     return s
 
 
@@ -117,3 +121,13 @@ def print_items(cheque, grid, offset, payee_side):
         grid.print_on_next_line("")
         grid.print_on_next_line("Signature: _____________________________________________ Date: __________")
         grid.print_on_next_line("I have received this cheque and agree to return any amount paid in error.")
+
+
+@timer('pdf')
+def render_cheques_pdf(output, cheque_ids):
+    cheques = ChequePayment.objects.filter(pk__in=cheque_ids).order_by('date', 'number', 'id') \
+        .select_related('artist__person')
+    text = StringIO()
+    for cheque in cheques:
+        cheque_to_text(cheque, text)
+    text_to_pdf(text.getvalue(), output, lines_per_page=PRINT_GRID.y_size)
@@ -5,6 +5,9 @@ have been set to the _UNCONFIGURED object, which will be checked during
 startup of the artshow application. _DISABLED is to leave a non-critical
 feature disabled"""
 
+import os
+import tempfile
+
 from appconf import AppConf
 from django.conf import settings  # noqa: F401
 
@@ -27,8 +30,15 @@ class ArtshowAppConf(AppConf):
     PERSON_CLASS = "peeps.Person"
 
     # name of the module used to print forms, in python path format
+    # Use "artshow.preprint" to render forms as PDFs on the server.
     PREPRINT_MODULE = "artshow.preprint_dummy"
 
+    # Number of processes used by artshow.preprint to render large print
+    # runs, and the number of pages each process renders at a time. "None"
+    # uses one process per CPU.
+    PREPRINT_WORKERS = None
+    PREPRINT_CHUNK_SIZE = 250
+
     SHOW_NAME = "Generic Art Show"
     SHOW_YEAR = "1999"
     TAX_RATE = "0.10"  # Used to initialise a Decimal object
@@ -93,3 +103,52 @@ class ArtshowAppConf(AppConf):
 
     # Print Cheques as PDF instead of plain text.
     CHEQUES_AS_PDF = False
+
+    # Number of artists whose closing payments are applied per transaction
+    # by the close show task.
+    CLOSE_SHOW_BATCH_SIZE = 100
+
+    # Seconds a running close show task can go without making progress
+    # before it is taken to have failed, and the show can be closed again.
+    CLOSE_SHOW_STALE_AFTER = 30 * 60
+
+    # Number of bidders messaged by each bulk messaging task. Each batch is
+    # sent over one mail connection, and at most one batch is sent per
+    # second, so keep this below the mail provider's per-second send limit.
+    MESSAGING_BATCH_SIZE = 10
+
+    # Seconds that a bidder's results page is cached for. Cached results are
+    # also invalidated whenever a piece they bid on changes.
+    RESULTS_CACHE_TIMEOUT = 60 * 60
+
+    # Directory where rendered PDFs are kept, named by the SHA-256 of their
+    # contents. Anything here can be regenerated, so it is safe to clear.
+    PDF_ARTIFACT_ROOT = os.path.join(tempfile.gettempdir(), 'artshow-pdf-artifacts')
+
+    # Times a webhook that fails is tried again before later webhooks with
+    # the same ordering key are held behind it, and the seconds before the
+    # first retry, doubling after each.
+    WEBHOOK_RETRIES = 5
+    WEBHOOK_RETRY_DELAY = 10
+
+    # Telegram Bot API server. Only needs changing to use a local Bot API
+    # server, or a stub in tests.
+    TELEGRAM_API_URL = 'https://api.telegram.org'
+
+    # Telegram messages sent per second in total, and to any one chat.
+    # Telegram's limits are about 30 and 1. With a Redis or Memcached cache
+    # these hold across every process sending messages, and otherwise for each
+    # process.
+    TELEGRAM_RATE_LIMIT = 30
+    TELEGRAM_CHAT_RATE_LIMIT = 1
+
+    # Number of bidders messaged by each bulk Telegram messaging task.
+    TELEGRAM_BATCH_SIZE = 100
+
+    # Number of request profiles kept for the profiling page, when the
+    # profiling middleware is enabled.
+    PROFILING_BUFFER_SIZE = 200
+
+    # Seconds between the snapshots of the show summary kept for its
+    # history. Snapshots are only taken while the summary is being viewed.
+    SUMMARY_SNAPSHOT_INTERVAL = 15 * 60
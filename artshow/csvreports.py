@@ -2,20 +2,69 @@
 # Copyright (C) 2009-2012 Chris Cogdon
 # See file COPYING for licence details
 
+from decimal import Decimal
+
 from . import unicodewriter
 from artshow.utils import format_money
-from django.http import HttpResponse
+from django.db.models import F, OuterRef, Subquery
+from django.http import StreamingHttpResponse
 from django.contrib.auth.decorators import permission_required
 from .models import (
-    Artist, Bid, Bidder, Checkoff, ChequePayment, Payment, Piece, Space
+    Artist, Bidder, BidderId, Checkoff, ChequePayment, Location, Payment, Piece, Space
 )
 
 
+# Number of rows fetched from the database at a time while streaming.
+CHUNK_SIZE = 500
+
+
+class Echo:
+    """File-like object that hands back whatever is written to it, so that a
+    CSV writer can be used to format rows for a streaming response."""
+
+    def write(self, value):
+        return value
+
+
+def csv_response(filename, field_names, rows):
+    writer = unicodewriter.UnicodeDictWriter(Echo(), field_names)
+
+    def generate():
+        yield writer.writerow({n: n for n in field_names})
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(generate(), content_type="text/csv")
+    response['Content-Disposition'] = "attachment; filename=%s" % filename
+    return response
+
+
+def allocated_spaces():
+    """Return a map of artist ID to the number of spaces of each type that
+    have been allocated to them through assigned locations."""
+    allocated = {}
+
+    def add_location(artist_id, location):
+        size = Decimal(0.5 if location.space_is_split or location.half_space else 1.0)
+        artist_spaces = allocated.setdefault(artist_id, {})
+        shortname = location.type.shortname
+        artist_spaces[shortname] = artist_spaces.get(shortname, Decimal(0)) + size
+
+    for location in Location.objects.select_related('type'):
+        if location.artist_1_id is not None:
+            add_location(location.artist_1_id, location)
+        if location.artist_2_id is not None:
+            add_location(location.artist_2_id, location)
+
+    return allocated
+
+
 @permission_required('artshow.view_artist')
 def artists(request):
     # TODO - This depends on the Person structure, which we want to move out into the model itself.
 
-    artists = Artist.objects.all().order_by('artistid')
+    artists = Artist.objects.all().order_by('artistid').select_related('person').prefetch_related(
+        'agent_set__person', 'allocation_set__space', 'checkoffs')
     spaces = Space.objects.all()
     checkoffs = Checkoff.objects.all()
 
@@ -29,76 +78,94 @@ def artists(request):
     for checkoff in checkoffs:
         field_names += ['chk-' + checkoff.shortname]
 
-    field_names_d = {}
-    for n in field_names:
-        field_names_d[n] = n
-
-    response = HttpResponse(content_type="text/csv")
-    response['Content-Disposition'] = "attachment; filename=artists.csv"
-    c = unicodewriter.UnicodeDictWriter(response, field_names)
-    c.writerow(field_names_d)
-
-    for a in artists:
-        d = dict(artistid=a.artistid, name=a.person.name, address1=a.person.address1, address2=a.person.address2,
-                 city=a.person.city, state=a.person.state,
-                 postcode=a.person.postcode, country=a.person.country, phone=a.person.phone, email=a.person.email,
-                 regid=a.person.reg_id, artistname=a.artistname(),
-                 website=a.website, mailin=a.mailin and "Yes" or "No",
-                 agent=", ".join([ag.person.name for ag in a.agent_set.all()]),
-                 reservationdate=str(a.reservationdate))
-        for alloc in a.allocation_set.all():
-            d['req-' + alloc.space.shortname] = str(alloc.requested)
-            d['alloc-' + alloc.space.shortname] = str(alloc.allocated)
-        for checkoff in a.checkoffs.all():
-            d['chk-' + checkoff.shortname] = checkoff.shortname
-        c.writerow(d)
-
-    return response
+    def rows():
+        allocated = allocated_spaces()
+        for a in artists.iterator(chunk_size=CHUNK_SIZE):
+            d = dict(artistid=a.artistid, name=a.person.name, address1=a.person.address1, address2=a.person.address2,
+                     city=a.person.city, state=a.person.state,
+                     postcode=a.person.postcode, country=a.person.country, phone=a.person.phone, email=a.person.email,
+                     regid=a.person.reg_id, artistname=a.artistname(),
+                     website=a.website, mailin=a.mailin and "Yes" or "No",
+                     agent=", ".join([ag.person.name for ag in a.agent_set.all()]),
+                     reservationdate=str(a.reservationdate))
+            for alloc in a.allocation_set.all():
+                d['req-' + alloc.space.shortname] = str(alloc.requested)
+            for shortname, spaces_allocated in allocated.get(a.artistid, {}).items():
+                d['alloc-' + shortname] = str(spaces_allocated)
+            for checkoff in a.checkoffs.all():
+                d['chk-' + checkoff.shortname] = checkoff.shortname
+            yield d
+
+    return csv_response("artists.csv", field_names, rows())
 
 
 # noinspection PyUnusedLocal
 @permission_required('artshow.view_piece')
 def pieces(request):
-    pieces = Piece.objects.all().order_by('artist__artistid', 'pieceid')
+    pieces = Piece.objects.all().order_by('artist__artistid', 'pieceid') \
+        .select_related('artist__person', 'top_bidder__person') \
+        .prefetch_related('top_bidder__bidderid_set')
 
     field_names = ['artistid', 'pieceid', 'code', 'artistname', 'title', 'media', 'min_bid', 'buy_now', 'adult',
                    'not_for_sale', 'status', 'top_bid', 'bought_now', 'voice_auction', 'bidder_name', 'bidder_ids']
 
-    field_names_d = {}
-    for n in field_names:
-        field_names_d[n] = n
-
-    response = HttpResponse(content_type="text/csv")
-    response['Content-Disposition'] = "attachment; filename=pieces.csv"
-    c = unicodewriter.UnicodeDictWriter(response, field_names)
-    c.writerow(field_names_d)
-
-    for p in pieces:
-        try:
-            top_bid = p.top_bid()
-        except Bid.DoesNotExist:
-            top_bid = None
-        d = {
-            'artistid': p.artist.artistid,
-            'pieceid': p.pieceid,
-            'code': p.code,
-            'artistname': p.artistname(),
-            'title': p.title(),
-            'media': p.media,
-            'min_bid': p.min_bid,
-            'buy_now': p.buy_now,
-            'adult': p.adult and "Yes" or "No",
-            'not_for_sale': p.not_for_sale and "Yes" or "No",
-            'status': p.get_status_display(),
-            'top_bid': top_bid and top_bid.amount or "",
-            'bought_now': top_bid and (top_bid.buy_now_bid and "Yes" or "No") or "",
-            'voice_auction': p.voice_auction and "Yes" or "No",
-            'bidder_name': top_bid and top_bid.bidder.name or "",
-            'bidder_ids': top_bid and (", ".join(top_bid.bidder.bidder_ids()) or ""),
-        }
-        c.writerow(d)
+    def rows():
+        for p in pieces.iterator(chunk_size=CHUNK_SIZE):
+            top_bidder = p.top_bidder
+            d = {
+                'artistid': p.artist.artistid,
+                'pieceid': p.pieceid,
+                'code': p.code,
+                'artistname': p.artistname(),
+                'title': p.title(),
+                'media': p.media,
+                'min_bid': p.min_bid,
+                'buy_now': p.buy_now,
+                'adult': p.adult and "Yes" or "No",
+                'not_for_sale': p.not_for_sale and "Yes" or "No",
+                'status': p.get_status_display(),
+                'top_bid': p.top_bid_amount or "",
+                'bought_now': top_bidder and (p.top_bid_is_buy_now and "Yes" or "No") or "",
+                'voice_auction': p.voice_auction and "Yes" or "No",
+                'bidder_name': top_bidder and top_bidder.name() or "",
+                'bidder_ids': top_bidder and ", ".join(top_bidder.bidder_ids()) or "",
+            }
+            yield d
+
+    return csv_response("pieces.csv", field_names, rows())
 
-    return response
+
+# noinspection PyUnusedLocal
+@permission_required('artshow.is_artshow_staff')
+def winning_bidders(request):
+    """The winning bidders report, one row for each winning bid, in the same
+    order as the report page."""
+    bidder_ids = {}
+    for bidder, bidder_id in BidderId.objects.filter(bidder__isnull=False) \
+            .order_by('id').values_list('bidder', 'id'):
+        bidder_ids.setdefault(bidder, []).append(bidder_id)
+
+    first_bidder_id = BidderId.objects.filter(bidder=OuterRef('top_bidder')).order_by('id').values('id')[:1]
+    pieces = Piece.objects.filter(top_bidder__isnull=False) \
+        .select_related('artist__person', 'top_bidder__person') \
+        .annotate(first_bidder_id=Subquery(first_bidder_id)) \
+        .order_by(F('first_bidder_id').asc(nulls_last=True), 'top_bidder', 'artist', 'pieceid')
+
+    field_names = ['bidder_ids', 'bidder_name', 'code', 'artistname', 'title', 'amount', 'voice_auction']
+
+    def rows():
+        for p in pieces.iterator(chunk_size=CHUNK_SIZE):
+            yield {
+                'bidder_ids': ", ".join(bidder_ids.get(p.top_bidder_id, [])),
+                'bidder_name': p.top_bidder.name(),
+                'code': p.code,
+                'artistname': p.artistname(),
+                'title': p.title(),
+                'amount': p.top_bid_amount,
+                'voice_auction': p.voice_auction and "Yes" or "No",
+            }
+
+    return csv_response("winning-bidders.csv", field_names, rows())
 
 
 # noinspection PyUnusedLocal
@@ -106,82 +173,56 @@ def pieces(request):
 def bidders(request):
     # TODO - This depends on the Person structure, which we want to move out into the model itself.
 
-    bidders = Bidder.objects.all()
+    bidders = Bidder.objects.all().order_by('pk').select_related('person').prefetch_related('bidderid_set')
 
     field_names = ['primary_bidder_id', 'bidder_ids', 'name', 'address1', 'address2', 'city', 'state', 'postcode',
                    'country', 'phone', 'email', 'regid']
 
-    field_names_d = {}
-    for n in field_names:
-        field_names_d[n] = n
-
-    response = HttpResponse(content_type="text/csv")
-    response['Content-Disposition'] = "attachment; filename=bidders.csv"
-    c = unicodewriter.UnicodeDictWriter(response, field_names)
-    c.writerow(field_names_d)
-
-    for b in bidders:
-        bidder_ids = b.bidder_ids()
-        if bidder_ids:
-            primary_bidder_id = bidder_ids[0]
-        else:
-            primary_bidder_id = ""
-        d = dict(primary_bidder_id=primary_bidder_id,
-                 bidder_ids=", ".join(bidder_ids),
-                 name=b.person.name, address1=b.person.address1, address2=b.person.address2, city=b.person.city,
-                 state=b.person.state,
-                 postcode=b.person.postcode, country=b.person.country, phone=b.person.phone, email=b.person.email,
-                 regid=b.person.reg_id)
-        c.writerow(d)
+    def rows():
+        for b in bidders.iterator(chunk_size=CHUNK_SIZE):
+            bidder_ids = b.bidder_ids()
+            if bidder_ids:
+                primary_bidder_id = bidder_ids[0]
+            else:
+                primary_bidder_id = ""
+            d = dict(primary_bidder_id=primary_bidder_id,
+                     bidder_ids=", ".join(bidder_ids),
+                     name=b.person.name, address1=b.person.address1, address2=b.person.address2, city=b.person.city,
+                     state=b.person.state,
+                     postcode=b.person.postcode, country=b.person.country, phone=b.person.phone, email=b.person.email,
+                     regid=b.person.reg_id)
+            yield d
 
-    return response
+    return csv_response("bidders.csv", field_names, rows())
 
 
 # noinspection PyUnusedLocal
 @permission_required('artshow.view_payment')
 def payments(request):
-    payments = Payment.objects.all().order_by('id')
+    payments = Payment.objects.all().order_by('id').select_related('artist__person', 'payment_type')
 
     field_names = ['paymentid', 'artistid', 'name', 'artistname', 'date', 'type', 'description', 'amount']
 
-    field_names_d = {}
-    for n in field_names:
-        field_names_d[n] = n
-
-    response = HttpResponse(content_type="text/csv")
-    response['Content-Disposition'] = "attachment; filename=payments.csv"
-    c = unicodewriter.UnicodeDictWriter(response, field_names)
-    c.writerow(field_names_d)
+    def rows():
+        for p in payments.iterator(chunk_size=CHUNK_SIZE):
+            yield dict(
+                paymentid=p.id, artistid=p.artist.artistid, name=p.artist.name(), artistname=p.artist.artistname(),
+                date=p.date, type=p.payment_type.name, description=p.description, amount=p.amount)
 
-    for p in payments:
-        d = dict(
-            paymentid=p.id, artistid=p.artist.artistid, name=p.artist.name(), artistname=p.artist.artistname(),
-            date=p.date, type=p.payment_type.name, description=p.description, amount=p.amount)
-        c.writerow(d)
-
-    return response
+    return csv_response("payments.csv", field_names, rows())
 
 
 # noinspection PyUnusedLocal
 @permission_required('artshow.view_cheque')
 def cheques(request):
-    cheques = ChequePayment.objects.all().order_by('date', 'number', 'id')
+    cheques = ChequePayment.objects.all().order_by('date', 'number', 'id').select_related('artist__person')
 
     field_names = ['artistid', 'name', 'artistname', 'payee', 'date', 'number', 'amount']
 
-    field_names_d = {}
-    for n in field_names:
-        field_names_d[n] = n
+    def rows():
+        for q in cheques.iterator(chunk_size=CHUNK_SIZE):
+            yield dict(
+                artistid=q.artist.artistid, name=q.artist.name(), artistname=q.artist.artistname(),
+                payee=q.payee, date=q.date, number=q.number, amount=format_money(-q.amount))
 
-    response = HttpResponse(content_type="text/csv")
-    response['Content-Disposition'] = "attachment; filename=cheques.csv"
-    c = unicodewriter.UnicodeDictWriter(response, field_names)
-    c.writerow(field_names_d)
-
-    for q in cheques:
-        d = dict(
-            artistid=q.artist.artistid, name=q.artist.name(), artistname=q.artist.artistname(),
-            payee=q.payee, date=q.date, number=q.number, amount=format_money(-q.amount))
-        c.writerow(d)
-
-    return response
+    return csv_response("cheques.csv", field_names, rows())
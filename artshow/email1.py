@@ -3,52 +3,102 @@
 # Copyright (C) 2009, 2010 Chris Cogdon
 # See file COPYING for licence details
 
+import functools
+import re
+
+from django.db.models import Prefetch
 from django.template import Template, Context
 from .utils import artshow_settings
-from .models import Piece
+from .models import Payment, Piece
 
 default_wrap_cols = 79
 
+# The number of compiled e-mail templates kept by compile_template().
+TEMPLATE_CACHE_SIZE = 32
+
+
+_non_space_re = re.compile(r'\S')
+
 
 def wrap(text, cols=default_wrap_cols, always_wrap=False):
+    if not always_wrap and not text.startswith('.') and '\n.' not in text:
+        return text
     old_lines = text.split("\n")
     new_lines = []
     for line in old_lines:
         if always_wrap or line.startswith('.'):
             if not always_wrap:
                 line = line[1:]
-            while len(line) > cols:
-                pos = line.rfind(" ", 0, cols)
-                if pos == -1:
-                    pos = line.find(" ", cols)
-                if pos == -1:
-                    break
-                new_lines.append(line[:pos].rstrip())
-                line = line[pos:].lstrip()
+            if len(line) > cols:
+                wrap_line(line, cols, new_lines)
+                continue
         new_lines.append(line)
     return "\n".join(new_lines)
 
 
-def make_email(artist_obj, template_str, signature, cols=default_wrap_cols, autoescape=False):
-    pieces_in_show = artist_obj.piece_set.exclude(status=Piece.StatusNotInShow)
-    payments = artist_obj.payment_set.all().order_by('date')
-    c = {
+def wrap_line(line, cols, new_lines):
+    # Works along the line rather than slicing off what has been wrapped,
+    # which copied the rest of the line for every line produced.
+    start = 0
+    while len(line) - start > cols:
+        pos = line.rfind(" ", start, start + cols)
+        if pos == -1:
+            pos = line.find(" ", start + cols)
+        if pos == -1:
+            break
+        new_lines.append(line[start:pos].rstrip())
+        match = _non_space_re.search(line, pos)
+        start = match.start() if match else len(line)
+    new_lines.append(line[start:])
+
+
+def prefetch_artists(queryset):
+    """Load everything make_email() needs for the artists in queryset, in
+    three queries for all of them."""
+    return queryset.select_related('person').prefetch_related(
+        Prefetch('piece_set', queryset=Piece.objects.exclude(status=Piece.StatusNotInShow),
+                 to_attr='pieces_in_show'),
+        Prefetch('payment_set', queryset=Payment.objects.order_by('date'), to_attr='payments_by_date'),
+    )
+
+
+def artist_context(artist_obj, signature):
+    if hasattr(artist_obj, 'pieces_in_show'):
+        pieces_in_show = artist_obj.pieces_in_show
+        payments = artist_obj.payments_by_date
+    else:
+        pieces_in_show = artist_obj.piece_set.exclude(status=Piece.StatusNotInShow)
+        payments = artist_obj.payment_set.all().order_by('date')
+    return {
         'artist': artist_obj,
         'pieces_in_show': pieces_in_show,
         'payments': payments,
         'artshow_settings': artshow_settings,
         'signature': signature,
     }
-    return make_email2(c, template_str, cols, autoescape)
 
 
-def make_email2(context, template_str, cols=default_wrap_cols, autoescape=False):
+def make_email(artist_obj, template_str, signature, cols=default_wrap_cols, autoescape=False):
+    return make_email2(artist_context(artist_obj, signature), template_str, cols, autoescape)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(template_str, autoescape=False):
+    """Compile an e-mail template, so that it can be rendered for many
+    recipients with render_email(). The most recently used templates are
+    kept, keyed by their text, so an edited template is compiled again."""
     if not autoescape:
         template_str = "{% autoescape off %}" + template_str + "{% endautoescape %}"
+    return Template(template_str)
+
+
+def render_email(template, context, cols=default_wrap_cols):
     context = dict(context)
     context.update({'artshow_settings': artshow_settings})
-    t = Template(template_str)
-    c = Context(context)
-    new_str = t.render(c)
+    new_str = template.render(Context(context))
     new_str = wrap(new_str, cols)
     return new_str
+
+
+def make_email2(context, template_str, cols=default_wrap_cols, autoescape=False):
+    return render_email(compile_template(template_str, autoescape), context, cols)
@@ -7,4 +7,4 @@ class BidderLookup(LookupChannel):
     model = Bidder
 
     def get_query(self, q, request):
-        return self.model.objects.filter(person__name__icontains=q).order_by('person__name')
+        return self.model.search(q).select_related('person')
@@ -0,0 +1,49 @@
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from ...pdfreports import BID_ENTRY_ROWS_PER_PAGE, bid_entry_rows, bid_entry_to_pdf
+from ...models import Piece
+
+
+class Command(BaseCommand):
+    help = "Measure the time and memory needed to render the bid entry worksheet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pieces", type=int, default=10000,
+            help="Number of synthetic pieces to render [%(default)s]")
+        parser.add_argument(
+            "--database", action="store_true",
+            help="Render the pieces in the database instead of synthetic pieces")
+
+    def handle(self, *args, **options):
+        if options['database']:
+            count = Piece.objects.count()
+        else:
+            count = options['pieces']
+
+        def rows():
+            if options['database']:
+                return bid_entry_rows(Piece.objects.order_by('location', 'artist__artistid', 'pieceid'))
+            return (("%s%d" % ("ABCDEFGH"[i % 8], i % 50),
+                     "Benchmark Artist With A Longer Name %d" % (i // 20),
+                     "A piece with a title long enough that it needs truncating, number %d" % i,
+                     "%d-%d" % (i // 20, i % 20)) for i in range(count))
+
+        output = BytesIO()
+        start = time.perf_counter()
+        bid_entry_to_pdf(rows(), output)
+        elapsed = time.perf_counter() - start
+
+        # Measure memory on a second run, as tracing slows rendering down.
+        tracemalloc.start()
+        bid_entry_to_pdf(rows(), BytesIO())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        pages = max(1, -(-count // BID_ENTRY_ROWS_PER_PAGE))
+        self.stdout.write("%d pieces, %d pages in %.2fs, %.1f pages/sec, peak memory %.1f MiB, %d bytes" % (
+            count, pages, elapsed, pages / elapsed, peak / 1024 / 1024, len(output.getvalue())))
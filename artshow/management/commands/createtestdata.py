@@ -11,6 +11,12 @@ class Command(BaseCommand):
             "--email",
             type=str,
             help="Email address for users")
+        parser.add_argument(
+            "--artists", type=int, default=99,
+            help="Number of artists to create [%(default)s]")
+        parser.add_argument(
+            "--bidders", type=int, default=500,
+            help="Number of bidders to create [%(default)s]")
         parser.add_argument(
             "--voice-auction",
             action="store_true",
@@ -18,7 +24,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         if options['email']:
-            testdata.create(options['email'])
+            testdata.create(options['email'], num_artists=options['artists'], num_bidders=options['bidders'])
             self.stdout.write(self.style.SUCCESS("Created test data."))
         if options['voice_auction']:
             testdata.voice_auction()
@@ -0,0 +1,51 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from ... import email1
+
+TEMPLATE = """Dear {{ artist.person.name }},
+
+.Thank you for exhibiting in the art show. This message lists the pieces you have in the show and the payments that have been made to or from you, so that you can check them before the show closes and let us know about any mistakes.
+
+{% for piece in pieces_in_show %}{{ piece.code }} "{{ piece.name }}" - {% if piece.top_bid_amount %}${{ piece.top_bid_amount }}{% else %}no bids{% endif %}
+{% endfor %}
+{% for payment in payments %}{{ payment.date }} {{ payment.payment_type }} ${{ payment.amount }}
+{% endfor %}
+.{{ signature }}
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure how long it takes to render an artist e-mail template"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--messages", type=int, default=1000,
+            help="Number of messages to render [%(default)s]")
+        parser.add_argument(
+            "--pieces", type=int, default=20,
+            help="Number of pieces listed in each message [%(default)s]")
+
+    def handle(self, *args, **options):
+        contexts = [{
+            'artist': {'person': {'name': 'Benchmark Artist %d' % i}},
+            'pieces_in_show': [{
+                'code': '%d-%d' % (i, j),
+                'name': 'A piece with a reasonably long title, number %d' % j,
+                'top_bid_amount': Decimal(10 * j) if j % 3 else None,
+            } for j in range(1, options['pieces'] + 1)],
+            'payments': [{'date': '2026-01-01', 'payment_type': 'Space Fee', 'amount': Decimal('-25.00')}],
+            'signature': 'The Art Show team, who would like to remind you that pick up closes at 2pm on Sunday.',
+        } for i in range(options['messages'])]
+
+        compile_uncached = email1.compile_template.__wrapped__
+        for name, compile_template in (("uncached", compile_uncached), ("cached", email1.compile_template)):
+            email1.compile_template.cache_clear()
+            start = time.perf_counter()
+            for context in contexts:
+                email1.render_email(compile_template(TEMPLATE), context)
+            elapsed = time.perf_counter() - start
+            self.stdout.write("%s: %d messages in %.2fs, %.1f us/message" % (
+                name, len(contexts), elapsed, elapsed / len(contexts) * 1000000))
@@ -0,0 +1,54 @@
+import os
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import preprint
+from ...conf import settings
+
+
+class Command(BaseCommand):
+    help = "Measure how many bid sheet pages per second the preprint module renders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pages", type=int, default=4000,
+            help="Number of bid sheets to render [%(default)s]")
+        parser.add_argument(
+            "--workers", type=int, action="append",
+            help="Number of processes to use. May be given more than once. "
+                 "Defaults to 1 and the ARTSHOW_PREPRINT_WORKERS setting")
+        parser.add_argument(
+            "--chunk-size", type=int,
+            help="Pages rendered by a process at a time [ARTSHOW_PREPRINT_CHUNK_SIZE]")
+        parser.add_argument(
+            "--blank",
+            help="Blank bid sheet to render over [ARTSHOW_BLANK_BID_SHEET]")
+
+    def handle(self, *args, **options):
+        blank_path = options['blank'] or settings.ARTSHOW_BLANK_BID_SHEET
+        if not os.path.exists(blank_path):
+            raise CommandError("Blank bid sheet %s does not exist." % blank_path)
+
+        pages = [{
+            'code': 'A%03d' % (i % 1000),
+            'barcode': '*A%03d*' % (i % 1000),
+            'artist': 'Benchmark Artist %d' % (i // 25),
+            'title': 'A piece with a reasonably long title, number %d' % i,
+            'media': 'Oil on canvas',
+            'min_bid': 'Minimum Bid: $100',
+            'buy_now': 'Auto Buy: $1,000' if i % 3 else 'Auto Buy: N/A',
+            'rights': 'This sale does not include reproduction rights.',
+        } for i in range(options['pages'])]
+
+        worker_counts = options['workers'] or sorted({1, settings.ARTSHOW_PREPRINT_WORKERS or os.cpu_count() or 1})
+        for workers in worker_counts:
+            output = BytesIO()
+            start = time.perf_counter()
+            preprint.render('bid_sheets', pages, output, blank_path=blank_path, workers=workers,
+                            chunk_size=options['chunk_size'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write("%d worker%s: %d pages in %.2fs, %.1f pages/sec, %d bytes" % (
+                workers, workers != 1 and "s" or "", len(pages), elapsed, len(pages) / elapsed,
+                len(output.getvalue())))
@@ -0,0 +1,22 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from peeps.search import index_people
+
+from ...conf import settings
+from ...models import BidderId
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search index of people and bidder IDs, such as after people were bulk imported"
+
+    def handle(self, *args, **options):
+        Person = apps.get_model(settings.ARTSHOW_PERSON_CLASS)
+        with transaction.atomic():
+            people = list(Person.objects.all())
+            index_people(people)
+            bidder_ids = list(BidderId.objects.filter(bidder__isnull=False))
+            BidderId.index(bidder_ids)
+        self.stdout.write(self.style.SUCCESS("Indexed %d people and %d bidder IDs." % (
+            len(people), len(bidder_ids))))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...models import Bid, Piece
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized top bid columns on every piece"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report pieces whose top bid columns are out of date")
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = self.verify()
+            if mismatches:
+                raise CommandError("%d piece%s with incorrect top bid columns." % (
+                    mismatches, mismatches != 1 and "s" or ""))
+            self.stdout.write(self.style.SUCCESS("All top bid columns are correct."))
+        else:
+            with transaction.atomic():
+                count = Piece.objects.update_top_bids()
+            self.stdout.write(self.style.SUCCESS("Rebuilt top bid columns on %d pieces." % count))
+
+    def verify(self):
+        expected = {}
+        bids = Bid.objects.filter(invalid=False).order_by('piece', 'amount') \
+            .values_list('piece', 'amount', 'bidder', 'bidderid', 'buy_now_bid')
+        for piece_id, amount, bidder_id, bidderid_id, buy_now_bid in bids:
+            count = expected[piece_id][4] + 1 if piece_id in expected else 1
+            expected[piece_id] = (amount, bidder_id, bidderid_id, buy_now_bid, count)
+
+        mismatches = 0
+        pieces = Piece.objects.order_by('artist__artistid', 'pieceid').values_list(
+            'pk', 'code', 'top_bid_amount', 'top_bidder', 'top_bidderid',
+            'top_bid_is_buy_now', 'valid_bid_count')
+        for pk, code, *actual in pieces:
+            if tuple(actual) != expected.get(pk, (None, None, None, False, 0)):
+                mismatches += 1
+                self.stdout.write("%s: stored %s, expected %s" % (
+                    code, tuple(actual), expected.get(pk, (None, None, None, False, 0))))
+        return mismatches
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ... import summary
+
+
+class Command(BaseCommand):
+    help = "Recalculate the show summary statistics, reporting any that were out of date"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--snapshot", action="store_true",
+            help="Also add a snapshot of the summary to its history")
+
+    def handle(self, *args, **options):
+        differences = summary.recompute()
+        for section, key, old, new in differences:
+            self.stdout.write("%s: %s was %r, now %r" % (section, key, old, new))
+        if options['snapshot']:
+            summary.take_snapshot(summary.get_summary_statistics(snapshot=False))
+        self.stdout.write(self.style.SUCCESS("Recalculated the summary, %d value%s changed." % (
+            len(differences), len(differences) != 1 and "s" or "")))
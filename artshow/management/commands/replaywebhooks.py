@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import webhooks
+
+
+class Command(BaseCommand):
+    help = "Process failed Square or Telegram webhooks again"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "kind", choices=sorted(webhooks.MODELS),
+            help="Kind of webhook to replay")
+        parser.add_argument(
+            "ids", nargs="*", type=int,
+            help="Only replay these webhooks. Defaults to every failed webhook")
+        parser.add_argument(
+            "--list", action="store_true",
+            help="List the failed webhooks and their errors instead of replaying them")
+        parser.add_argument(
+            "--discard", action="store_true",
+            help="Mark the failed webhooks as processed without processing them, "
+                 "releasing any webhooks held behind them")
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        if options['list']:
+            for webhook in webhooks.failed(kind).order_by('pk'):
+                error = webhook.error.strip().splitlines()
+                self.stdout.write("%d %s %s: %s" % (
+                    webhook.pk, webhook.timestamp.isoformat(), webhook.ordering_key or '-',
+                    error[-1] if error else ''))
+            return
+
+        count = webhooks.replay(kind, options['ids'], discard=options['discard'])
+        if count is None:
+            raise CommandError("The %s webhooks are being drained. Try again shortly." % kind)
+        remaining = webhooks.failed(kind).count()
+        self.stdout.write(self.style.SUCCESS("%s %d webhook%s, %d still failed, %d pending." % (
+            "Discarded" if options['discard'] else "Processed", count, count != 1 and "s" or "",
+            remaining, webhooks.pending(kind).count())))
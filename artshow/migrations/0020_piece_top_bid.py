@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_top_bids(apps, schema_editor):
+    Bid = apps.get_model('artshow', 'Bid')
+    Piece = apps.get_model('artshow', 'Piece')
+    valid_bids = Bid.objects.filter(piece=OuterRef('pk'), invalid=False)
+    top_bid = valid_bids.order_by('-amount')[:1]
+    bid_count = valid_bids.order_by().values('piece').annotate(count=Count('pk')).values('count')
+    Piece.objects.update(
+        top_bid_amount=Subquery(top_bid.values('amount')),
+        top_bidder=Subquery(top_bid.values('bidder')),
+        top_bidderid=Subquery(top_bid.values('bidderid')),
+        top_bid_is_buy_now=Coalesce(Subquery(top_bid.values('buy_now_bid')), Value(False)),
+        valid_bid_count=Coalesce(Subquery(bid_count), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0019_print_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='piece',
+            name='top_bid_amount',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=0, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='piece',
+            name='top_bid_is_buy_now',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='piece',
+            name='top_bidder',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='artshow.bidder'),
+        ),
+        migrations.AddField(
+            model_name='piece',
+            name='top_bidderid',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='artshow.bidderid'),
+        ),
+        migrations.AddField(
+            model_name='piece',
+            name='valid_bid_count',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(populate_top_bids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0020_piece_top_bid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CloseShowTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('piece_won_count', models.IntegerField(default=0)),
+                ('piece_voice_auction_count', models.IntegerField(default=0)),
+                ('artist_count', models.IntegerField(default=0)),
+                ('processed_count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
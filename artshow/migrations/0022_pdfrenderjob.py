@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0021_closeshowtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfRenderJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=40)),
+                ('params', models.JSONField(default=dict)),
+                ('filename', models.CharField(max_length=100)),
+                ('cache_key', models.CharField(db_index=True, max_length=64)),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Complete'), (2, 'Failed')], default=0)),
+                ('digest', models.CharField(blank=True, help_text='SHA-256 of the rendered PDF in the artifact store', max_length=64)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
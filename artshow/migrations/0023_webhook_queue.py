@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:18
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_processed(apps, schema_editor):
+    # Webhooks received before the queue were processed as they arrived.
+    for model_name in ('SquareWebhook', 'TelegramWebhook'):
+        apps.get_model('artshow', model_name).objects.update(processed=F('timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0022_pdfrenderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='squarewebhook',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='squarewebhook',
+            name='event_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='squarewebhook',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='squarewebhook',
+            name='ordering_key',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='squarewebhook',
+            name='processed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='telegramwebhook',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='telegramwebhook',
+            name='event_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='telegramwebhook',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='telegramwebhook',
+            name='ordering_key',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='telegramwebhook',
+            name='processed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='squarewebhook',
+            index=models.Index(fields=['processed', 'failed'], name='artshow_squ_process_476163_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='telegramwebhook',
+            index=models.Index(fields=['processed', 'failed'], name='artshow_tel_process_fa4e91_idx'),
+        ),
+        migrations.RunPython(mark_existing_processed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:52
+
+import artshow.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0023_webhook_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShowStatistics',
+            fields=[
+                ('section', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('data', models.JSONField(decoder=artshow.models.StatisticsDecoder, encoder=artshow.models.StatisticsEncoder)),
+                ('version', models.CharField(max_length=32)),
+                ('updated', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShowStatisticsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken', models.DateTimeField(db_index=True)),
+                ('data', models.JSONField(decoder=artshow.models.StatisticsDecoder, encoder=artshow.models.StatisticsEncoder)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:10
+
+from django.db import migrations
+
+from peeps import search
+
+
+def index_bidder_ids(apps, schema_editor):
+    BidderId = apps.get_model('artshow', 'BidderId')
+    SearchToken = apps.get_model('peeps', 'SearchToken')
+    texts = {}
+    for bidder_id, person_id in BidderId.objects.filter(bidder__isnull=False) \
+            .values_list('id', 'bidder__person').iterator():
+        texts.setdefault(person_id, []).append(('bidder_id', bidder_id))
+    SearchToken.objects.bulk_create(search.build_tokens(texts, SearchToken), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0024_show_statistics'),
+        ('peeps', '0008_searchtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_bidder_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:34
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_status(apps, schema_editor):
+    # Tasks that never finished are taken to have failed.
+    CloseShowTask = apps.get_model('artshow', 'CloseShowTask')
+    CloseShowTask.objects.filter(processed_count__gte=F('artist_count')).update(status=1, updated=F('started'))
+    CloseShowTask.objects.filter(processed_count__lt=F('artist_count')).update(status=2, updated=F('started'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0025_index_bidder_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='closeshowtask',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='closeshowtask',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Running'), (1, 'Complete'), (2, 'Failed')], default=0),
+        ),
+        migrations.AddField(
+            model_name='closeshowtask',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(set_status, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='closeshowtask',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 0)), fields=('status',), name='artshow_closeshowtask_one_running'),
+        ),
+    ]
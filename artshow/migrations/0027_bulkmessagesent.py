@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0026_closeshowtask_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkMessageSent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.IntegerField(help_text='pk of the bidder or artist')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='artshow.bulkmessagingtask')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('task', 'recipient'), name='artshow_bulkmessagesent_unique')],
+            },
+        ),
+    ]
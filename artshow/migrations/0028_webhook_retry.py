@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0027_bulkmessagesent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='squarewebhook',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='squarewebhook',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='telegramwebhook',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='telegramwebhook',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
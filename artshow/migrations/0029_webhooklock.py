@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artshow', '0028_webhook_retry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookLock',
+            fields=[
+                ('kind', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('token', models.CharField(blank=True, max_length=32)),
+                ('expires', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
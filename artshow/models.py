@@ -7,20 +7,27 @@ __all__ = ["Allocation", "Artist", "ArtistManager", "BatchScan", "Bid", "Bidder"
            "InvoicePayment", "Payment", "PaymentType", "Piece", "Product", "Location", "Space", "Task",
            "Agent", "validate_space", "validate_space_increments"]
 
+import contextvars
+import json
+from datetime import timedelta
 from decimal import Decimal
 from functools import reduce
 
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import (
-    Count, IntegerField, Max, OuterRef, Subquery, Sum, Q, Value as V
+    Count, Exists, F, IntegerField, OuterRef, Subquery, Sum, Q, Value as V
 )
 from django.db.models.functions import Cast, Coalesce, Substr
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.urls import reverse
 from django.utils import timezone
 
 from num2words import num2words
+from peeps.models import SearchToken
+from peeps.search import build_tokens, search as search_people, tokenize
 
 from . import mod11codes
 from .conf import settings
@@ -120,6 +127,21 @@ class ArtistManager (models.Manager):
         # TODO. find out if "distinct" is really needed here
         return self.get_queryset().filter(Q(agent__in=accessors) | Q(person__user=user)).distinct()
 
+    def with_close_show_status(self):
+        """Annotate each artist with whether they still have pieces awaiting
+        voice auction, and whether their closing payments have been applied."""
+        return self.get_queryset().annotate(
+            awaiting_voice_auction=Exists(Piece.objects.filter(
+                artist=OuterRef('pk'),
+                status=Piece.StatusInShow,
+                voice_auction=True)),
+            payments_applied=Exists(Payment.objects.filter(
+                artist=OuterRef('pk'),
+                payment_type_id__in=(settings.ARTSHOW_SPACE_FEE_PK,
+                                     settings.ARTSHOW_COMMISSION_PK,
+                                     settings.ARTSHOW_SALES_PK))),
+        )
+
 
 class Artist (models.Model):
 
@@ -288,6 +310,8 @@ class Artist (models.Model):
                         date=timezone.now()))
 
         Payment.objects.bulk_create(payments)
+        ShowStatistics.invalidate('payments')
+        return payments
 
     @staticmethod
     def apply_winnings_and_commission(artists):
@@ -301,14 +325,11 @@ class Artist (models.Model):
             pieces=Count('piece', distinct=True),
             pieces_with_bids=Count('piece',
                                    distinct=True,
-                                   filter=Q(piece__bid__invalid=False)),
+                                   filter=Q(piece__valid_bid_count__gt=0)),
+            winnings=Sum('piece__top_bid_amount'),
         )
         payments = []
         for artist in artists:
-            artist.winnings = Piece.objects.filter(artist=artist).annotate(
-                top_bid=Max('bid__amount', filter=Q(bid__invalid=False))
-            ).aggregate(winnings=Sum('top_bid'))['winnings']
-
             if artist.winnings is None:
                 continue
 
@@ -333,19 +354,42 @@ class Artist (models.Model):
                             date=timezone.now()))
 
         Payment.objects.bulk_create(payments)
+        ShowStatistics.invalidate('payments')
+        return payments
 
     @staticmethod
     def create_cheques(artists):
-        artists = artists.annotate(balance=Sum('payment__amount'))
+        artists = artists.annotate(balance=Sum('payment__amount')).filter(
+            balance__gt=0).select_related('person', 'payment_to')
+        cheques = []
         for artist in artists:
-            if artist.balance and artist.balance > 0:
-                chq = ChequePayment(
-                    artist=artist,
-                    payment_type_id=settings.ARTSHOW_PAYMENT_SENT_PK,
-                    amount=-artist.balance,
-                    date=timezone.now())
-                chq.clean()
-                chq.save()
+            chq = ChequePayment(
+                artist=artist,
+                payment_type_id=settings.ARTSHOW_PAYMENT_SENT_PK,
+                amount=-artist.balance,
+                date=timezone.now())
+            chq.clean()
+            cheques.append(chq)
+        return ChequePayment.bulk_create(cheques)
+
+    @staticmethod
+    def settle(artists, dry_run=False):
+        """Apply space fees, winnings and commission, and then write cheques
+        for artists, all in one transaction. Returns the payments made. With
+        dry_run the transaction is rolled back, and the unsaved payments that
+        would have been made are returned instead. Each step evaluates the
+        artists queryset again, so it must not depend on their payments."""
+        with transaction.atomic():
+            ledger = Artist.apply_space_fees(artists)
+            ledger += Artist.apply_winnings_and_commission(artists)
+            ledger += Artist.create_cheques(artists)
+            if dry_run:
+                transaction.set_rollback(True)
+        if dry_run:
+            for payment in ledger:
+                payment.pk = payment.id = None
+                payment._state.adding = True
+        return ledger
 
     class Meta:
         permissions = (
@@ -383,62 +427,118 @@ class Bidder (models.Model):
     notes = models.TextField(blank=True)
 
     def bidder_ids(self):
-        return [b_id.id for b_id in self.bidderid_set.all().order_by('id')]
+        # Sorted here rather than with order_by() so that a prefetched
+        # bidderid_set can be used.
+        return sorted(b_id.id for b_id in self.bidderid_set.all())
+
+    @staticmethod
+    def search(text):
+        """Return the bidders whose name, email address, reg ID or bidder IDs
+        match text, the best matches first."""
+        return search_people(Bidder.objects.all(), text, person='person') \
+            .order_by('-search_rank', 'person__name')
 
     def top_bids(self, unsold_only=False):
-        results = []
-        bids = self.bid_set.filter(invalid=False)
-        for b in bids:
-            if b.is_top_bid and (not unsold_only or b.piece.status != Piece.StatusSold):
-                results.append(b)
+        return Bidder.top_bids_for_bidders([self], unsold_only=unsold_only)[self.pk]
+
+    @staticmethod
+    def top_bids_for_bidders(bidders, unsold_only=False):
+        """Return a dictionary mapping each bidder's pk to a list of their
+        winning bids, with each bid's piece and artist already loaded."""
+        results = {bidder.pk: [] for bidder in bidders}
+        bids = Bid.objects.top_bids().filter(bidder__in=list(results))
+        if unsold_only:
+            bids = bids.exclude(piece__status=Piece.StatusSold)
+        for bid in bids.order_by('pk'):
+            results[bid.bidder_id].append(bid)
         return results
 
     def get_results(self):
-        pieces_won = []
-        pieces_not_won = []
-        pieces_in_voice_auction = []
+        return Bidder.results_for_bidders([self])[self.pk]
+
+    @staticmethod
+    def results_for_bidders(bidders):
+        """Return a dictionary mapping each bidder's pk to the pieces they
+        won, the pieces they bid on but did not win, and the pieces awaiting
+        voice auction, using a single query for all of them."""
+        results = {bidder.pk: ([], [], []) for bidder in bidders}
 
-        winning_bid_query = Bid.objects.filter(
-            piece=OuterRef('pk'), invalid=False).order_by('-amount')[:1]
-        pieces = Piece.objects.filter(bid__bidder=self).annotate(
-            top_bidder=Subquery(winning_bid_query.values('bidder')),
-            top_bid=Subquery(winning_bid_query.values('amount'))
-        ).order_by('artist', 'code').distinct()
+        pieces = Piece.objects.filter(bid__bidder__in=list(results)).annotate(
+            top_bid=F('top_bid_amount'),
+            results_bidder=F('bid__bidder'),
+        ).select_related('artist__person').order_by('artist', 'code').distinct()
 
         for piece in pieces:
+            pieces_won, pieces_not_won, pieces_in_voice_auction = results[piece.results_bidder]
             if piece.status == Piece.StatusInShow and piece.voice_auction:
                 pieces_in_voice_auction.append(piece)
             elif piece.status == Piece.StatusWon or piece.status == Piece.StatusSold:
-                if piece.top_bidder == self.pk:
+                if piece.top_bidder_id == piece.results_bidder:
                     pieces_won.append(piece)
                 else:
                     pieces_not_won.append(piece)
 
-        return pieces_won, pieces_not_won, pieces_in_voice_auction
+        return results
+
+    @staticmethod
+    def results_cache_key(bidder_id):
+        return 'artshow-bidder-results-%d' % bidder_id
+
+    def cached_results(self):
+        """get_results(), cached until a piece this bidder has bid on
+        changes."""
+        return cache.get_or_set(Bidder.results_cache_key(self.pk), self.get_results,
+                                settings.ARTSHOW_RESULTS_CACHE_TIMEOUT)
+
+    @staticmethod
+    def invalidate_results(bidder_ids):
+        """Clear the cached results of bidders once the current transaction
+        commits, so that a request reading the old rows in the meantime
+        cannot cache them again."""
+        keys = [Bidder.results_cache_key(bidder_id) for bidder_id in bidder_ids]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @staticmethod
+    def invalidate_results_for_pieces(pieces):
+        """Invalidate the cached results of every bidder with a bid on one of
+        pieces, which may be a queryset or a list of primary keys."""
+        Bidder.invalidate_results(set(Bid.objects.filter(piece__in=pieces).values_list('bidder', flat=True)))
 
     def unsold_pieces(self):
-        winning_bid_query = Bid.objects.filter(
-            piece=OuterRef('pk'), invalid=False).order_by('-amount')[:1]
         return Piece.objects.filter(
             status=Piece.StatusWon,
-            bid__bidder=self
+            top_bidder=self
         ).annotate(
-            top_bidder=Subquery(winning_bid_query.values('bidder')),
-            top_bid=Subquery(winning_bid_query.values('amount'))
-        ).filter(top_bidder=self.pk).order_by('artist', 'code').distinct()
+            top_bid=F('top_bid_amount')
+        ).order_by('artist', 'code')
 
     def voice_auction_wins(self, adult):
-        winning_bid_query = Bid.objects.filter(
-            piece=OuterRef('pk'), invalid=False).order_by('-amount')[:1]
         return Piece.objects.filter(
             status=Piece.StatusWon,
             voice_auction=True,
             adult=adult,
-            bid__bidder=self
+            top_bidder=self
+        ).annotate(
+            top_bid=F('top_bid_amount')
+        ).order_by('artist', 'code')
+
+    @staticmethod
+    def pieces_won_by_bidders(bidders, **filters):
+        """Return a dictionary mapping each bidder's pk to a list of the won
+        pieces they are the top bidder on, filtered by filters. The pieces
+        are annotated like unsold_pieces()."""
+        results = {bidder.pk: [] for bidder in bidders}
+        pieces = Piece.objects.filter(
+            status=Piece.StatusWon,
+            top_bidder__in=list(results),
+            **filters
         ).annotate(
-            top_bidder=Subquery(winning_bid_query.values('bidder')),
-            top_bid=Subquery(winning_bid_query.values('amount'))
-        ).filter(top_bidder=self.pk).order_by('artist', 'code').distinct()
+            top_bid=F('top_bid_amount')
+        ).select_related('artist__person').order_by('artist', 'code')
+        for piece in pieces:
+            results[piece.top_bidder_id].append(piece)
+        return results
 
     def __str__(self):
         return "%s (%s)" % (self.person.name, ", ".join(self.bidder_ids()))
@@ -458,9 +558,70 @@ class BidderId (models.Model):
         name = self.bidder.person.name if self.bidder else "Unassigned"
         return "BidderId %s (%s)" % (self.id, name)
 
+    @staticmethod
+    def index(bidder_ids):
+        """Add bidder_ids to the search index of their bidders' people, and
+        remove them from anyone they belonged to before."""
+        SearchToken.objects.filter(
+            field='bidder_id', token__in=[token for b in bidder_ids for token in tokenize(b.id)]
+        ).delete()
+        people = dict(Bidder.objects.filter(pk__in={b.bidder_id for b in bidder_ids if b.bidder_id})
+                      .values_list('pk', 'person'))
+        texts = {}
+        for b in bidder_ids:
+            if b.bidder_id:
+                texts.setdefault(people[b.bidder_id], []).append(('bidder_id', b.id))
+        SearchToken.objects.bulk_create(build_tokens(texts), batch_size=1000)
+
+
+class PieceQuerySet(models.QuerySet):
+    # Updates that skip Piece.save(), including bulk_update(), invalidate the
+    # cached results of the pieces' bidders and the show summary here
+    # instead.
+
+    def update(self, **kwargs):
+        if Piece.RESULTS_FIELDS.intersection(kwargs):
+            bidder_ids = set(Bid.objects.filter(piece__in=self.values('pk')).values_list('bidder', flat=True))
+        else:
+            bidder_ids = ()
+        rows = super().update(**kwargs)
+        Bidder.invalidate_results(bidder_ids)
+        ShowStatistics.invalidate('pieces')
+        return rows
+
+    def update_top_bids(self):
+        """Recalculate the denormalized top bid columns for these pieces with
+        a single UPDATE."""
+        valid_bids = Bid.objects.filter(piece=OuterRef('pk'), invalid=False)
+        top_bid = valid_bids.order_by('-amount')[:1]
+        bid_count = valid_bids.order_by().values('piece').annotate(count=Count('pk')).values('count')
+        return self.update(
+            top_bid_amount=Subquery(top_bid.values('amount')),
+            top_bidder=Subquery(top_bid.values('bidder')),
+            top_bidderid=Subquery(top_bid.values('bidderid')),
+            top_bid_is_buy_now=Coalesce(Subquery(top_bid.values('buy_now_bid')), V(False)),
+            valid_bid_count=Coalesce(Subquery(bid_count), V(0)),
+        )
+
+    def apply_won_status(self):
+        """Set-based equivalent of Piece.apply_won_status(). Returns the number
+        of pieces marked as won, and the number sent to voice auction."""
+        in_show = self.filter(status=Piece.StatusInShow)
+        now = timezone.now()
+        voice_auction = in_show.filter(
+            valid_bid_count__gte=Piece.VOICE_AUCTION_BID_COUNT,
+        ).update(voice_auction=True, updated=now)
+        won = in_show.filter(
+            valid_bid_count__gt=0,
+            valid_bid_count__lt=Piece.VOICE_AUCTION_BID_COUNT,
+        ).update(voice_auction=False, status=Piece.StatusWon, updated=now)
+        return won, voice_auction
+
 
 class Piece (models.Model):
 
+    objects = PieceQuerySet.as_manager()
+
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
     pieceid = models.IntegerField()
     code = models.CharField(max_length=10, editable=False)
@@ -495,6 +656,28 @@ class Piece (models.Model):
     order = models.IntegerField(null=True, blank=True)
     bids_updated = models.DateTimeField(null=True, blank=True, default=None)
 
+    # Denormalized copy of the highest valid bid, maintained by the Bid
+    # signal handlers and PieceQuerySet.update_top_bids().
+    top_bid_amount = models.DecimalField(
+        max_digits=5, decimal_places=0, blank=True, null=True, db_index=True,
+        editable=False)
+    top_bidder = models.ForeignKey('Bidder', null=True, blank=True, editable=False,
+                                   on_delete=models.SET_NULL, related_name='+')
+    top_bidderid = models.ForeignKey('BidderId', null=True, blank=True, editable=False,
+                                     on_delete=models.SET_NULL, related_name='+')
+    top_bid_is_buy_now = models.BooleanField(default=False, editable=False)
+    valid_bid_count = models.IntegerField(default=0, db_index=True, editable=False)
+
+    TOP_BID_FIELDS = ['top_bid_amount', 'top_bidder', 'top_bidderid',
+                      'top_bid_is_buy_now', 'valid_bid_count']
+
+    # Fields shown on the bidder results page.
+    RESULTS_FIELDS = frozenset(TOP_BID_FIELDS + ['status', 'voice_auction', 'code', 'name', 'original',
+                                                 'print_number', 'print_run', 'other_artist'])
+
+    # Pieces with at least this many valid bids go to voice auction.
+    VOICE_AUCTION_BID_COUNT = 6
+
     StatusNotInShow = 0
     StatusInShow = 1
     StatusWon = 2
@@ -536,15 +719,31 @@ class Piece (models.Model):
     def top_bid(self):
         return self.bid_set.exclude(invalid=True).order_by('-amount')[0:1].get()
 
+    def update_top_bid(self):
+        """Recalculate the top bid columns for this piece, and refresh them on
+        this instance so that a later save() does not write stale values."""
+        Piece.objects.filter(pk=self.pk).update_top_bids()
+        self.refresh_from_db(fields=Piece.TOP_BID_FIELDS)
+
     def is_artist_editable(self):
         return self.status == Piece.StatusNotInShow
 
-    def save(self, *args, **kwargs):
-        self.code = "%s-%s" % (self.artist.artistid, self.pieceid)
+    def update_status_from_location(self):
+        """Move the piece in or out of the show to match its location."""
         if self.location and self.status == Piece.StatusNotInShow:
             self.status = Piece.StatusInShow
         if not self.location and self.status == Piece.StatusInShow:
             self.status = Piece.StatusNotInShow
+
+    def save(self, *args, **kwargs):
+        self.code = "%s-%s" % (self.artist.artistid, self.pieceid)
+        self.update_status_from_location()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The top bid columns are only written by update_top_bids(), so
+            # that saving a stale instance cannot overwrite them.
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in Piece.TOP_BID_FIELDS]
         super(Piece, self).save(*args, **kwargs)
 
     def __str__(self):
@@ -587,7 +786,7 @@ class Piece (models.Model):
         if self.status == Piece.StatusInShow:
             bid_count = self.bid_set.exclude(invalid=True).count()
             if bid_count > 0:
-                self.voice_auction = bid_count >= 6
+                self.voice_auction = bid_count >= Piece.VOICE_AUCTION_BID_COUNT
                 if not self.voice_auction:
                     self.status = Piece.StatusWon
                 self.save()
@@ -614,7 +813,62 @@ class Product (models.Model):
                                            self.name, self.artistname(), self.artist.artistid)
 
 
+# Set while BidQuerySet.bulk_delete() deletes bids, so that the post_delete
+# signal leaves their pieces to be updated together afterwards.
+bulk_deleting_bids = contextvars.ContextVar('artshow_bulk_deleting_bids', default=False)
+
+
+class BidQuerySet(models.QuerySet):
+    def top_bids(self):
+        """Bids that are currently the top valid bid on their piece."""
+        return self.filter(
+            invalid=False,
+            amount=F('piece__top_bid_amount'),
+        ).select_related('piece', 'piece__artist', 'piece__artist__person')
+
+    # Bulk operations skip the post_save signal, so the affected pieces have
+    # their top bid columns recalculated here instead.
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        Piece.objects.filter(pk__in={bid.piece_id for bid in objs}).update_top_bids()
+        Bid.invalidate_show_has_bids()
+        return objs
+
+    def update(self, **kwargs):
+        piece_ids, bidder_ids = set(), set()
+        for piece_id, bidder_id in self.values_list('piece_id', 'bidder_id'):
+            piece_ids.add(piece_id)
+            bidder_ids.add(bidder_id)
+        rows = super().update(**kwargs)
+        Piece.objects.filter(pk__in=piece_ids).update_top_bids()
+        # Bidders who no longer have a bid on the piece are not found by
+        # update_top_bids().
+        Bidder.invalidate_results(bidder_ids)
+        Bid.invalidate_show_has_bids()
+        return rows
+
+    def bulk_delete(self):
+        """Delete these bids, skipping the per-bid work of the post_delete
+        signal, and then recalculate the top bids of their pieces once."""
+        piece_ids, bidder_ids = set(), set()
+        for piece_id, bidder_id in self.values_list('piece_id', 'bidder_id'):
+            piece_ids.add(piece_id)
+            bidder_ids.add(bidder_id)
+        token = bulk_deleting_bids.set(True)
+        try:
+            rows, _ = self.delete()
+        finally:
+            bulk_deleting_bids.reset(token)
+        Piece.objects.filter(pk__in=piece_ids).update_top_bids()
+        Bidder.invalidate_results(bidder_ids)
+        Bid.invalidate_show_has_bids()
+        return rows
+
+
 class Bid (models.Model):
+    objects = BidQuerySet.as_manager()
+
     bidder = models.ForeignKey(Bidder, on_delete=models.CASCADE)
     bidderid = models.ForeignKey(BidderId, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=5, decimal_places=0)
@@ -623,9 +877,22 @@ class Bid (models.Model):
     invalid = models.BooleanField(default=False)
 
     def _is_top_bid(self):
-        return self.piece.top_bid() == self
+        return not self.invalid and self.amount == self.piece.top_bid_amount
     is_top_bid = property(_is_top_bid)
 
+    SHOW_HAS_BIDS_CACHE_KEY = 'artshow-show-has-bids'
+
+    @staticmethod
+    def show_has_bids():
+        """Whether any valid bids have been entered, cached until a bid
+        changes."""
+        return cache.get_or_set(Bid.SHOW_HAS_BIDS_CACHE_KEY, Bid.objects.filter(invalid=False).exists,
+                                settings.ARTSHOW_RESULTS_CACHE_TIMEOUT)
+
+    @staticmethod
+    def invalidate_show_has_bids():
+        transaction.on_commit(lambda: cache.delete(Bid.SHOW_HAS_BIDS_CACHE_KEY))
+
     def __str__(self):
         return "%s (%s) %s $%s on %s" % (self.bidder.name(), self.bidderid,
                                          "INVALID BID" if self.invalid else "bid", self.amount, self.piece)
@@ -633,23 +900,22 @@ class Bid (models.Model):
     class Meta:
         unique_together = (('piece', 'amount', 'invalid'), )
 
-    def validate(self):
+    def validate(self, as_new=False):
         # super(Bid,self).validate()
+        # as_new checks a saved bid against the piece's top bid as though it
+        # were being placed now.
         if self.piece.not_for_sale:
             raise ValidationError("Not For Sale piece cannot have bids placed on it")
-        if self.id is None:
+        if self.id is None or as_new:
             if self.piece.status != Piece.StatusInShow:
                 raise ValidationError("New bids cannot be placed on pieces that are not In Show")
-            try:
-                top_bid = self.piece.top_bid()
-                if self.amount <= top_bid.amount:
+            if self.piece.top_bid_amount is not None:
+                if self.amount <= self.piece.top_bid_amount:
                     raise ValidationError("New bid must be higher than existing bids")
-                if self.piece.buy_now and top_bid.buy_now_bid:
+                if self.piece.buy_now and self.piece.top_bid_is_buy_now:
                     raise ValidationError("Cannot bid on piece that has had Buy Now option invoked")
                 if self.buy_now_bid:
                     raise ValidationError("Buy Now option not available on piece with bids")
-            except Bid.DoesNotExist:
-                pass
         if self.buy_now_bid:
             if not self.piece.buy_now:
                 raise ValidationError("Buy Now option not available on this piece")
@@ -720,6 +986,39 @@ class ChequePayment (Payment):
     def amount_string(self):
         return str(-self.amount)
 
+    @staticmethod
+    def bulk_create(cheques):
+        """Save a list of new cheques. QuerySet.bulk_create() does not support
+        multi-table inheritance, so the parent Payment rows are created in
+        bulk first and the cheque rows are then inserted in one statement."""
+        if not cheques:
+            return cheques
+
+        payments = Payment.objects.bulk_create([
+            Payment(artist_id=cheque.artist_id, amount=cheque.amount,
+                    payment_type_id=cheque.payment_type_id,
+                    description=cheque.description, date=cheque.date)
+            for cheque in cheques
+        ])
+        for cheque, payment in zip(cheques, payments):
+            cheque.id = cheque.payment_ptr_id = payment.pk
+
+        fields = ChequePayment._meta.local_concrete_fields
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (%s) VALUES (%s)' % (
+                    quote_name(ChequePayment._meta.db_table),
+                    ', '.join(quote_name(field.column) for field in fields),
+                    ', '.join(['%s'] * len(fields))),
+                [[field.get_db_prep_save(getattr(cheque, field.attname), connection)
+                  for field in fields]
+                 for cheque in cheques])
+        for cheque in cheques:
+            cheque._state.adding = False
+        ShowStatistics.invalidate('payments')
+        return cheques
+
     @property
     def amount_words(self):
         amount = -self.amount
@@ -860,14 +1159,47 @@ class SquareTerminal(models.Model):
     checkout_id = models.CharField(max_length=255, blank=True)
 
 
-class SquareWebhook(models.Model):
+class Webhook(models.Model):
+    """A webhook request, stored as soon as it arrives and processed later by
+    the process_webhooks task. See artshow.webhooks."""
     timestamp = models.DateTimeField()
     body = models.JSONField()
+    # The provider's ID for the event, used to ignore deliveries of an event
+    # that has already been received.
+    event_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    # Webhooks with the same ordering key are processed in the order they
+    # arrived, and wait behind any earlier one that failed.
+    ordering_key = models.CharField(max_length=255, blank=True, db_index=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    failed = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # When a webhook that failed is to be tried again.
+    retry_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+        indexes = [
+            models.Index(fields=['processed', 'failed']),
+        ]
 
 
-class TelegramWebhook(models.Model):
-    timestamp = models.DateTimeField()
-    body = models.JSONField()
+class SquareWebhook(Webhook):
+    class Meta(Webhook.Meta):
+        pass
+
+
+class TelegramWebhook(Webhook):
+    class Meta(Webhook.Meta):
+        pass
+
+
+class WebhookLock(models.Model):
+    """Held by the process draining one kind of webhook, so that only one
+    drain or replay of each kind runs at a time. See artshow.webhooks."""
+    kind = models.CharField(max_length=20, primary_key=True)
+    token = models.CharField(max_length=32, blank=True)
+    expires = models.DateTimeField(null=True, blank=True)
 
 
 class BulkMessagingTask(models.Model):
@@ -882,3 +1214,150 @@ class BulkMessagingTask(models.Model):
     @property
     def remaining(self):
         return self.message_count - self.sent_count
+
+
+class BulkMessageSent(models.Model):
+    """A recipient of a bulk message who has been sent it, so that a batch
+    that is retried after failing part way through skips them."""
+    task = models.ForeignKey(BulkMessagingTask, on_delete=models.CASCADE)
+    recipient = models.IntegerField(help_text="pk of the bidder or artist")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'recipient'], name='artshow_bulkmessagesent_unique'),
+        ]
+
+
+class CloseShowTask(models.Model):
+    StatusRunning = 0
+    StatusComplete = 1
+    StatusFailed = 2
+
+    STATUS_CHOICES = [
+        (StatusRunning, 'Running'),
+        (StatusComplete, 'Complete'),
+        (StatusFailed, 'Failed'),
+    ]
+
+    started = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(default=timezone.now)
+    status = models.IntegerField(choices=STATUS_CHOICES, default=StatusRunning)
+    error = models.TextField(blank=True)
+    piece_won_count = models.IntegerField(default=0)
+    piece_voice_auction_count = models.IntegerField(default=0)
+    artist_count = models.IntegerField(default=0)
+    processed_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Only one close can run at a time, so that no artist is settled
+            # twice.
+            models.UniqueConstraint(fields=['status'], condition=Q(status=0),
+                                    name='artshow_closeshowtask_one_running'),
+        ]
+
+    @property
+    def percentage(self):
+        if not self.artist_count:
+            return 100.0
+        return float(self.processed_count) / self.artist_count * 100
+
+    @property
+    def remaining(self):
+        return self.artist_count - self.processed_count
+
+    @property
+    def complete(self):
+        return self.status == CloseShowTask.StatusComplete
+
+    @staticmethod
+    def fail_stale():
+        """Mark running tasks that have made no progress for
+        ARTSHOW_CLOSE_SHOW_STALE_AFTER seconds as failed, as their worker
+        has presumably died, so that the show can be closed again."""
+        cutoff = timezone.now() - timedelta(seconds=settings.ARTSHOW_CLOSE_SHOW_STALE_AFTER)
+        return CloseShowTask.objects.filter(status=CloseShowTask.StatusRunning, updated__lt=cutoff) \
+            .update(status=CloseShowTask.StatusFailed, error="No progress was made for too long.")
+
+
+class PdfRenderJob(models.Model):
+    StatusPending = 0
+    StatusComplete = 1
+    StatusFailed = 2
+
+    STATUS_CHOICES = [
+        (StatusPending, 'Pending'),
+        (StatusComplete, 'Complete'),
+        (StatusFailed, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=40)
+    params = models.JSONField(default=dict)
+    filename = models.CharField(max_length=100)
+    cache_key = models.CharField(max_length=64, db_index=True)
+    status = models.IntegerField(choices=STATUS_CHOICES, default=StatusPending)
+    digest = models.CharField(max_length=64, blank=True,
+                              help_text="SHA-256 of the rendered PDF in the artifact store")
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "%s (%s)" % (self.filename, self.get_status_display())
+
+
+class StatisticsEncoder(DjangoJSONEncoder):
+    """Encodes Decimals so that StatisticsDecoder can turn them back into
+    Decimals rather than strings."""
+
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return {'decimal': str(o)}
+        return super().default(o)
+
+
+class StatisticsDecoder(json.JSONDecoder):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, object_hook=self.decode_decimal, **kwargs)
+
+    @staticmethod
+    def decode_decimal(obj):
+        if obj.keys() == {'decimal'}:
+            return Decimal(obj['decimal'])
+        return obj
+
+
+class ShowStatistics(models.Model):
+    """One section of the show summary, as it was last calculated. Changes
+    that affect a section delete its version from the cache, and the section
+    is calculated again the next time the summary is read. See
+    artshow.summary."""
+    SECTIONS = ['pieces', 'artists', 'spaces', 'payments', 'invoices']
+
+    section = models.CharField(max_length=20, primary_key=True)
+    data = models.JSONField(encoder=StatisticsEncoder, decoder=StatisticsDecoder)
+    version = models.CharField(max_length=32)
+    updated = models.DateTimeField()
+
+    @staticmethod
+    def version_cache_key(section):
+        return 'artshow:summary:%s:version' % section
+
+    @staticmethod
+    def invalidate(*sections):
+        """Mark sections of the summary as out of date once the current
+        transaction commits."""
+        keys = [ShowStatistics.version_cache_key(section) for section in sections]
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+    def __str__(self):
+        return self.section
+
+
+class ShowStatisticsSnapshot(models.Model):
+    """A copy of the whole show summary at a point in time."""
+    taken = models.DateTimeField(db_index=True)
+    data = models.JSONField(encoder=StatisticsEncoder, decoder=StatisticsDecoder)
+
+    def __str__(self):
+        return str(self.taken)
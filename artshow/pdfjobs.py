@@ -0,0 +1,149 @@
+# Artshow Jockey
+# Copyright (C) 2009, 2010 Chris Cogdon
+# See file COPYING for licence details
+
+"""Background rendering of PDFs.
+
+A view asks for a PDF with request_pdf(), which returns a PdfRenderJob. The
+render_pdf task then builds the PDF in a Celery worker and writes it to a
+content-addressed store on local disk. The job page polls until the PDF is
+ready and then downloads it.
+
+Each request is given a cache key made from the kind of PDF, its parameters
+and a "version" that summarises the rows the PDF is built from. If a job
+with the same key has already completed, its PDF is reused instead of being
+rendered again.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth.decorators import permission_required
+from django.db import transaction
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils import timezone
+
+from .conf import settings
+from .models import PdfRenderJob
+
+
+# A pending job older than this is assumed to have been lost, and will not be
+# waited on by new requests.
+PENDING_TIMEOUT = timedelta(minutes=10)
+
+
+def renderers():
+    """Map each kind of PDF to the function that renders it. Each function is
+    called as render(output, **params)."""
+    from . import cheques, pdfreports, bidsheets
+    return {
+        'winning_bidders': pdfreports.render_winning_bidders,
+        'mailing_labels': bidsheets.render_mailing_labels,
+        'cheques': cheques.render_cheques_pdf,
+    }
+
+
+def artifact_path(digest):
+    return os.path.join(settings.ARTSHOW_PDF_ARTIFACT_ROOT, digest[:2], digest + '.pdf')
+
+
+def artifact_exists(digest):
+    return bool(digest) and os.path.exists(artifact_path(digest))
+
+
+def store_artifact(data):
+    """Write data to the artifact store, and return its digest."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = artifact_path(digest)
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so that a reader never sees a
+        # partially written PDF.
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return digest
+
+
+def make_cache_key(kind, params, version):
+    key = json.dumps([kind, params, version], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def request_pdf(kind, filename, params, version):
+    """Return a job that will produce the requested PDF, reusing a completed
+    or pending job for the same inputs where there is one."""
+    cache_key = make_cache_key(kind, params, version)
+
+    pending_cutoff = timezone.now() - PENDING_TIMEOUT
+    for job in PdfRenderJob.objects.filter(cache_key=cache_key).exclude(
+            status=PdfRenderJob.StatusFailed).order_by('-created'):
+        if job.status == PdfRenderJob.StatusPending:
+            if job.created > pending_cutoff:
+                return job
+        elif artifact_exists(job.digest):
+            return job
+
+    job = PdfRenderJob(kind=kind, filename=filename, params=params, cache_key=cache_key)
+    job.save()
+
+    from . import tasks
+    transaction.on_commit(lambda: tasks.render_pdf.delay(job.pk))
+    return job
+
+
+def render_job(job):
+    output = tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024)
+    try:
+        renderers()[job.kind](output, **job.params)
+        output.seek(0)
+        job.digest = store_artifact(output.read())
+    except Exception as e:
+        job.status = PdfRenderJob.StatusFailed
+        job.error = repr(e)
+        raise
+    else:
+        job.status = PdfRenderJob.StatusComplete
+    finally:
+        output.close()
+        job.completed = timezone.now()
+        job.save()
+
+
+@permission_required('artshow.is_artshow_staff')
+def job(request, job_id):
+    job = get_object_or_404(PdfRenderJob, pk=job_id)
+    return render(request, 'artshow/pdf_job.html', {'job': job})
+
+
+@permission_required('artshow.is_artshow_staff')
+def job_status(request, job_id):
+    job = get_object_or_404(PdfRenderJob, pk=job_id)
+    result = {
+        'status': job.get_status_display().lower(),
+    }
+    if job.status == PdfRenderJob.StatusComplete:
+        result['url'] = reverse('artshow-pdf-job-download', args=(job.pk,))
+    elif job.status == PdfRenderJob.StatusFailed:
+        result['error'] = job.error
+    return JsonResponse(result)
+
+
+@permission_required('artshow.is_artshow_staff')
+def job_download(request, job_id):
+    job = get_object_or_404(PdfRenderJob, pk=job_id, status=PdfRenderJob.StatusComplete)
+    if not artifact_exists(job.digest):
+        raise Http404("PDF is no longer available")
+    return FileResponse(open(artifact_path(job.digest), 'rb'), as_attachment=True,
+                        filename=job.filename, content_type='application/pdf')
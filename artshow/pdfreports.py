@@ -5,40 +5,67 @@
 from html import escape
 
 from django.db.models import Min
-from django.shortcuts import get_object_or_404
+from django.shortcuts import get_object_or_404, redirect
 from reportlab.lib.pagesizes import LETTER
 from django.http import HttpResponse
 from django.contrib.auth.decorators import permission_required
 from reportlab.lib.sequencer import getSequencer
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, Spacer, Frame, KeepTogether
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer, Frame, KeepTogether
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
-from .models import Bidder, Invoice, Piece
+from .models import Bid, Bidder, BidderId, Invoice, Piece
 from .conf import settings
+from . import pdfjobs
+from .profiling import timer
 from artshow.utils import format_money
 
 
 MAX_PIECES_PER_PAGE = 30
 
 
+def winning_bidders_version():
+    """Everything render_winning_bidders() prints, read with three queries
+    rather than by rendering, so that any change to it renders the PDF
+    again."""
+    return [
+        list(Bidder.objects.annotate(first_bidderid=Min('bidderid')).order_by('first_bidderid', 'pk')
+             .values_list('pk', flat=True)),
+        list(BidderId.objects.filter(bidder__isnull=False).order_by('bidder', 'id')
+             .values_list('bidder', 'id')),
+        list(Bid.objects.top_bids().order_by('pk').values_list(
+            'bidder', 'amount', 'piece__code', 'piece__name', 'piece__original', 'piece__print_number',
+            'piece__print_run', 'piece__voice_auction', 'piece__other_artist', 'piece__artist__publicname',
+            'piece__artist__person__name')),
+    ]
+
+
 @permission_required('artshow.is_artshow_staff')
 def winning_bidders(request):
-    bidders = Bidder.objects.all().annotate(first_bidderid=Min('bidderid')).order_by('first_bidderid')
-    response = HttpResponse(mimetype="application/pdf")
+    job = pdfjobs.request_pdf('winning_bidders', 'winning-bidders.pdf', {}, winning_bidders_version())
+    return redirect('artshow-pdf-job', job_id=job.pk)
+
+
+@timer('pdf')
+def render_winning_bidders(output):
+    bidders = Bidder.objects.all().annotate(first_bidderid=Min('bidderid')).order_by('first_bidderid') \
+        .prefetch_related('bidderid_set')
+    all_top_bids = Bidder.top_bids_for_bidders(bidders)
 
     styles = getSampleStyleSheet()
     normal_style = styles["Normal"]
     heading_style = styles["Heading3"]
     heading_style_white = ParagraphStyle("heading_style_white", parent=heading_style, textColor=colors.white)
-    doc = SimpleDocTemplate(response, leftMargin=0.5 * inch, rightMargin=0.5 * inch, topMargin=0.5 * inch,
+    doc = SimpleDocTemplate(output, leftMargin=0.5 * inch, rightMargin=0.5 * inch, topMargin=0.5 * inch,
                             bottomMargin=0.5 * inch)
 
     data = [("Bidder",
              Table([("ID", "Piece", "Bid", "Notes")], colWidths=[0.5 * inch, 4.5 * inch, 0.5 * inch, 1.2 * inch]))]
 
     for bidder in bidders:
-        top_bids = bidder.top_bids()
+        top_bids = all_top_bids[bidder.pk]
         if top_bids:
             for i in range(0, len(top_bids), MAX_PIECES_PER_PAGE):
                 bidder_data = []
@@ -94,7 +121,85 @@ def winning_bidders(request):
     story = [table]
     doc.build(story)
 
-    return response
+
+BID_ENTRY_HEADINGS = ("Loc.", "Artist", "Title", "Code", "Bidder", "Amount", "No\nSale", "Norm.\nSale",
+                      "Buy\nNow\nSale", "Voice\nAuct.")
+BID_ENTRY_COL_WIDTHS = [0.5 * inch, 1.5 * inch, 1.7 * inch, 0.7 * inch, 1 * inch, 1 * inch, 0.4 * inch, 0.4 * inch,
+                        0.4 * inch, 0.4 * inch]
+BID_ENTRY_HEADER_HEIGHT = 0.6 * inch
+BID_ENTRY_ROW_HEIGHT = 0.3 * inch
+BID_ENTRY_MARGIN = 0.5 * inch
+BID_ENTRY_PADDING = 3
+BID_ENTRY_FONT = ("Helvetica", 10)
+BID_ENTRY_ROWS_PER_PAGE = int((LETTER[1] - 2 * BID_ENTRY_MARGIN - BID_ENTRY_HEADER_HEIGHT) // BID_ENTRY_ROW_HEIGHT)
+BID_ENTRY_CHUNK_SIZE = 500
+
+BID_ENTRY_TABLE_STYLE = TableStyle([
+    ("FONT", (0, 0), (-1, -1)) + BID_ENTRY_FONT,
+    ("LEFTPADDING", (0, 0), (-1, -1), BID_ENTRY_PADDING),
+    ("RIGHTPADDING", (0, 0), (-1, -1), BID_ENTRY_PADDING),
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ("GRID", (0, 1), (-1, -1), 0.5, colors.black),
+])
+
+
+def truncate_to_width(text, width, font_name, font_size):
+    """Shorten text with an ellipsis so that it is no wider than width."""
+    if stringWidth(text, font_name, font_size) <= width:
+        return text
+    width -= stringWidth("\u2026", font_name, font_size)
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if stringWidth(text[:middle], font_name, font_size) <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "\u2026"
+
+
+def bid_entry_rows(pieces):
+    """Yield the location, artist, title and code of each piece, reading
+    pieces from the database a chunk at a time."""
+    pieces = pieces.select_related('artist__person').only(
+        'location', 'code', 'name', 'original', 'print_number', 'print_run', 'other_artist',
+        'artist__publicname', 'artist__person__name')
+    for piece in pieces.iterator(chunk_size=BID_ENTRY_CHUNK_SIZE):
+        yield piece.location, piece.artistname(), piece.title(), piece.code
+
+
+@timer('pdf')
+def bid_entry_to_pdf(rows, output):
+    """Write a bid entry worksheet for rows of (location, artist, title,
+    code) to output.
+
+    Each page is laid out as its own fixed-height table of plain strings, so
+    the time and memory needed to lay out a page does not depend on the
+    number of pieces."""
+    canvas = Canvas(output, pagesize=LETTER)
+    text_widths = [width - 2 * BID_ENTRY_PADDING for width in BID_ENTRY_COL_WIDTHS]
+    blank_columns = ("",) * (len(BID_ENTRY_HEADINGS) - 4)
+
+    def draw_page(page_rows):
+        table = Table([BID_ENTRY_HEADINGS] + page_rows, colWidths=BID_ENTRY_COL_WIDTHS,
+                      rowHeights=[BID_ENTRY_HEADER_HEIGHT] + [BID_ENTRY_ROW_HEIGHT] * len(page_rows),
+                      style=BID_ENTRY_TABLE_STYLE)
+        _, height = table.wrapOn(canvas, LETTER[0], LETTER[1])
+        table.drawOn(canvas, BID_ENTRY_MARGIN, LETTER[1] - BID_ENTRY_MARGIN - height)
+        canvas.showPage()
+
+    page_rows = []
+    pages = 0
+    for row in rows:
+        page_rows.append(tuple(truncate_to_width(text, width, *BID_ENTRY_FONT)
+                               for text, width in zip(row, text_widths)) + blank_columns)
+        if len(page_rows) == BID_ENTRY_ROWS_PER_PAGE:
+            draw_page(page_rows)
+            page_rows = []
+            pages += 1
+    if page_rows or not pages:
+        draw_page(page_rows)
+    canvas.save()
 
 
 @permission_required('artshow.is_artshow_staff')
@@ -113,40 +218,8 @@ def bid_entry_by_location(request):
 
 @permission_required('artshow.is_artshow_staff')
 def bid_entry(request, pieces):
-    response = HttpResponse(mimetype="application/pdf")
-
-    styles = getSampleStyleSheet()
-    normal_style = styles["Normal"]
-    doc = SimpleDocTemplate(response, leftMargin=0.5 * inch, rightMargin=0.5 * inch, topMargin=0.5 * inch,
-                            bottomMargin=0.5 * inch)
-
-    data = [("Loc.", "Artist", "Title", "Code", "Bidder", "Amount", "No\nSale", "Norm.\nSale", "Buy\nNow\nSale",
-             "Voice\nAuct.")]
-
-    for piece in pieces:
-        data.append((
-            Paragraph(escape(piece.location), normal_style),
-            Paragraph(escape(piece.artistname()), normal_style),
-            Paragraph(escape(piece.title()), normal_style),
-            Paragraph(escape(piece.code), normal_style),
-            "",
-            "",
-            "",
-            "",
-            "",
-            "",
-        ))
-
-    table_style = [
-        ("GRID", (0, 1), (-1, -1), 0.5, colors.black),
-    ]
-    table = Table(data,
-                  colWidths=[0.5 * inch, 1.5 * inch, 1.7 * inch, 0.7 * inch, 1 * inch, 1 * inch, 0.4 * inch, 0.4 * inch,
-                             0.4 * inch, 0.4 * inch],
-                  repeatRows=1, style=table_style)
-    story = [table]
-    doc.build(story)
-
+    response = HttpResponse(content_type="application/pdf")
+    bid_entry_to_pdf(bid_entry_rows(pieces), response)
     return response
 
 
@@ -194,6 +267,7 @@ def draw_invoice_header(canvas, doc, invoice, purpose):
     frame.addFromList(header_story, canvas)
 
 
+@timer('pdf')
 def invoice_to_pdf(invoice, outf):
     normal_style = ParagraphStyle("normal", fontName="Helvetica")
     piece_condition_style = ParagraphStyle("piececondition", normal_style, fontSize=normal_style.fontSize - 2,
@@ -275,11 +349,12 @@ def invoice_to_pdf(invoice, outf):
 @permission_required('artshow.is_artshow_staff')
 def pdf_invoice(request, invoice_id):
     invoice = get_object_or_404(Invoice, pk=invoice_id)
-    response = HttpResponse(mimetype="application/pdf")
+    response = HttpResponse(content_type="application/pdf")
     invoice_to_pdf(invoice, response)
     return response
 
 
+@timer('pdf')
 def picklist_to_pdf(invoice, outf):
     normal_style = ParagraphStyle("normal", fontName="Helvetica")
     piece_condition_style = ParagraphStyle("piececondition", normal_style, fontSize=normal_style.fontSize - 2,
@@ -360,6 +435,6 @@ def picklist_to_pdf(invoice, outf):
 @permission_required('artshow.is_artshow_staff')
 def pdf_picklist(request, invoice_id):
     invoice = get_object_or_404(Invoice, pk=invoice_id)
-    response = HttpResponse(mimetype="application/pdf")
+    response = HttpResponse(content_type="application/pdf")
     picklist_to_pdf(invoice, response)
     return response
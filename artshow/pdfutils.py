@@ -1,4 +1,5 @@
-from cgi import escape as escape_html
+import functools
+from html import escape as escape_html
 
 from reportlab.lib.units import inch
 from reportlab.lib.styles import TA_CENTER, ParagraphStyle
@@ -19,7 +20,7 @@ default_style = ParagraphStyle("default", fontName="Helvetica", fontSize=18, lea
 
 def squeeze_text_into_box(canvas, text, x0, y0, x1, y1, units=inch, style=default_style, escape=True):
     if escape:
-        text = escape_html(text).replace('\n', '<br/>')
+        text = escape_html(text, quote=False).replace('\n', '<br/>')
     frame = Frame(x0 * units, y0 * units, (x1 - x0) * units, (y1 - y0) * units, leftPadding=2, rightPadding=2,
                   topPadding=0, bottomPadding=4, showBoundary=0)
     current_style = style
@@ -48,7 +49,17 @@ def load_pdf_as_form(canvas, path):
     :param path: path to pdf file to open
     :return: a reportlab object that may be drawn using canvas.doForm(obj)
     """
+    return makerl(canvas, load_pdf_page(path))
+
+
+@functools.lru_cache(maxsize=None)
+def load_pdf_page(path):
+    """
+    Parse the first page of a pdf file into a form XObject. The result is
+    cached, so each process only parses a given file once.
+
+    :param path: path to pdf file to open
+    :return: a pdfrw XObject that may be passed to makerl()
+    """
     pdf = PdfReader(path)
-    xobj = pagexobj(pdf.pages[0])
-    reportlab_obj = makerl(canvas, xobj)
-    return reportlab_obj
+    return pagexobj(pdf.pages[0])
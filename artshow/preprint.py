@@ -1,17 +1,232 @@
+"""Server-side PDF rendering of the forms printed before the show.
+
+Set ARTSHOW_PREPRINT_MODULE to "artshow.preprint" to use this module.
+
+Bid sheets and control forms are drawn over the blank forms in
+ARTSHOW_BLANK_BID_SHEET and ARTSHOW_BLANK_CONTROL_FORM. The pieces are read
+from the database up front and turned into one dict of strings per page. Large
+print runs are then split into chunks of ARTSHOW_PREPRINT_CHUNK_SIZE pages,
+rendered in a pool of ARTSHOW_PREPRINT_WORKERS processes, and merged into a
+single PDF.
+
+The box positions below are in inches from the bottom left of a letter page,
+and may need adjusting to line up with the blank forms in use.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import groupby, repeat
+
+from pdfrw import PdfReader, PdfWriter
+from reportlab.lib.enums import TA_LEFT
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.pdfgen.canvas import Canvas
+
+from .conf import settings
+from .pdfutils import default_style, load_pdf_as_form, load_pdf_page, squeeze_text_into_box
+
+code_style = ParagraphStyle("code", parent=default_style, fontName="Helvetica-Bold", fontSize=36, leading=36)
+barcode_style = ParagraphStyle("barcode", parent=default_style, fontName=settings.ARTSHOW_BARCODE_FONT[0],
+                               fontSize=36, leading=36)
+field_style = ParagraphStyle("field", parent=default_style, fontSize=14, leading=14, alignment=TA_LEFT)
+small_style = ParagraphStyle("small", parent=default_style, fontSize=10, leading=10, alignment=TA_LEFT)
+
+BID_SHEET_BOXES = {
+    'code': ((5.0, 9.8, 8.0, 10.6), code_style),
+    'barcode': ((5.0, 9.1, 8.0, 9.8), barcode_style),
+    'min_bid': ((0.5, 9.1, 2.6, 9.6), field_style),
+    'buy_now': ((2.6, 9.1, 4.8, 9.6), field_style),
+    'artist': ((1.3, 8.3, 8.0, 8.8), field_style),
+    'title': ((1.3, 7.7, 8.0, 8.3), field_style),
+    'media': ((1.3, 7.1, 8.0, 7.7), field_style),
+    'not_for_sale': ((0.5, 3.0, 8.0, 6.0), code_style),
+    'rights': ((0.5, 0.5, 8.0, 0.9), small_style),
+}
+
+CONTROL_FORM_BOXES = {
+    'artistid': ((6.5, 9.8, 8.0, 10.4), code_style),
+    'name': ((1.5, 9.3, 8.0, 9.7), field_style),
+    'artistname': ((1.5, 8.9, 8.0, 9.3), field_style),
+    'address': ((1.5, 8.1, 8.0, 8.9), small_style),
+    'contact': ((1.5, 7.7, 8.0, 8.1), small_style),
+}
+
+# Columns of the piece table on the control form, and the position of its
+# first row. Each further row is CONTROL_FORM_ROW_HEIGHT lower.
+CONTROL_FORM_COLUMNS = {
+    'code': (0.5, 1.3),
+    'title': (1.3, 4.6),
+    'media': (4.6, 6.3),
+    'min_bid': (6.3, 7.2),
+    'buy_now': (7.2, 8.0),
+}
+CONTROL_FORM_FIRST_ROW = (7.0, 7.3)
+CONTROL_FORM_ROW_HEIGHT = 0.3
+CONTROL_FORM_PIECES_PER_PAGE = 20
+
+# Avery 5160 / 8160 sheets: 3 columns of 10 labels.
+MAILING_LABEL_COLUMNS = 3
+MAILING_LABEL_ROWS = 10
+MAILING_LABEL_SIZE = (2.625, 1.0)
+MAILING_LABEL_ORIGIN = (0.1875, 0.5)
+MAILING_LABEL_COLUMN_GAP = 0.125
+
+
+def format_price(value):
+    return '$%s' % format(value, ',') if value else ''
+
+
+def bid_sheet_pages(pieces):
+    for piece in pieces:
+        page = {
+            'code': piece.code,
+            'barcode': '*%s*' % piece.code,
+            'artist': piece.artistname(),
+            'title': piece.title(),
+            'media': piece.media,
+        }
+        if piece.not_for_sale:
+            page['not_for_sale'] = 'Not For Sale'
+        else:
+            page['min_bid'] = 'Minimum Bid: %s' % format_price(piece.min_bid)
+            page['buy_now'] = 'Auto Buy: %s' % (format_price(piece.buy_now) if piece.buy_now else 'N/A')
+            page['rights'] = 'This sale %s reproduction rights.' % (
+                'includes' if piece.reproduction_rights_included else 'does not include')
+        yield page
+
+
+def control_form_pages(pieces):
+    for artist, artist_pieces in groupby(pieces, key=lambda piece: piece.artist):
+        person = artist.person
+        header = {
+            'artistid': str(artist.artistid),
+            'name': person.name,
+            'artistname': artist.artistname(),
+            'address': '\n'.join(line for line in (
+                person.address1, person.address2,
+                ' '.join(filter(None, (person.city, person.state, person.postcode))),
+                person.country) if line),
+            'contact': '  '.join(filter(None, (person.phone, person.email))),
+        }
+        rows = [{
+            'code': piece.code,
+            'title': piece.title(),
+            'media': piece.media,
+            'min_bid': 'NFS' if piece.not_for_sale else format_price(piece.min_bid),
+            'buy_now': '' if piece.not_for_sale else format_price(piece.buy_now),
+        } for piece in artist_pieces]
+        for i in range(0, len(rows), CONTROL_FORM_PIECES_PER_PAGE):
+            yield dict(header, rows=rows[i:i + CONTROL_FORM_PIECES_PER_PAGE])
+
+
+def draw_boxes(canvas, boxes, page):
+    for name, (box, style) in boxes.items():
+        text = page.get(name)
+        if text:
+            squeeze_text_into_box(canvas, text, *box, style=style)
+
+
+def draw_bid_sheet(canvas, page):
+    draw_boxes(canvas, BID_SHEET_BOXES, page)
+
+
+def draw_control_form(canvas, page):
+    draw_boxes(canvas, CONTROL_FORM_BOXES, page)
+    y0, y1 = CONTROL_FORM_FIRST_ROW
+    for row in page['rows']:
+        for name, (x0, x1) in CONTROL_FORM_COLUMNS.items():
+            if row[name]:
+                squeeze_text_into_box(canvas, row[name], x0, y0, x1, y1, style=small_style)
+        y0 -= CONTROL_FORM_ROW_HEIGHT
+        y1 -= CONTROL_FORM_ROW_HEIGHT
+
+
+FORMS = {
+    'bid_sheets': ('ARTSHOW_BLANK_BID_SHEET', draw_bid_sheet),
+    'control_forms': ('ARTSHOW_BLANK_CONTROL_FORM', draw_control_form),
+}
+
+
+def render_chunk(kind, blank_path, pages):
+    """Render pages over the blank form, returning the PDF as bytes."""
+    draw = FORMS[kind][1]
+    output = BytesIO()
+    canvas = Canvas(output, pagesize=letter)
+    form = load_pdf_as_form(canvas, blank_path)
+    for page in pages:
+        canvas.doForm(form)
+        draw(canvas, page)
+        canvas.showPage()
+    canvas.save()
+    return output.getvalue()
+
+
+def merge_pdfs(chunks, output):
+    writer = PdfWriter()
+    for chunk in chunks:
+        writer.addpages(PdfReader(fdata=chunk).pages)
+    writer.write(output)
+
+
+def render(kind, pages, output, blank_path=None, workers=None, chunk_size=None):
+    """Render a list of pages of the given kind and write them to output as
+    one PDF. The blank form, number of processes and chunk size default to
+    the values in settings."""
+    if blank_path is None:
+        blank_path = getattr(settings, FORMS[kind][0])
+    chunk_size = chunk_size or settings.ARTSHOW_PREPRINT_CHUNK_SIZE
+    chunks = [pages[i:i + chunk_size] for i in range(0, len(pages), chunk_size)] or [[]]
+
+    workers = workers or settings.ARTSHOW_PREPRINT_WORKERS or os.cpu_count() or 1
+    if multiprocessing.current_process().daemon:
+        # Daemonic processes, such as task queue workers, may not start
+        # child processes of their own.
+        workers = 1
+    workers = min(workers, len(chunks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_pdf_page,
+                                 initargs=(blank_path,)) as executor:
+            rendered = list(executor.map(render_chunk, repeat(kind), repeat(blank_path), chunks))
+    else:
+        rendered = [render_chunk(kind, blank_path, chunk) for chunk in chunks]
+
+    if len(rendered) == 1:
+        output.write(rendered[0])
+    else:
+        merge_pdfs(rendered, output)
+
 
 def control_forms(pieces, output):
-    # TODO implement code
-    raise NotImplementedError
+    pieces = pieces.select_related('artist__person').order_by('artist__artistid', 'pieceid')
+    render('control_forms', list(control_form_pages(pieces)), output)
 
 
 def bid_sheets(pieces, output):
-    # TODO implement code
-    raise NotImplementedError
+    pieces = pieces.select_related('artist__person')
+    render('bid_sheets', list(bid_sheet_pages(pieces)), output)
 
 
 def mailing_labels(artists, output):
-    # TODO implement code
-    raise NotImplementedError
+    canvas = Canvas(output, pagesize=letter)
+    width, height = MAILING_LABEL_SIZE
+    per_page = MAILING_LABEL_COLUMNS * MAILING_LABEL_ROWS
+    for i, artist in enumerate(artists.select_related('person')):
+        if i and i % per_page == 0:
+            canvas.showPage()
+        column, row = divmod(i % per_page, MAILING_LABEL_ROWS)
+        x0 = MAILING_LABEL_ORIGIN[0] + column * (width + MAILING_LABEL_COLUMN_GAP)
+        y1 = letter[1] / inch - MAILING_LABEL_ORIGIN[1] - row * height
+        person = artist.person
+        lines = [artist.chequename(), person.address1, person.address2,
+                 ' '.join(filter(None, (person.city, person.state, person.postcode))), person.country]
+        squeeze_text_into_box(canvas, '\n'.join(line for line in lines if line),
+                              x0, y1 - height, x0 + width, y1, style=field_style)
+    canvas.showPage()
+    canvas.save()
 
 
 def piece_stickers(pieces, output):
@@ -5,7 +5,9 @@
 
 from .models import BatchScan, Piece, Bid, BidderId, Bidder
 import re
+from collections import namedtuple
 from django.apps import apps
+from django.db.models import Count
 from django.db.models.query import transaction
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -30,6 +32,56 @@ person_scan_re = re.compile(r'P(\d+)$')
 comments_re = re.compile(r'\s+#.*')
 
 
+ScanLine = namedtuple('ScanLine', ['lineno', 'kind', 'match'])
+
+
+def parse_lines(lines, patterns):
+    """Strip comments and whitespace from each line in place, and classify it
+    against the (kind, regex) pairs in patterns, tried in order. Returns a
+    ScanLine for every non-blank line; unrecognised lines have a kind of None.
+    """
+    scans = []
+    for lineno, line in enumerate(lines):
+        line = lines[lineno] = comments_re.sub('', line.strip())
+        if line == "":
+            continue
+        for kind, regex in patterns:
+            mo = regex.match(line)
+            if mo:
+                scans.append(ScanLine(lineno, kind, mo))
+                break
+        else:
+            scans.append(ScanLine(lineno, None, None))
+    return scans
+
+
+def piece_key(mo):
+    return int(mo.group(1)), int(mo.group(2))
+
+
+def fetch_pieces(scans, **annotations):
+    """Load every piece referenced by the scanned lines, keyed by
+    (artistid, pieceid)."""
+    keys = {piece_key(scan.match) for scan in scans if scan.kind == 'piece'}
+    if not keys:
+        return {}
+    pieces = Piece.objects.filter(
+        artist__in={artistid for artistid, pieceid in keys},
+        pieceid__in={pieceid for artistid, pieceid in keys},
+    ).annotate(**annotations)
+    return {(piece.artist_id, piece.pieceid): piece for piece in pieces
+            if (piece.artist_id, piece.pieceid) in keys}
+
+
+@transaction.atomic
+def save_changes(pieces, fields, new_bids=()):
+    now = timezone.now()
+    for piece in pieces:
+        piece.updated = now
+    Bid.objects.bulk_create(new_bids)
+    Piece.objects.bulk_update(pieces, fields + ['updated'])
+
+
 class StateL:
     start = 1
     read_location = 2
@@ -46,55 +98,55 @@ def add_error(errors, lines, lineno, message):
         errors.append(message)
 
 
-@transaction.atomic
+location_scan_patterns = [
+    ('location', location_scan_re),
+    ('piece', piece_scan_re),
+    ('end', end_location_scan_re),
+]
+
+
 def process_locations(data):
     errors = []
     state = StateL.start
     current_location = None
     lines = data.splitlines()
-    for lineno, line in enumerate(lines):
-        line = line.strip()
-        line = lines[lineno] = comments_re.sub('', line)
-        lines[lineno] = line
-        if line == "":
-            continue
-        mo = location_scan_re.match(line)
-        if mo:
+    scans = parse_lines(lines, location_scan_patterns)
+    pieces = fetch_pieces(scans)
+    changed_pieces = {}
+    for lineno, kind, mo in scans:
+        if kind == 'location':
             if state not in [StateL.start, StateL.error_skipping]:
                 add_error(errors, lines, lineno, "previous block incomplete")
             current_location = mo.group(1)
             state = StateL.read_location
-        if not mo:
-            if state == StateL.error_skipping:
-                continue
-            mo = piece_scan_re.match(line)
-            if mo:
-                if state == StateL.read_location:
-                    try:
-                        piece = Piece.objects.get(artist=int(mo.group(1)), pieceid=int(mo.group(2)))
-                    except Piece.DoesNotExist:
-                        add_error(errors, lines, lineno, "piece does not exist")
-                        state = State.error_skipping
-                        continue
-                    piece.location = current_location
-                    if piece.status in [Piece.StatusNotInShow, Piece.StatusNotInShowLocked]:
-                        piece.status = Piece.StatusInShow
-                    piece.save()
-                else:
-                    add_error(errors, lines, lineno, "piece not found immediately after location")
-        if not mo:
-            mo = end_location_scan_re.match(line)
-            if mo:
-                if state == StateL.read_location:
-                    state = StateL.start
-                else:
-                    add_error(errors, lines, lineno, "location block ended without being begun")
-        if not mo:
+        elif state == StateL.error_skipping:
+            continue
+        elif kind == 'piece':
+            if state == StateL.read_location:
+                piece = pieces.get(piece_key(mo))
+                if piece is None:
+                    add_error(errors, lines, lineno, "piece does not exist")
+                    state = StateL.error_skipping
+                    continue
+                piece.location = current_location
+                if piece.status in [Piece.StatusNotInShow, Piece.StatusNotInShowLocked]:
+                    piece.status = Piece.StatusInShow
+                changed_pieces[piece.pk] = piece
+            else:
+                add_error(errors, lines, lineno, "piece not found immediately after location")
+        elif kind == 'end':
+            if state == StateL.read_location:
+                state = StateL.start
+            else:
+                add_error(errors, lines, lineno, "location block ended without being begun")
+        else:
             add_error(errors, lines, lineno, "unknown code")
             state = StateL.error_skipping
     if state != StateL.start:
         add_error(errors, lines, None, "last block missing END")
 
+    save_changes(list(changed_pieces.values()), ['location', 'status'])
+
     data = "\n".join(lines)
     return data, errors
 
@@ -107,196 +159,172 @@ class State:
     error_skipping = 99
 
 
-@transaction.atomic
+bid_scan_patterns = [
+    ('piece', piece_scan_re),
+    ('bidder', bidder_scan_re),
+    ('price', price_scan_re),
+    ('normal_sale', normal_sale_scan_re),
+    ('buy_now', buy_now_scan_re),
+    ('auction_sale', auction_sale_scan_re),
+    ('auction_complete', auction_complete_scan_re),
+    ('not_for_sale', not_for_sale_scan_re),
+    ('no_bids', no_bids_scan_re),
+]
+
+
 def process_bids(data, final_scan=False):
     errors = []
     state = State.start
     current_piece = None
-    current_bidder = None
+    current_bidderid = None
     current_price = None
     lines = data.splitlines()
-    for lineno, line in enumerate(lines):
-        line = line.strip()
-        line = lines[lineno] = comments_re.sub('', line)
-        if line == "":
-            continue
-        mo = piece_scan_re.match(line)
-        if mo:
+
+    # Resolve everything the scan refers to up front, so that the blocks
+    # below can be checked without further queries.
+    scans = parse_lines(lines, bid_scan_patterns)
+    pieces = fetch_pieces(scans, bid_count=Count('bid'))
+    bidderids = BidderId.objects.select_related('bidder').in_bulk(
+        {scan.match.group(1) for scan in scans if scan.kind == 'bidder'})
+    bids = {(bid.piece_id, bid.amount): bid
+            for bid in Bid.objects.filter(piece__in=list(pieces.values()), invalid=False)}
+
+    new_bids = []
+    changed_pieces = {}
+
+    def add_bid(lineno, buy_now_bid, match_buy_now):
+        if current_bidderid.bidder is None:
+            add_error(errors, lines, lineno, "bidder does not exist")
+            return False
+        bid = bids.get((current_piece.pk, current_price))
+        if bid is not None and bid.bidder_id == current_bidderid.bidder_id and \
+                (match_buy_now is None or bid.buy_now_bid == match_buy_now):
+            return True
+        bid = Bid(bidder=current_bidderid.bidder, bidderid=current_bidderid,
+                  amount=current_price, piece=current_piece, buy_now_bid=buy_now_bid)
+        try:
+            bid.validate()
+        except ValidationError as x:
+            add_error(errors, lines, lineno, "invalid bid: %s" % str(x))
+            return False
+        new_bids.append(bid)
+        bids[(current_piece.pk, current_price)] = bid
+        current_piece.top_bid_amount = bid.amount
+        current_piece.top_bid_is_buy_now = bid.buy_now_bid
+        current_piece.valid_bid_count += 1
+        current_piece.bid_count += 1
+        return True
+
+    for lineno, kind, mo in scans:
+        if kind == 'piece':
             if state not in [State.start, State.error_skipping]:
                 add_error(errors, lines, lineno, "previous block incomplete")
-            try:
-                current_piece = Piece.objects.get(artist=int(mo.group(1)), pieceid=int(mo.group(2)))
-            except Piece.DoesNotExist:
+            current_piece = pieces.get(piece_key(mo))
+            if current_piece is None:
                 add_error(errors, lines, lineno, "piece does not exist")
                 state = State.error_skipping
             else:
                 state = State.read_piece
-        if not mo:
-            if state == State.error_skipping:
-                continue
-            mo = bidder_scan_re.match(line)
-            if mo:
-                if state == State.read_piece:
-                    try:
-                        current_bidder = BidderId.objects.get(id=mo.group(1)).bidder
-                    except BidderId.DoesNotExist:
-                        add_error(errors, lines, lineno, "bidder does not exist")
-                        state = State.error_skipping
-                    else:
-                        state = State.read_bidder
-                else:
-                    add_error(errors, lines, lineno, "found bidder scan not immediately after piece")
-                    state = State.error_skipping
-        if not mo:
-            mo = price_scan_re.match(line)
-            if mo:
-                if state == State.read_bidder:
-                    current_price = int(mo.group(1))
-                    state = State.read_price
-                else:
-                    add_error(errors, lines, lineno, "found price not immediately after bidder")
+        elif state == State.error_skipping:
+            continue
+        elif kind == 'bidder':
+            if state == State.read_piece:
+                current_bidderid = bidderids.get(mo.group(1))
+                if current_bidderid is None:
+                    add_error(errors, lines, lineno, "bidder does not exist")
                     state = State.error_skipping
-        if not mo:
-            mo = normal_sale_scan_re.match(line)
-            if mo:
-                if state == State.start:
-                    # Skipping extraneous Normal Sale, a common scanning error
-                    pass
-                elif state == State.read_price:
-                    try:
-                        bid = Bid.objects.get(bidder=current_bidder, amount=current_price,
-                                              piece=current_piece, invalid=False)
-                    except Bid.DoesNotExist:
-                        bid = Bid(bidder=current_bidder, amount=current_price, piece=current_piece)
-                        try:
-                            bid.validate()
-                        except ValidationError as x:
-                            add_error(errors, lines, lineno, "invalid bid: %s" % str(x))
-                            state = State.error_skipping
-                            continue
-                        bid.save()
-                    if final_scan:
-                        current_piece.bidsheet_scanned = True
-                        current_piece.status = Piece.StatusWon
-                    current_piece.save()
-                    state = State.start
                 else:
-                    add_error(errors, lines, lineno, "normal sale scan found not immediately after price")
+                    state = State.read_bidder
+            else:
+                add_error(errors, lines, lineno, "found bidder scan not immediately after piece")
+                state = State.error_skipping
+        elif kind == 'price':
+            if state == State.read_bidder:
+                current_price = int(mo.group(1))
+                state = State.read_price
+            else:
+                add_error(errors, lines, lineno, "found price not immediately after bidder")
+                state = State.error_skipping
+        elif kind == 'normal_sale':
+            if state == State.start:
+                # Skipping extraneous Normal Sale, a common scanning error
+                pass
+            elif state == State.read_price:
+                if not add_bid(lineno, buy_now_bid=False, match_buy_now=None):
                     state = State.error_skipping
-        if not mo:
-            mo = buy_now_scan_re.match(line)
-            if mo:
-                if state == State.read_price:
-                    try:
-                        bid = Bid.objects.get(bidder=current_bidder, amount=current_price,
-                                              piece=current_piece, buy_now_bid=True, invalid=False)
-                    except Bid.DoesNotExist:
-                        bid = Bid(bidder=current_bidder, amount=current_price, piece=current_piece, buy_now_bid=True)
-                        try:
-                            bid.validate()
-                        except ValidationError as x:
-                            add_error(errors, lines, lineno, "invalid bid: %s" % str(x))
-                            state = State.error_skipping
-                            continue
-                        bid.save()
-                    if final_scan:
-                        current_piece.bidsheet_scanned = True
-                        current_piece.status = Piece.StatusWon
-                    current_piece.save()
-                    state = State.start
-                else:
-                    add_error(errors, lines, lineno, "buy now scan found not immediately after price")
+                    continue
+                if final_scan:
+                    current_piece.bidsheet_scanned = True
+                    current_piece.status = Piece.StatusWon
+                changed_pieces[current_piece.pk] = current_piece
+                state = State.start
+            else:
+                add_error(errors, lines, lineno, "normal sale scan found not immediately after price")
+                state = State.error_skipping
+        elif kind == 'buy_now':
+            if state == State.read_price:
+                if not add_bid(lineno, buy_now_bid=True, match_buy_now=True):
                     state = State.error_skipping
-        if not mo:
-            mo = auction_sale_scan_re.match(line)
-            if mo:
-                if state == State.read_price:
-                    try:
-                        bid = Bid.objects.get(bidder=current_bidder, amount=current_price,
-                                              piece=current_piece, buy_now_bid=False, invalid=False)
-                    except Bid.DoesNotExist:
-                        bid = Bid(bidder=current_bidder, amount=current_price, piece=current_piece)
-                        try:
-                            bid.validate()
-                        except ValidationError as x:
-                            add_error(errors, lines, lineno, "invalid bid: %s" % str(x))
-                            state = State.error_skipping
-                            continue
-                        bid.save()
-                    if final_scan:
-                        current_piece.bidsheet_scanned = True
-                    current_piece.voice_auction = True
-                    current_piece.save()
-                    state = State.start
-                    pass
-                else:
-                    add_error(errors, lines, lineno, "auction sale scan found not immediately after price")
+                    continue
+                if final_scan:
+                    current_piece.bidsheet_scanned = True
+                    current_piece.status = Piece.StatusWon
+                changed_pieces[current_piece.pk] = current_piece
+                state = State.start
+            else:
+                add_error(errors, lines, lineno, "buy now scan found not immediately after price")
+                state = State.error_skipping
+        elif kind in ('auction_sale', 'auction_complete'):
+            if state == State.read_price:
+                if not add_bid(lineno, buy_now_bid=False, match_buy_now=False):
                     state = State.error_skipping
-        if not mo:
-            mo = auction_complete_scan_re.match(line)
-            if mo:
-                if state == State.read_price:
-                    try:
-                        bid = Bid.objects.get(bidder=current_bidder, amount=current_price,
-                                              piece=current_piece, buy_now_bid=False, invalid=False)
-                    except Bid.DoesNotExist:
-                        bid = Bid(bidder=current_bidder, amount=current_price, piece=current_piece)
-                        try:
-                            bid.validate()
-                        except ValidationError as x:
-                            add_error(errors, lines, lineno, "invalid bid: %s" % str(x))
-                            state = State.error_skipping
-                            continue
-                        bid.save()
-                    if final_scan:
-                        current_piece.bidsheet_scanned = True
+                    continue
+                if final_scan:
+                    current_piece.bidsheet_scanned = True
+                    if kind == 'auction_complete':
                         current_piece.status = Piece.StatusWon
-                    current_piece.voice_auction = True
-                    current_piece.save()
-                    state = State.start
-                    pass
-                else:
-                    add_error(errors, lines, lineno, "auction sale scan found not immediately after price")
-                    state = State.error_skipping
-        if not mo:
-            mo = not_for_sale_scan_re.match(line)
-            if mo:
-                if state == State.read_piece:
-                    if not current_piece.not_for_sale:
-                        add_error(errors, lines, lineno, "Not for sale found on non NFS piece")
-                        state = State.error_skipping
-                        continue
-                    if final_scan:
-                        current_piece.bidsheet_scanned = True
-                    current_piece.save()
-                    state = State.start
-                    pass
-                else:
-                    add_error(errors, lines, lineno, "not for sale scan found not immediately after piece")
+                current_piece.voice_auction = True
+                changed_pieces[current_piece.pk] = current_piece
+                state = State.start
+            else:
+                add_error(errors, lines, lineno, "auction sale scan found not immediately after price")
+                state = State.error_skipping
+        elif kind == 'not_for_sale':
+            if state == State.read_piece:
+                if not current_piece.not_for_sale:
+                    add_error(errors, lines, lineno, "Not for sale found on non NFS piece")
                     state = State.error_skipping
-        if not mo:
-            mo = no_bids_scan_re.match(line)
-            if mo:
-                if state == State.read_piece:
-                    num_bids = current_piece.bid_set.count()
-                    if num_bids > 0:
-                        add_error(errors, lines, lineno, "No Bid found for pieces with bids")
-                        state = State.error_skipping
-                        continue
-                    if final_scan:
-                        current_piece.bidsheet_scanned = True
-                    current_piece.save()
-                    state = State.start
-                else:
-                    add_error(errors, lines, lineno, "no bids scan found not immediately after piece")
+                    continue
+                if final_scan:
+                    current_piece.bidsheet_scanned = True
+                changed_pieces[current_piece.pk] = current_piece
+                state = State.start
+            else:
+                add_error(errors, lines, lineno, "not for sale scan found not immediately after piece")
+                state = State.error_skipping
+        elif kind == 'no_bids':
+            if state == State.read_piece:
+                if current_piece.bid_count > 0:
+                    add_error(errors, lines, lineno, "No Bid found for pieces with bids")
                     state = State.error_skipping
-
-        if not mo:
+                    continue
+                if final_scan:
+                    current_piece.bidsheet_scanned = True
+                changed_pieces[current_piece.pk] = current_piece
+                state = State.start
+            else:
+                add_error(errors, lines, lineno, "no bids scan found not immediately after piece")
+                state = State.error_skipping
+        else:
             add_error(errors, lines, lineno, "unknown line")
             state = State.error_skipping
     if state not in (State.start, State.error_skipping):
         add_error(errors, lines, None, "block incomplete")
 
+    save_changes(list(changed_pieces.values()),
+                 ['status', 'bidsheet_scanned', 'voice_auction'],
+                 new_bids=new_bids)
+
     data = "\n".join(lines)
     return data, errors
 
@@ -0,0 +1,189 @@
+# Artshow Jockey
+# See file COPYING for licence details
+
+"""Per-request query and timing profiles.
+
+ProfilingMiddleware records, for each request, the number of SQL queries and
+the time spent in the database, queries that were run more than once with
+different parameters (the usual sign of a query made in a loop), and the time
+spent rendering templates and PDFs. It is opt-in: set ARTSHOW_PROFILING=1 in
+the environment to add it to MIDDLEWARE.
+
+Each profile is written to the artshow.profiling logger as a JSON line, and
+the most recent are kept in memory for the staff profiling page. The buffer
+belongs to the process, so with several web workers the page only shows the
+requests served by the worker that serves it.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.contrib.auth.decorators import permission_required
+from django.db import connections
+from django.shortcuts import render
+from django.template.base import Template
+from django.utils import timezone
+
+from .conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The most duplicated queries kept with each profile.
+MAX_DUPLICATES = 10
+
+current_profile = contextvars.ContextVar('artshow_profile', default=None)
+
+_buffer_lock = threading.Lock()
+_buffer = None
+
+
+def recent_profiles():
+    """Return the profiles in the buffer, newest first."""
+    with _buffer_lock:
+        return list(reversed(_buffer or ()))
+
+
+def add_profile(record):
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None or _buffer.maxlen != settings.ARTSHOW_PROFILING_BUFFER_SIZE:
+            _buffer = deque(_buffer or (), maxlen=settings.ARTSHOW_PROFILING_BUFFER_SIZE)
+        _buffer.append(record)
+
+
+def clear_profiles():
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.clear()
+
+
+_in_list_re = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+
+
+def fingerprint(sql):
+    """Reduce a query to its shape, so that the same query run with
+    different parameters has the same fingerprint."""
+    return _in_list_re.sub('(...)', ' '.join(sql.split()))
+
+
+class Profile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+        self.fingerprint_times = Counter()
+        self.timings = Counter()
+        self.depths = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper that counts and times each query."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            key = fingerprint(sql)
+            self.queries += 1
+            self.db_time += elapsed
+            self.fingerprints[key] += 1
+            self.fingerprint_times[key] += elapsed
+
+    def duplicates(self):
+        return [
+            {'sql': sql, 'count': count, 'db_ms': round(self.fingerprint_times[sql] * 1000, 3)}
+            for sql, count in self.fingerprints.most_common(MAX_DUPLICATES) if count > 1
+        ]
+
+
+class timer:
+    """Add the time spent in a block to the current request's profile under
+    the given name. Nested timers with the same name are only counted once.
+    Does nothing when the request is not being profiled."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = current_profile.get()
+        if self.profile is not None:
+            self.profile.depths[self.name] += 1
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.depths[self.name] -= 1
+            if not self.profile.depths[self.name]:
+                self.profile.timings[self.name] += time.perf_counter() - self.start
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+_template_timing_installed = False
+
+
+def install_template_timing():
+    """Time every template render. This wraps Template.render in the same way
+    that Django's test runner does to record the templates used."""
+    global _template_timing_installed
+    if not _template_timing_installed:
+        Template.render = timer('template')(Template.render)
+        _template_timing_installed = True
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_template_timing()
+
+    def __call__(self, request):
+        profile = Profile()
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        record = {
+            'timestamp': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'user': request.user.get_username() if hasattr(request, 'user') else '',
+            'duration_ms': round(elapsed * 1000, 3),
+            'queries': profile.queries,
+            'db_ms': round(profile.db_time * 1000, 3),
+            'template_ms': round(profile.timings['template'] * 1000, 3),
+            'pdf_ms': round(profile.timings['pdf'] * 1000, 3),
+            'duplicates': profile.duplicates(),
+        }
+        add_profile(record)
+        logger.info(json.dumps(record, sort_keys=True), extra={'profile': record})
+        return response
+
+
+@permission_required('artshow.is_artshow_staff')
+def profiles(request):
+    enabled = 'artshow.profiling.ProfilingMiddleware' in settings.MIDDLEWARE
+    return render(request, 'artshow/profiling.html', {
+        'enabled': enabled,
+        'profiles': recent_profiles(),
+    })
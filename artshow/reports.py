@@ -1,19 +1,19 @@
 # Artshow Jockey
 # Copyright (C) 2009, 2010 Chris Cogdon
 # See file COPYING for licence details
+from collections import defaultdict
 from decimal import Decimal
+from django.core.paginator import Paginator
+from django.http import JsonResponse
 from django.shortcuts import render
 from django.db.models import (
-    Case, Count, Exists, F, Max, OuterRef, Q, Subquery, Sum, Value as V, When
+    Case, Count, Exists, F, OuterRef, Q, Subquery, Sum, Value as V, When
 )
 from django.db.models.fields import DecimalField
-from django.db.models.functions import Coalesce
 from django.contrib.auth.decorators import permission_required
 from django.views.decorators.clickjacking import xframe_options_sameorigin
-from .models import (
-    Allocation, Artist, Bid, BidderId, Invoice, InvoiceItem, InvoicePayment,
-    Location, PaymentType, Piece, Space
-)
+from . import summary
+from .models import Allocation, Artist, Bidder, BidderId, Location, Piece, Space
 
 
 @permission_required('artshow.is_artshow_staff')
@@ -34,65 +34,83 @@ def artists(request):
     return render(request, 'artshow/reports-artists.html', {'artists': artists, 'query': query})
 
 
-@permission_required('artshow.is_artshow_staff')
-def winning_bidders(request):
-    bidder_ids = BidderId.objects.filter(
-        bidder__isnull=False
-    ).order_by('bidder', 'id')
-    winning_bid_query = Bid.objects.filter(
-        piece=OuterRef('pk'), invalid=False).order_by('-amount')
-    pieces = Piece.objects.select_related(
-        'artist', 'artist__person'
-    ).filter(Exists(winning_bid_query)).annotate(
-        winning_bidder=Subquery(winning_bid_query.values('bidder')[:1]),
-        winning_bid=Subquery(winning_bid_query.values('amount')[:1])
-    ).order_by('winning_bidder', 'artist', 'pieceid')
+# Number of bidders on each page of the winning bidders report.
+WINNING_BIDDERS_PAGE_SIZE = 100
 
-    bidders = []
-    last_bidder = None
-    for bidder_id in bidder_ids:
-        if last_bidder != bidder_id.bidder_id:
-            bidders.append({
-                'bidder': bidder_id.bidder_id,
-                'bidder_ids': [bidder_id.id],
-                'pieces': [],
-            })
-            last_bidder = bidder_id.bidder_id
-        else:
-            bidders[-1]['bidder_ids'].append(bidder_id.id)
 
-    bidder_index = 0
-    for piece in pieces:
-        assert piece.winning_bidder >= bidders[bidder_index]['bidder']
-        while piece.winning_bidder != bidders[bidder_index]['bidder']:
-            bidder_index += 1
-        bidders[bidder_index]['pieces'].append(piece)
+def winning_bidders_queryset():
+    """Bidders with a bidder ID or a winning bid, ordered by their first
+    bidder ID. Bidders without a bidder ID come last."""
+    bidder_ids = BidderId.objects.filter(bidder=OuterRef('pk')).order_by('id')
+    return Bidder.objects.filter(
+        Exists(bidder_ids) | Exists(Piece.objects.filter(top_bidder=OuterRef('pk')))
+    ).annotate(
+        first_bidder_id=Subquery(bidder_ids.values('id')[:1])
+    ).select_related('person').order_by(F('first_bidder_id').asc(nulls_last=True), 'pk')
+
+
+def winning_bidder_groups(bidders):
+    """Return the bidder IDs and winning pieces of each bidder in bidders,
+    using one query for each."""
+    bidder_pks = [bidder.pk for bidder in bidders]
 
-    bidders.sort(key=lambda bidder: bidder['bidder_ids'][0])
+    bidder_ids = defaultdict(list)
+    for bidder, bidder_id in BidderId.objects.filter(bidder__in=bidder_pks) \
+            .order_by('id').values_list('bidder', 'id'):
+        bidder_ids[bidder].append(bidder_id)
+
+    pieces = defaultdict(list)
+    for piece in Piece.objects.select_related('artist', 'artist__person') \
+            .filter(top_bidder__in=bidder_pks).annotate(winning_bid=F('top_bid_amount')) \
+            .order_by('artist', 'pieceid'):
+        pieces[piece.top_bidder_id].append(piece)
+
+    return [{
+        'bidder': bidder.pk,
+        'name': bidder.name(),
+        'bidder_ids': bidder_ids[bidder.pk],
+        'pieces': pieces[bidder.pk],
+    } for bidder in bidders]
+
+
+@permission_required('artshow.is_artshow_staff')
+def winning_bidders(request):
+    paginator = Paginator(winning_bidders_queryset(), WINNING_BIDDERS_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('page'))
+    bidders = winning_bidder_groups(page)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'page': page.number,
+            'num_pages': paginator.num_pages,
+            'bidders': [{
+                'bidder_ids': bidder['bidder_ids'],
+                'name': bidder['name'],
+                'pieces': [{
+                    'code': piece.code,
+                    'title': piece.title(),
+                    'artist': piece.artistname(),
+                    'amount': piece.winning_bid,
+                    'voice_auction': piece.voice_auction,
+                } for piece in bidder['pieces']],
+            } for bidder in bidders],
+        })
 
     return render(request, 'artshow/reports-winning-bidders.html',
-                  {'bidders': bidders})
+                  {'bidders': bidders, 'page': page})
 
 
 @permission_required('artshow.is_artshow_staff')
 def unsold_pieces(request):
-    winning_bid_query = Bid.objects.filter(
-        piece=OuterRef('pk'), invalid=False).order_by('-amount')
     pieces = Piece.objects.select_related(
         'artist', 'artist__person'
-    ).filter(status=Piece.StatusWon).filter(
-        Exists(winning_bid_query)
-    ).annotate(
-        winning_bidder=Subquery(winning_bid_query.values('bidder')[:1]),
-        winning_bidder_name=Subquery(
-            winning_bid_query.values('bidder__person__name')[:1]),
-        winning_bidder_phone=Subquery(
-            winning_bid_query.values('bidder__person__phone')[:1]),
-        winning_bidder_telegram_username=Subquery(
-            winning_bid_query.values('bidder__person__telegram_username')[:1]),
-        winning_bidder_email=Subquery(
-            winning_bid_query.values('bidder__person__email')[:1]),
-        winning_bid=Subquery(winning_bid_query.values('amount')[:1])
+    ).filter(status=Piece.StatusWon, top_bidder__isnull=False).annotate(
+        winning_bidder=F('top_bidder'),
+        winning_bidder_name=F('top_bidder__person__name'),
+        winning_bidder_phone=F('top_bidder__person__phone'),
+        winning_bidder_telegram_username=F('top_bidder__person__telegram_username'),
+        winning_bidder_email=F('top_bidder__person__email'),
+        winning_bid=F('top_bid_amount')
     ).order_by('winning_bidder', 'artist', 'pieceid')
 
     bidders = []
@@ -181,142 +199,14 @@ def artist_payment_report(request):
     return render(request, 'artshow/artist-payment-report.html', {'artists': artists, 'non_zero': non_zero})
 
 
-def get_summary_statistics():
-    max_valid_bid = Max('bid__amount', filter=Q(bid__invalid=False))
-    has_bid = Q(top_bid__isnull=False)
-    general_rating = Q(adult=False)
-    adult_rating = Q(adult=True)
-    piece_showing = ~Q(status__in=[Piece.StatusNotInShow, Piece.StatusNotInShowLocked])
-    voice_auction = Q(voice_auction=True)
-    silent_auction = Q(voice_auction=False)
-
-    piece_stats = Piece.objects.annotate(top_bid=max_valid_bid).aggregate(
-        pieces_entered_all=Count('pk'),
-        pieces_entered_general=Count('pk', filter=general_rating),
-        pieces_entered_adult=Count('pk', filter=adult_rating),
-        pieces_showing_all=Count('pk', filter=piece_showing),
-        pieces_showing_general=Count('pk', filter=piece_showing & general_rating),
-        pieces_showing_adult=Count('pk', filter=piece_showing & adult_rating),
-        bids_all=Count('pk', filter=has_bid),
-        bids_general=Count('pk', filter=has_bid & general_rating),
-        bids_adult=Count('pk', filter=has_bid & adult_rating),
-        pieces_va_all=Count('pk', filter=voice_auction),
-        pieces_va_general=Count('pk', filter=voice_auction & general_rating),
-        pieces_va_adult=Count('pk', filter=voice_auction & adult_rating),
-        bidamt_all=Sum('top_bid'),
-        bidamt_general=Sum('top_bid', filter=general_rating),
-        bidamt_adult=Sum('top_bid', filter=adult_rating),
-        bidamt_va_all=Sum('top_bid', filter=voice_auction),
-        bidamt_va_general=Sum('top_bid', filter=voice_auction & general_rating),
-        bidamt_va_adult=Sum('top_bid', filter=voice_auction & adult_rating),
-        highest_amt_all=Max('top_bid'),
-        highest_amt_general=Max('top_bid', filter=general_rating),
-        highest_amt_adult=Max('top_bid', filter=adult_rating),
-        highest_amt_va_all=Max('top_bid', filter=voice_auction),
-        highest_amt_va_general=Max('top_bid', filter=voice_auction & general_rating),
-        highest_amt_va_adult=Max('top_bid', filter=voice_auction & adult_rating),
-        highest_amt_sa_all=Max('top_bid', filter=silent_auction),
-        highest_amt_sa_general=Max('top_bid', filter=silent_auction & general_rating),
-        highest_amt_sa_adult=Max('top_bid', filter=silent_auction & adult_rating),
-    )
-
-    artist_locations = Location.objects.filter(
-        Q(artist_1=OuterRef('pk')) | Q(artist_2=OuterRef('pk')))
-    artist_stats = Artist.objects.annotate(
-        num_requested=Sum('allocation__requested'),
-        has_allocations=Exists(artist_locations)).aggregate(
-        count=Count('pk'),
-        count_active=Count('pk', filter=Q(num_requested__gt=0)),
-        count_showing=Count('pk', filter=Q(has_allocations=True))
-    )
-
-    decimal_zero = V(0, output_field=DecimalField())
-
-    payment_types = PaymentType.objects.annotate(
-        total_payments=Coalesce(Sum('payment__amount'), decimal_zero))
-    total_payments = sum([pt.total_payments for pt in payment_types])
-
-    tax_paid = Invoice.objects.aggregate(tax_paid=Sum('tax_paid'))['tax_paid'] or Decimal(0)
-    piece_charges = InvoiceItem.objects.aggregate(piece_charges=Sum('price'))['piece_charges'] or Decimal(0)
-    total_charges = tax_paid + piece_charges
-
-    invoice_payments = InvoicePayment.objects.values('payment_method').annotate(total=Sum('amount'))
-    payment_method_choice_dict = dict(InvoicePayment.PaymentMethod.choices)
-    total_invoice_payments = Decimal(0)
-    for ip in invoice_payments:
-        ip['payment_method_desc'] = payment_method_choice_dict[ip['payment_method']]
-        total_invoice_payments += ip['total']
-
-    spaces = Space.objects.annotate(
-        requested=Coalesce(Sum('allocation__requested'), decimal_zero))
-    total_spaces = {
-        'available': 0,
-        'locations': 0,
-        'requested': 0,
-        'allocated': 0,
-        'requested_perc': 0,
-        'allocated_perc': 0
-    }
-    for s in spaces:
-        data = Location.objects.filter(type=s).aggregate(
-            total_count=Sum(Case(When(half_space=True, then=V(0.5)),
-                                 default=V(1),
-                                 output_field=DecimalField())),
-            artist_1_count=Sum(Case(When(Q(half_space=True) | Q(space_is_split=True),
-                                         then=V(0.5)),
-                                    default=V(1),
-                                    output_field=DecimalField()),
-                               filter=Q(artist_1__isnull=False)),
-            artist_2_count=Sum(Case(When(Q(half_space=True) | Q(space_is_split=True),
-                                         then=V(0.5)),
-                                    default=V(1),
-                                    output_field=DecimalField()),
-                               filter=Q(artist_2__isnull=False)))
-        s.locations = data['total_count'] or Decimal(0)
-        s.allocated = (data['artist_1_count'] or Decimal(0)) + \
-                      (data['artist_2_count'] or Decimal(0))
-
-        total_spaces['available'] += s.available
-        total_spaces['locations'] += s.locations
-        total_spaces['requested'] += s.requested
-        total_spaces['allocated'] += s.allocated
-        if s.available:
-            s.requested_perc = s.requested / s.available * 100
-            s.allocated_perc = s.allocated / s.available * 100
-        else:
-            s.requested_perc = 0
-            s.allocated_perc = 0
-    if total_spaces['available']:
-        total_spaces['requested_perc'] = \
-            total_spaces['requested'] / total_spaces['available'] * 100
-        total_spaces['allocated_perc'] = \
-            total_spaces['allocated'] / total_spaces['available'] * 100
-
-    # all_invoices = Invoice.objects.aggregate ( Sum('tax_paid'), Sum('invoicepayment__amount') )
-
-    return {
-        'piece_stats': piece_stats,
-        'artist_stats': artist_stats,
-        'payment_types': payment_types,
-        'total_payments': total_payments,
-        'tax_paid': tax_paid,
-        'piece_charges': piece_charges,
-        'total_charges': total_charges,
-        'total_invoice_payments': total_invoice_payments,
-        'invoice_payments': invoice_payments,
-        'spaces': spaces,
-        'total_spaces': total_spaces,
-    }
-
-
 @permission_required('artshow.is_artshow_staff')
 def show_summary(request):
 
-    statistics = get_summary_statistics()
+    statistics = summary.get_summary_statistics()
     format = request.GET.get("format")
 
     if format == "json":
-        pass
+        return JsonResponse({'statistics': statistics, 'history': summary.history()})
     else:
         return render(request, 'artshow/show-summary.html', statistics)
 
@@ -401,13 +291,9 @@ def sales_percentiles(request):
 
     amounts = []
     perc_amounts = []
-    pieces = Piece.objects.exclude(status=Piece.StatusNotInShow)
-    for p in pieces:
-        try:
-            tb = p.top_bid()
-            amounts.append(tb.amount)
-        except Bid.DoesNotExist:
-            pass
+    amounts = list(Piece.objects.exclude(status=Piece.StatusNotInShow)
+                   .filter(top_bid_amount__isnull=False)
+                   .values_list('top_bid_amount', flat=True))
 
     if amounts:
         amounts.sort()
@@ -0,0 +1,104 @@
+# Artshow Jockey
+# See file COPYING for licence details
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from peeps.models import Person
+
+from .models import (
+    Allocation, Artist, Bid, Bidder, BidderId, ChequePayment, Invoice, InvoiceItem, InvoicePayment,
+    Location, Payment, PaymentType, Piece, ShowStatistics, Space, SquareInvoicePayment,
+    SquarePayment, bulk_deleting_bids
+)
+
+
+def refresh_piece_top_bid(bid):
+    # Update the piece row directly rather than through bid.piece, which may
+    # already have been removed when a piece deletion cascades to its bids.
+    Piece.objects.filter(pk=bid.piece_id).update_top_bids()
+    if Bid.piece.is_cached(bid):
+        bid.piece.refresh_from_db(fields=Piece.TOP_BID_FIELDS)
+    # update_top_bids() only finds the bidders who still have a bid on the
+    # piece, which misses the bidder of a deleted bid.
+    Bidder.invalidate_results([bid.bidder_id])
+    Bid.invalidate_show_has_bids()
+
+
+@receiver(post_save, sender=Bid)
+def bid_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_piece_top_bid(instance)
+
+
+@receiver(post_delete, sender=Bid)
+def bid_deleted(sender, instance, **kwargs):
+    if not bulk_deleting_bids.get():
+        refresh_piece_top_bid(instance)
+
+
+@receiver(post_save, sender=Piece)
+def piece_saved(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        Bidder.invalidate_results_for_pieces([instance.pk])
+
+
+# The results pages show each piece with its artist's name.
+@receiver(post_save, sender=Artist)
+def artist_saved(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        Bidder.invalidate_results_for_pieces(Piece.objects.filter(artist=instance))
+
+
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        Bidder.invalidate_results_for_pieces(Piece.objects.filter(artist__person=instance))
+
+
+# The sections of the show summary calculated from each model. Subclasses
+# are listed separately, since signals are sent with the class being saved.
+SUMMARY_SECTIONS = {
+    Piece: ['pieces'],
+    Artist: ['artists'],
+    Allocation: ['artists', 'spaces'],
+    Location: ['artists', 'spaces'],
+    Space: ['spaces'],
+    PaymentType: ['payments'],
+    Payment: ['payments'],
+    ChequePayment: ['payments'],
+    SquarePayment: ['payments'],
+    Invoice: ['invoices'],
+    InvoiceItem: ['invoices'],
+    InvoicePayment: ['invoices'],
+    SquareInvoicePayment: ['invoices'],
+}
+
+
+def invalidate_summary(sender, raw=False, **kwargs):
+    if not raw:
+        ShowStatistics.invalidate(*SUMMARY_SECTIONS[sender])
+
+
+for model in SUMMARY_SECTIONS:
+    post_save.connect(invalidate_summary, sender=model, dispatch_uid='summary-saved-%s' % model.__name__)
+    post_delete.connect(invalidate_summary, sender=model, dispatch_uid='summary-deleted-%s' % model.__name__)
+
+
+@receiver(post_save, sender=BidderId)
+def bidderid_saved(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and (instance.bidder_id or not created):
+        BidderId.index([instance])
+
+
+@receiver(post_delete, sender=BidderId)
+def bidderid_deleted(sender, instance, **kwargs):
+    # Indexing it without a bidder only removes it.
+    BidderId.index([BidderId(id=instance.id)])
+
+
+@receiver(post_save, sender=Bidder)
+def bidder_saved(sender, instance, created=False, raw=False, **kwargs):
+    # In case the bidder was moved to another person.
+    if not created and not raw:
+        BidderId.index(list(instance.bidderid_set.all()))
@@ -16,10 +16,9 @@ from square.core.api_error import ApiError
 from square.environment import SquareEnvironment
 from square.utils.webhooks_helper import verify_signature
 
+from . import webhooks
 from .conf import settings
-from .models import (
-    SquareInvoicePayment, SquarePayment, SquareTerminal, SquareWebhook
-)
+from .models import SquareInvoicePayment, SquarePayment, SquareTerminal
 
 logger = logging.getLogger(__name__)
 
@@ -201,6 +200,21 @@ def process_checkout_created_or_updated(body):
         payment.save()
 
 
+def ordering_key(body):
+    """Webhooks for the same terminal, or failing that the same checkout or
+    order, are processed in the order they arrived."""
+    data = body.get('data', {})
+    obj = data.get('object', {})
+    if 'checkout' in obj:
+        device_id = obj['checkout'].get('device_options', {}).get('device_id')
+        return f'device:{device_id}' if device_id else f'checkout:{data.get("id", "")}'
+    if 'device_code' in obj:
+        return f'device:{obj["device_code"].get("device_id", "")}'
+    if 'payment' in obj:
+        return f'order:{obj["payment"].get("order_id", "")}'
+    return ''
+
+
 def process_webhook(body):
     if body['type'] in ('payment.created', 'payment.updated'):
         process_payment_created_or_updated(body)
@@ -229,12 +243,7 @@ def webhook(request):
         logger.exception('Received webhook with invalid JSON!')
         return HttpResponse(status=400)
 
-    webhook = SquareWebhook(timestamp=now(), body=body)
-    webhook.save()
-
-    try:
-        process_webhook(body)
-    except Exception:
-        logger.exception('Failed to process webhook!')
+    if not webhooks.receive('square', body, body.get('event_id'), ordering_key(body)):
+        logger.info(f'Ignoring duplicate webhook: {body.get("event_id")}')
 
     return HttpResponse(status=200)
@@ -0,0 +1,258 @@
+# Artshow Jockey
+# See file COPYING for licence details
+
+"""Materialized show summary statistics.
+
+The summary is split into sections, each stored as a ShowStatistics row
+along with a version that is also kept in the cache. Saving or deleting
+anything a section is calculated from deletes that section's version from
+the cache (see artshow.signals and ShowStatistics.invalidate()). Reading the
+summary then only calculates the sections whose stored version no longer
+matches the cache, so a summary page loaded during bidding only recounts the
+pieces, and one loaded while nothing is changing makes a single query.
+
+A snapshot of the whole summary is kept at most every
+ARTSHOW_SUMMARY_SNAPSHOT_INTERVAL seconds while the summary is being read,
+giving a history of the show's sales. The recomputesummary command
+recalculates every section and reports any that had drifted.
+"""
+
+import uuid
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Case, Count, Exists, Max, OuterRef, Q, Sum, Value as V, When
+from django.db.models.fields import DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .conf import settings
+from .models import (
+    Artist, Invoice, InvoiceItem, InvoicePayment, Location, PaymentType, Piece,
+    ShowStatistics, ShowStatisticsSnapshot, Space
+)
+
+SNAPSHOT_CACHE_KEY = 'artshow:summary:snapshot'
+
+
+def piece_statistics():
+    top_bid = 'top_bid_amount'
+    has_bid = Q(top_bid_amount__isnull=False)
+    general_rating = Q(adult=False)
+    adult_rating = Q(adult=True)
+    piece_showing = ~Q(status__in=[Piece.StatusNotInShow, Piece.StatusNotInShowLocked])
+    voice_auction = Q(voice_auction=True)
+    silent_auction = Q(voice_auction=False)
+
+    piece_stats = Piece.objects.aggregate(
+        pieces_entered_all=Count('pk'),
+        pieces_entered_general=Count('pk', filter=general_rating),
+        pieces_entered_adult=Count('pk', filter=adult_rating),
+        pieces_showing_all=Count('pk', filter=piece_showing),
+        pieces_showing_general=Count('pk', filter=piece_showing & general_rating),
+        pieces_showing_adult=Count('pk', filter=piece_showing & adult_rating),
+        bids_all=Count('pk', filter=has_bid),
+        bids_general=Count('pk', filter=has_bid & general_rating),
+        bids_adult=Count('pk', filter=has_bid & adult_rating),
+        pieces_va_all=Count('pk', filter=voice_auction),
+        pieces_va_general=Count('pk', filter=voice_auction & general_rating),
+        pieces_va_adult=Count('pk', filter=voice_auction & adult_rating),
+        bidamt_all=Sum(top_bid),
+        bidamt_general=Sum(top_bid, filter=general_rating),
+        bidamt_adult=Sum(top_bid, filter=adult_rating),
+        bidamt_va_all=Sum(top_bid, filter=voice_auction),
+        bidamt_va_general=Sum(top_bid, filter=voice_auction & general_rating),
+        bidamt_va_adult=Sum(top_bid, filter=voice_auction & adult_rating),
+        highest_amt_all=Max(top_bid),
+        highest_amt_general=Max(top_bid, filter=general_rating),
+        highest_amt_adult=Max(top_bid, filter=adult_rating),
+        highest_amt_va_all=Max(top_bid, filter=voice_auction),
+        highest_amt_va_general=Max(top_bid, filter=voice_auction & general_rating),
+        highest_amt_va_adult=Max(top_bid, filter=voice_auction & adult_rating),
+        highest_amt_sa_all=Max(top_bid, filter=silent_auction),
+        highest_amt_sa_general=Max(top_bid, filter=silent_auction & general_rating),
+        highest_amt_sa_adult=Max(top_bid, filter=silent_auction & adult_rating),
+    )
+    return {'piece_stats': piece_stats}
+
+
+def artist_statistics():
+    artist_locations = Location.objects.filter(
+        Q(artist_1=OuterRef('pk')) | Q(artist_2=OuterRef('pk')))
+    artist_stats = Artist.objects.annotate(
+        num_requested=Sum('allocation__requested'),
+        has_allocations=Exists(artist_locations)).aggregate(
+        count=Count('pk'),
+        count_active=Count('pk', filter=Q(num_requested__gt=0)),
+        count_showing=Count('pk', filter=Q(has_allocations=True))
+    )
+    return {'artist_stats': artist_stats}
+
+
+def space_statistics():
+    decimal_zero = V(0, output_field=DecimalField())
+    spaces = Space.objects.annotate(
+        requested=Coalesce(Sum('allocation__requested'), decimal_zero))
+    total_spaces = {
+        'available': 0,
+        'locations': 0,
+        'requested': 0,
+        'allocated': 0,
+        'requested_perc': 0,
+        'allocated_perc': 0
+    }
+    space_stats = []
+    for s in spaces:
+        data = Location.objects.filter(type=s).aggregate(
+            total_count=Sum(Case(When(half_space=True, then=V(0.5)),
+                                 default=V(1),
+                                 output_field=DecimalField())),
+            artist_1_count=Sum(Case(When(Q(half_space=True) | Q(space_is_split=True),
+                                         then=V(0.5)),
+                                    default=V(1),
+                                    output_field=DecimalField()),
+                               filter=Q(artist_1__isnull=False)),
+            artist_2_count=Sum(Case(When(Q(half_space=True) | Q(space_is_split=True),
+                                         then=V(0.5)),
+                                    default=V(1),
+                                    output_field=DecimalField()),
+                               filter=Q(artist_2__isnull=False)))
+        locations = data['total_count'] or Decimal(0)
+        allocated = (data['artist_1_count'] or Decimal(0)) + \
+                    (data['artist_2_count'] or Decimal(0))
+        space_stats.append({
+            'name': str(s),
+            'available': s.available,
+            'locations': locations,
+            'requested': s.requested,
+            'allocated': allocated,
+            'requested_perc': s.requested / s.available * 100 if s.available else 0,
+            'allocated_perc': allocated / s.available * 100 if s.available else 0,
+        })
+
+        total_spaces['available'] += s.available
+        total_spaces['locations'] += locations
+        total_spaces['requested'] += s.requested
+        total_spaces['allocated'] += allocated
+    if total_spaces['available']:
+        total_spaces['requested_perc'] = \
+            total_spaces['requested'] / total_spaces['available'] * 100
+        total_spaces['allocated_perc'] = \
+            total_spaces['allocated'] / total_spaces['available'] * 100
+
+    return {
+        'spaces': space_stats,
+        'total_spaces': total_spaces,
+    }
+
+
+def payment_statistics():
+    decimal_zero = V(0, output_field=DecimalField())
+    payment_types = [
+        {'name': str(pt), 'total_payments': pt.total_payments}
+        for pt in PaymentType.objects.annotate(
+            total_payments=Coalesce(Sum('payment__amount'), decimal_zero))
+    ]
+    total_payments = sum([pt['total_payments'] for pt in payment_types])
+    return {
+        'payment_types': payment_types,
+        'total_payments': total_payments,
+    }
+
+
+def invoice_statistics():
+    tax_paid = Invoice.objects.aggregate(tax_paid=Sum('tax_paid'))['tax_paid'] or Decimal(0)
+    piece_charges = InvoiceItem.objects.aggregate(piece_charges=Sum('price'))['piece_charges'] or Decimal(0)
+    total_charges = tax_paid + piece_charges
+
+    invoice_payments = list(InvoicePayment.objects.values('payment_method').annotate(total=Sum('amount')))
+    payment_method_choice_dict = dict(InvoicePayment.PaymentMethod.choices)
+    total_invoice_payments = Decimal(0)
+    for ip in invoice_payments:
+        ip['payment_method_desc'] = payment_method_choice_dict[ip['payment_method']]
+        total_invoice_payments += ip['total']
+
+    return {
+        'tax_paid': tax_paid,
+        'piece_charges': piece_charges,
+        'total_charges': total_charges,
+        'total_invoice_payments': total_invoice_payments,
+        'invoice_payments': invoice_payments,
+    }
+
+
+CALCULATIONS = {
+    'pieces': piece_statistics,
+    'artists': artist_statistics,
+    'spaces': space_statistics,
+    'payments': payment_statistics,
+    'invoices': invoice_statistics,
+}
+
+
+def calculate(section):
+    """Calculate a section of the summary and store it. Returns the
+    ShowStatistics row."""
+    version = uuid.uuid4().hex
+    # The version is cached before calculating, so that a change made while
+    # the section is being calculated invalidates the result.
+    cache.set(ShowStatistics.version_cache_key(section), version, None)
+    statistics, created = ShowStatistics.objects.update_or_create(section=section, defaults={
+        'data': CALCULATIONS[section](),
+        'version': version,
+        'updated': timezone.now(),
+    })
+    return statistics
+
+
+def get_summary_statistics(snapshot=True):
+    """Return the whole summary, calculating any sections that have changed
+    since they were stored. Unless snapshot is False, a snapshot is taken if
+    the last one is old enough."""
+    rows = ShowStatistics.objects.in_bulk()
+    versions = cache.get_many([ShowStatistics.version_cache_key(section)
+                               for section in ShowStatistics.SECTIONS])
+    summary = {}
+    for section in ShowStatistics.SECTIONS:
+        row = rows.get(section)
+        if row is None or versions.get(ShowStatistics.version_cache_key(section)) != row.version:
+            row = calculate(section)
+        summary.update(row.data)
+
+    if snapshot and cache.add(SNAPSHOT_CACHE_KEY, True, settings.ARTSHOW_SUMMARY_SNAPSHOT_INTERVAL):
+        take_snapshot(summary)
+    return summary
+
+
+def take_snapshot(summary):
+    return ShowStatisticsSnapshot.objects.create(taken=timezone.now(), data=summary)
+
+
+def recompute():
+    """Calculate every section of the summary from scratch. Returns a list
+    of (section, key, stored value, new value) for every value that had
+    changed since the section was stored."""
+    rows = ShowStatistics.objects.in_bulk()
+    differences = []
+    for section in ShowStatistics.SECTIONS:
+        old = rows[section].data if section in rows else {}
+        new = calculate(section).data
+        for key in sorted(set(old) | set(new)):
+            if old.get(key) != new.get(key):
+                differences.append((section, key, old.get(key), new.get(key)))
+    return differences
+
+
+def history():
+    """The snapshots of the summary, oldest first, reduced to the figures
+    worth charting over the show."""
+    return [
+        {
+            'taken': snapshot.taken,
+            'pieces_with_bids': snapshot.data['piece_stats']['bids_all'],
+            'bid_total': snapshot.data['piece_stats']['bidamt_all'] or Decimal(0),
+            'total_charges': snapshot.data['total_charges'],
+            'total_invoice_payments': snapshot.data['total_invoice_payments'],
+        }
+        for snapshot in ShowStatisticsSnapshot.objects.order_by('taken')
+    ]
@@ -1,236 +1,291 @@
 from django.core import mail
-from django.db.models import F, OuterRef, Subquery
-from django.template.loader import render_to_string
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import get_template
+from django.utils import timezone
 
 from artshowjockey.celery import app
 
-from .models import Bid, Bidder, BulkMessagingTask, Piece
+from .conf import settings
+from .models import Artist, Bidder, BulkMessageSent, BulkMessagingTask, CloseShowTask, PdfRenderJob, Piece
 from .utils import artshow_settings
-from . import telegram
+from . import email1, pdfjobs, telegram, webhooks
 
 
-@app.task(rate_limit='1/s', autoretry_for=(Exception,), retry_backoff=True)
-def send_results_email(task_pk, bidder_pk):
-    bidder = Bidder.objects.get(pk=bidder_pk)
-
-    pieces_won, pieces_not_won, pieces_in_voice_auction = bidder.get_results()
-    text_content = render_to_string('artshow/bid_results_email.txt', {
-        'artshow_settings': artshow_settings,
-        'bidder': bidder,
-        'pieces_won': pieces_won,
-        'pieces_not_won': pieces_not_won,
-        'pieces_in_voice_auction': pieces_in_voice_auction,
-    })
-
-    mail.send_mail(
-        subject=f'{artshow_settings.SITE_NAME} results',
-        message=text_content,
-        from_email=artshow_settings.ARTSHOW_EMAIL_SENDER,
-        recipient_list=[bidder.person.email],
-    )
+# Bulk messages are sent in batches of ARTSHOW_MESSAGING_BATCH_SIZE recipients,
+# or ARTSHOW_TELEGRAM_BATCH_SIZE for Telegram. Each batch is one task, which
+# loads everything its messages need in a few queries, sends them, and then
+# updates the BulkMessagingTask progress. E-mail batches record who they have
+# sent to, so that a batch retried after an SMTP error doesn't send anyone
+# the same message twice. Telegram batches are paced by the Telegram client
+# rather than by a task rate limit.
 
-    BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + 1)
+def start_bulk_messaging(name, pks, batch_task, batch_size=None, **kwargs):
+    pks = sorted(pks)
 
-
-@app.task
-def email_results():
-    bidders = Bidder.objects.filter(person__email_confirmed=True).values_list('pk', flat=True)
-
-    task = BulkMessagingTask(name='Send results via email')
-    task.message_count = len(bidders)
+    task = BulkMessagingTask(name=name)
+    task.message_count = len(pks)
     task.save()
 
+    batch_size = batch_size or settings.ARTSHOW_MESSAGING_BATCH_SIZE
+    for i in range(0, len(pks), batch_size):
+        batch_task.delay(task.pk, pks[i:i + batch_size], **kwargs)
+
+
+def load_bidders(bidder_pks):
+    return list(Bidder.objects.filter(pk__in=bidder_pks).select_related('person')
+                .prefetch_related('bidderid_set').order_by('pk'))
+
+
+def unsent(task_pk, pks):
+    """The pks of the recipients in pks who have not already been sent the
+    task's message, by an earlier attempt at the same batch."""
+    sent = set(BulkMessageSent.objects.filter(task=task_pk, recipient__in=pks)
+               .values_list('recipient', flat=True))
+    return [pk for pk in pks if pk not in sent]
+
+
+def deliver(task_pk, messages):
+    """Send (recipient pk, EmailMessage) pairs over a single connection. The
+    recipients sent to are recorded even if a later message fails, so that
+    when the batch is retried only the rest are sent."""
+    sent = []
+    try:
+        with mail.get_connection() as connection:
+            for pk, message in messages:
+                connection.send_messages([message])
+                sent.append(pk)
+    finally:
+        if sent:
+            BulkMessageSent.objects.bulk_create([BulkMessageSent(task_id=task_pk, recipient=pk) for pk in sent],
+                                                ignore_conflicts=True)
+            BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + len(sent))
+
+
+def send_emails(task_pk, subject, template_name, contexts):
+    """Render template_name for each (bidder, context) pair, and send the
+    results over a single connection."""
+    template = get_template(template_name)
+    deliver(task_pk, [
+        (bidder.pk, mail.EmailMessage(
+            subject=subject,
+            body=template.render(dict(context, artshow_settings=artshow_settings, bidder=bidder)),
+            from_email=artshow_settings.ARTSHOW_EMAIL_SENDER,
+            to=[bidder.person.email],
+        ))
+        for bidder, context in contexts
+    ])
+
+
+def send_telegram_messages(task_pk, template_name, contexts):
+    """Render template_name for each (bidder, context) pair, and send the
+    results as fast as Telegram's rate limits allow. Messages that cannot be
+    sent, for example because the bidder has blocked the bot, are logged and
+    left out of the sent count rather than retried."""
+    template = get_template(template_name)
+    sent = telegram.send_messages([
+        (bidder.person.telegram_chat_id,
+         template.render(dict(context, artshow_settings=artshow_settings, bidder=bidder)))
+        for bidder, context in contexts
+    ])
+    BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + sent)
+
+
+def results_contexts(bidder_pks):
+    bidders = load_bidders(bidder_pks)
+    results = Bidder.results_for_bidders(bidders)
+    contexts = []
     for bidder in bidders:
-        send_results_email.delay(task_pk=task.pk, bidder_pk=bidder)
+        pieces_won, pieces_not_won, pieces_in_voice_auction = results[bidder.pk]
+        contexts.append((bidder, {
+            'pieces_won': pieces_won,
+            'pieces_not_won': pieces_not_won,
+            'pieces_in_voice_auction': pieces_in_voice_auction,
+        }))
+    return contexts
+
+
+def voice_auction_winners(adult):
+    return Piece.objects.filter(
+        status=Piece.StatusWon,
+        voice_auction=True,
+        adult=adult
+    ).values_list('top_bidder', flat=True)
 
 
 @app.task(rate_limit='1/s', autoretry_for=(Exception,), retry_backoff=True)
-def send_results_telegram_message(task_pk, bidder_pk):
-    bidder = Bidder.objects.get(pk=bidder_pk)
+def send_results_emails(task_pk, bidder_pks):
+    send_emails(task_pk, f'{artshow_settings.SITE_NAME} results', 'artshow/bid_results_email.txt',
+                results_contexts(unsent(task_pk, bidder_pks)))
 
-    pieces_won, pieces_not_won, pieces_in_voice_auction = bidder.get_results()
-    text_content = render_to_string('artshow/bid_results_message.txt', {
-        'artshow_settings': artshow_settings,
-        'bidder': bidder,
-        'pieces_won': pieces_won,
-        'pieces_not_won': pieces_not_won,
-        'pieces_in_voice_auction': pieces_in_voice_auction,
-    })
 
-    telegram.send_message(bidder.person.telegram_chat_id, text_content)
+@app.task
+def email_results():
+    bidders = Bidder.objects.filter(person__email_confirmed=True).values_list('pk', flat=True)
+    start_bulk_messaging('Send results via email', bidders, send_results_emails)
+
 
-    BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + 1)
+@app.task(autoretry_for=(Exception,), retry_backoff=True)
+def send_results_telegram_messages(task_pk, bidder_pks):
+    send_telegram_messages(task_pk, 'artshow/bid_results_message.txt', results_contexts(bidder_pks))
 
 
 @app.task
 def telegram_results():
     bidders = Bidder.objects.filter(person__telegram_chat_id__isnull=False).values_list('pk', flat=True)
-
-    task = BulkMessagingTask(name='Send results via Telegram')
-    task.message_count = len(bidders)
-    task.save()
-
-    for bidder in bidders:
-        send_results_telegram_message.delay(task_pk=task.pk, bidder_pk=bidder)
+    start_bulk_messaging('Send results via Telegram', bidders, send_results_telegram_messages,
+                         batch_size=settings.ARTSHOW_TELEGRAM_BATCH_SIZE)
 
 
 @app.task(rate_limit='1/s', autoretry_for=(Exception,), retry_backoff=True)
-def send_voice_results_email(task_pk, bidder_pk, adult):
-    bidder = Bidder.objects.get(pk=bidder_pk)
+def send_voice_results_emails(task_pk, bidder_pks, adult):
     type = 'adult' if adult else 'general'
-
-    text_content = render_to_string('artshow/voice_auction_results_email.txt', {
-        'artshow_settings': artshow_settings,
-        'bidder': bidder,
-        'type': type,
-        'pieces_won': bidder.voice_auction_wins(adult=adult),
-    })
-
-    mail.send_mail(
-        subject=f'{artshow_settings.SITE_NAME} {type} voice auction results',
-        message=text_content,
-        from_email=artshow_settings.ARTSHOW_EMAIL_SENDER,
-        recipient_list=[bidder.person.email],
-    )
-
-    BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + 1)
+    bidders = load_bidders(unsent(task_pk, bidder_pks))
+    pieces_won = Bidder.pieces_won_by_bidders(bidders, voice_auction=True, adult=adult)
+    send_emails(task_pk, f'{artshow_settings.SITE_NAME} {type} voice auction results',
+                'artshow/voice_auction_results_email.txt',
+                [(bidder, {'type': type, 'pieces_won': pieces_won[bidder.pk]}) for bidder in bidders])
 
 
 @app.task
 def email_voice_results(adult):
-    winning_bid_query = Bid.objects.filter(
-        piece=OuterRef('pk'), invalid=False).order_by('-amount')[:1]
-    winning_bidder_ids = Piece.objects.filter(
-        status=Piece.StatusWon,
-        voice_auction=True,
-        adult=adult
-    ).annotate(
-        top_bidder=Subquery(winning_bid_query.values('bidder'))
-    ).values_list('top_bidder', flat=True)
     bidders = Bidder.objects.filter(
-        pk__in=winning_bidder_ids,
+        pk__in=voice_auction_winners(adult),
         person__email_confirmed=True).values_list('pk', flat=True)
 
     type = 'adult' if adult else 'general'
+    start_bulk_messaging(f'Send {type} voice auction results via email', bidders, send_voice_results_emails,
+                         adult=adult)
 
-    task = BulkMessagingTask(name=f'Send {type} voice auction results via email')
-    task.message_count = len(bidders)
-    task.save()
 
-    for bidder in bidders:
-        send_voice_results_email.delay(task_pk=task.pk, bidder_pk=bidder, adult=adult)
-
-
-@app.task(rate_limit='1/s', autoretry_for=(Exception,), retry_backoff=True)
-def send_voice_results_telegram_message(task_pk, bidder_pk, adult):
-    bidder = Bidder.objects.get(pk=bidder_pk)
+@app.task(autoretry_for=(Exception,), retry_backoff=True)
+def send_voice_results_telegram_messages(task_pk, bidder_pks, adult):
     type = 'adult' if adult else 'general'
-
-    text_content = render_to_string('artshow/voice_auction_results_message.txt', {
-        'artshow_settings': artshow_settings,
-        'bidder': bidder,
-        'type': type,
-        'piece_won_count': bidder.voice_auction_wins(adult=adult).count(),
-    })
-
-    telegram.send_message(bidder.person.telegram_chat_id, text_content)
-
-    BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + 1)
+    bidders = load_bidders(bidder_pks)
+    pieces_won = Bidder.pieces_won_by_bidders(bidders, voice_auction=True, adult=adult)
+    send_telegram_messages(task_pk, 'artshow/voice_auction_results_message.txt', [
+        (bidder, {'type': type, 'piece_won_count': len(pieces_won[bidder.pk])}) for bidder in bidders])
 
 
 @app.task
 def telegram_voice_results(adult):
-    winning_bid_query = Bid.objects.filter(
-        piece=OuterRef('pk'), invalid=False).order_by('-amount')[:1]
-    winning_bidder_ids = Piece.objects.filter(
-        status=Piece.StatusWon,
-        voice_auction=True,
-        adult=adult
-    ).annotate(
-        top_bidder=Subquery(winning_bid_query.values('bidder'))
-    ).values_list('top_bidder', flat=True)
     bidders = Bidder.objects.filter(
-        pk__in=winning_bidder_ids,
+        pk__in=voice_auction_winners(adult),
         person__telegram_chat_id__isnull=False).values_list('pk', flat=True)
 
     type = 'adult' if adult else 'general'
-
-    task = BulkMessagingTask(name=f'Send {type} voice auction results via Telegram')
-    task.message_count = len(bidders)
-    task.save()
-
-    for bidder in bidders:
-        send_voice_results_telegram_message.delay(task_pk=task.pk, bidder_pk=bidder, adult=adult)
+    start_bulk_messaging(f'Send {type} voice auction results via Telegram', bidders,
+                         send_voice_results_telegram_messages, adult=adult,
+                         batch_size=settings.ARTSHOW_TELEGRAM_BATCH_SIZE)
 
 
 @app.task(rate_limit='1/s', autoretry_for=(Exception,), retry_backoff=True)
-def send_reminder_email(task_pk, bidder_pk):
-    bidder = Bidder.objects.get(pk=bidder_pk)
-
-    text_content = render_to_string('artshow/unsold_pieces_email.txt', {
-        'artshow_settings': artshow_settings,
-        'bidder': bidder,
-        'unsold_pieces': bidder.unsold_pieces(),
-    })
-
-    mail.send_mail(
-        subject=f'Reminder: {artshow_settings.SITE_NAME} pick-up available',
-        message=text_content,
-        from_email=artshow_settings.ARTSHOW_EMAIL_SENDER,
-        recipient_list=[bidder.person.email],
-    )
-
-    BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + 1)
+def send_reminder_emails(task_pk, bidder_pks):
+    bidders = load_bidders(unsent(task_pk, bidder_pks))
+    unsold_pieces = Bidder.pieces_won_by_bidders(bidders)
+    send_emails(task_pk, f'Reminder: {artshow_settings.SITE_NAME} pick-up available',
+                'artshow/unsold_pieces_email.txt',
+                [(bidder, {'unsold_pieces': unsold_pieces[bidder.pk]}) for bidder in bidders])
 
 
 @app.task
 def email_reminder():
-    winning_bid_query = Bid.objects.filter(
-        piece=OuterRef('pk'), invalid=False).order_by('-amount')[:1]
-    winning_bidder_ids = Piece.objects.filter(status=Piece.StatusWon).annotate(
-        top_bidder=Subquery(winning_bid_query.values('bidder'))
-    ).values_list('top_bidder', flat=True)
+    winning_bidder_ids = Piece.objects.filter(status=Piece.StatusWon).values_list('top_bidder', flat=True)
     bidders = Bidder.objects.filter(
         pk__in=winning_bidder_ids,
         person__email_confirmed=True).values_list('pk', flat=True)
+    start_bulk_messaging('Send reminder for unsold pieces via email', bidders, send_reminder_emails)
 
-    task = BulkMessagingTask(name='Send reminder for unsold pieces via email')
-    task.message_count = len(bidders)
-    task.save()
 
-    for bidder in bidders:
-        send_reminder_email.delay(task.pk, bidder)
+@app.task(autoretry_for=(Exception,), retry_backoff=True)
+def send_reminder_telegram_messages(task_pk, bidder_pks):
+    bidders = load_bidders(bidder_pks)
+    unsold_pieces = Bidder.pieces_won_by_bidders(bidders)
+    send_telegram_messages(task_pk, 'artshow/unsold_pieces_message.txt', [
+        (bidder, {'unsold_piece_count': len(unsold_pieces[bidder.pk])}) for bidder in bidders])
 
 
-@app.task(rate_limit='1/s', autoretry_for=(Exception,), retry_backoff=True)
-def send_reminder_telegram_message(task_pk, bidder_pk):
-    bidder = Bidder.objects.get(pk=bidder_pk)
+@app.task
+def telegram_reminder():
+    winning_bidder_ids = Piece.objects.filter(status=Piece.StatusWon).values_list('top_bidder', flat=True)
+    bidders = Bidder.objects.filter(
+        pk__in=winning_bidder_ids,
+        person__telegram_chat_id__isnull=False).values_list('pk', flat=True)
+    start_bulk_messaging('Send reminder for unsold pieces via Telegram', bidders, send_reminder_telegram_messages,
+                         batch_size=settings.ARTSHOW_TELEGRAM_BATCH_SIZE)
 
-    text_content = render_to_string('artshow/unsold_pieces_message.txt', {
-        'artshow_settings': artshow_settings,
-        'bidder': bidder,
-        'unsold_piece_count': bidder.unsold_pieces().count(),
-    })
 
-    telegram.send_message(bidder.person.telegram_chat_id, text_content)
+def start_close_show():
+    """Create the task row for closing the show. Raises IntegrityError if
+    the show is already being closed."""
+    CloseShowTask.fail_stale()
+    with transaction.atomic():
+        return CloseShowTask.objects.create()
 
-    BulkMessagingTask.objects.filter(pk=task_pk).update(sent_count=F('sent_count') + 1)
+
+@app.task
+def close_show(task_pk=None):
+    task_pk = task_pk or start_close_show().pk
+    try:
+        won, voice_auction = Piece.objects.apply_won_status()
+
+        artist_ids = list(Artist.objects.with_close_show_status().filter(
+            awaiting_voice_auction=False,
+            payments_applied=False,
+        ).order_by('artistid').values_list('pk', flat=True))
+
+        CloseShowTask.objects.filter(pk=task_pk).update(
+            piece_won_count=won, piece_voice_auction_count=voice_auction, artist_count=len(artist_ids),
+            updated=timezone.now())
+
+        batch_size = settings.ARTSHOW_CLOSE_SHOW_BATCH_SIZE
+        for i in range(0, len(artist_ids), batch_size):
+            batch = artist_ids[i:i + batch_size]
+            Artist.settle(Artist.objects.filter(pk__in=batch))
+            CloseShowTask.objects.filter(pk=task_pk).update(
+                processed_count=F('processed_count') + len(batch), updated=timezone.now())
+    except Exception as e:
+        CloseShowTask.objects.filter(pk=task_pk).update(
+            status=CloseShowTask.StatusFailed, error=str(e) or e.__class__.__name__, updated=timezone.now())
+        raise
+    CloseShowTask.objects.filter(pk=task_pk).update(status=CloseShowTask.StatusComplete, updated=timezone.now())
 
 
 @app.task
-def telegram_reminder():
-    winning_bid_query = Bid.objects.filter(
-        piece=OuterRef('pk'), invalid=False).order_by('-amount')[:1]
-    winning_bidder_ids = Piece.objects.filter(status=Piece.StatusWon).annotate(
-        top_bidder=Subquery(winning_bid_query.values('bidder'))
-    ).values_list('top_bidder', flat=True)
-    bidders = Bidder.objects.filter(
-        pk__in=winning_bidder_ids,
-        person__telegram_chat_id__isnull=False).values_list('pk', flat=True)
+def render_pdf(job_pk):
+    pdfjobs.render_job(PdfRenderJob.objects.get(pk=job_pk))
 
-    task = BulkMessagingTask(name='Send reminder for unsold pieces via Telegram')
-    task.message_count = len(bidders)
-    task.save()
 
-    for bidder in bidders:
-        send_reminder_telegram_message.delay(task_pk=task.pk, bidder_pk=bidder)
+@app.task
+def process_webhooks(kind):
+    webhooks.drain(kind)
+
+
+@app.task(rate_limit='1/s', autoretry_for=(Exception,), retry_backoff=True)
+def send_artist_emails(task_pk, artist_pks, subject, template_str, signature):
+    """Send an e-mail template to a batch of artists. The template is given
+    as text rather than by pk, so that every batch sends the template as it
+    was when the mailing started."""
+    template = email1.compile_template(template_str)
+    artists = email1.prefetch_artists(Artist.objects.filter(pk__in=unsent(task_pk, artist_pks)).order_by('pk'))
+    deliver(task_pk, [
+        (artist.pk, mail.EmailMessage(
+            subject=subject,
+            body=email1.render_email(template, email1.artist_context(artist, signature)),
+            from_email=artshow_settings.ARTSHOW_EMAIL_SENDER,
+            to=[artist.person.email],
+        ))
+        for artist in artists
+    ])
+
+
+def email_artists(artist_pks, subject, template_str, signature):
+    """Start sending an e-mail template to the given artists in the
+    background. Artists without an e-mail address are skipped. Returns the
+    number of e-mails to be sent."""
+    artist_pks = list(Artist.objects.filter(pk__in=artist_pks).exclude(person__email='')
+                      .values_list('pk', flat=True))
+    name = ('Send "%s" to artists via email' % subject)[:BulkMessagingTask._meta.get_field('name').max_length]
+    start_bulk_messaging(name, artist_pks, send_artist_emails,
+                         subject=subject, template_str=template_str, signature=signature)
+    return len(artist_pks)
@@ -3,7 +3,6 @@ from django.contrib.auth.decorators import permission_required
 from django.http import HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse
-from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods, require_POST
 
@@ -13,15 +12,15 @@ import json
 import logging
 import requests
 
+from . import telegram_client, webhooks
 from .conf import settings
-from .models import TelegramWebhook
 
 logger = logging.getLogger(__name__)
 
 
 @cache
 def api_url():
-    return f'https://api.telegram.org/bot{settings.ARTSHOW_TELEGRAM_BOT_TOKEN}'
+    return f'{settings.ARTSHOW_TELEGRAM_API_URL}/bot{settings.ARTSHOW_TELEGRAM_BOT_TOKEN}'
 
 
 @permission_required('artshow.is_artshow_staff')
@@ -59,13 +58,13 @@ def delete_webhook(request):
 
 
 def send_message(chat_id, text):
-    response = requests.post(f'{api_url()}/sendMessage', {
-        'chat_id': chat_id,
-        'parse_mode': 'HTML',
-        'text': text
-    })
-    if response.status_code != 200:
-        raise Exception(f'Failed to send Telegram message ({response.status_code}): {response.text}')
+    telegram_client.client().send_message(chat_id, text)
+
+
+def send_messages(messages):
+    """Send a list of (chat_id, text) pairs. Returns the number sent."""
+    errors = telegram_client.client().send_messages(messages)
+    return errors.count(None)
 
 
 def process_message(message):
@@ -93,12 +92,9 @@ def webhook(request):
         logger.exception('Received webhook with invalid JSON!')
         return HttpResponse(status=400)
 
-    webhook = TelegramWebhook(timestamp=now(), body=body)
-    webhook.save()
-
-    try:
-        process_update(body)
-    except Exception:
-        logger.exception('Failed to process webhook!')
+    # Updates from the same chat are processed in the order they arrived.
+    chat_id = body.get('message', {}).get('chat', {}).get('id')
+    if not webhooks.receive('telegram', body, body.get('update_id'), f'chat:{chat_id}' if chat_id else ''):
+        logger.info(f'Ignoring duplicate update: {body.get("update_id")}')
 
     return HttpResponse(status=200)
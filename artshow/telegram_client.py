@@ -0,0 +1,228 @@
+# Artshow Jockey
+# See file COPYING for licence details
+
+"""Client for the Telegram Bot API.
+
+Requests go through one pooled requests.Session, so sending many messages
+reuses a few connections rather than opening a new one for each message.
+
+Messages are paced by token buckets that follow Telegram's documented
+limits: about 30 messages a second in total, one a second to a single chat,
+and 20 a minute to a group. A 429 response is retried after the number of
+seconds Telegram asks for.
+
+Messages are sent by more than one process, such as the webhooks worker and
+the bulk messaging tasks. When the cache is Redis or Memcached, the client
+made by client() counts messages there, so the limits hold across every
+process. Other cache backends cannot add to a count atomically, so the
+client then falls back to buckets of its own, and the limits only hold for
+each process.
+"""
+
+import logging
+import threading
+import time
+from functools import cache
+
+import requests
+from django.core.cache import caches
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramError(Exception):
+    def __init__(self, status, description, retry_after=None):
+        super().__init__(f'Telegram API error ({status}): {description}')
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows rate events a second on average, with bursts of up to capacity
+    events."""
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def delay(self):
+        """Take a token, and return how many seconds to wait before using
+        it."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.delay()
+        if wait > 0:
+            self.sleep(wait)
+
+
+class SharedRateLimit:
+    """Allows rate events a second, counted in a cache shared between
+    processes. The cache's add() and incr() must be atomic, as they are with
+    Redis and Memcached, or concurrent events are lost from the count. Events
+    are counted in fixed windows of the clock, a second long or long enough
+    for one event at slower rates, so up to twice the limit may pass around
+    the end of a window. The clock must agree between the processes."""
+
+    def __init__(self, cache, key, rate, clock=time.time, sleep=time.sleep):
+        self.cache = cache
+        self.key = key
+        self.period = max(1.0, 1 / rate)
+        self.limit = round(rate * self.period)
+        self.clock = clock
+        self.sleep = sleep
+
+    def delay(self):
+        """Take a place in the current window, and return 0, or how many
+        seconds to wait for the next window if it is full."""
+        now = self.clock()
+        window = int(now // self.period)
+        key = f'{self.key}:{window}'
+        timeout = int(self.period) + 1
+        self.cache.add(key, 0, timeout)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # The count expired between being added and incremented.
+            self.cache.add(key, 1, timeout)
+            count = 1
+        if count <= self.limit:
+            return 0
+        return (window + 1) * self.period - now
+
+    def acquire(self):
+        while (wait := self.delay()) > 0:
+            self.sleep(wait)
+
+
+class TelegramClient:
+    def __init__(self, token, base_url='https://api.telegram.org', global_rate=30,
+                 chat_rate=1, group_rate=20 / 60, max_retries=3, timeout=10,
+                 clock=time.monotonic, sleep=time.sleep, rate_limit_cache=None):
+        """If rate_limit_cache is given, the rate limits are counted in it and
+        shared with every other client using it, and clock must be the wall
+        clock. Otherwise they belong to this client."""
+        self.url = f'{base_url}/bot{token}'
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.rate_limit_cache = rate_limit_cache
+        if rate_limit_cache is None:
+            self.global_bucket = TokenBucket(global_rate, global_rate, clock, sleep)
+        else:
+            self.global_bucket = SharedRateLimit(rate_limit_cache, 'artshow:telegram:rate', global_rate,
+                                                 clock, sleep)
+        self.chat_buckets = {}
+        self.chat_buckets_lock = threading.Lock()
+
+        self.session = requests.Session()
+        # Connection failures are retried here. Rate limiting is handled in
+        # call(), since Telegram says how long to wait.
+        adapter = HTTPAdapter(pool_maxsize=10, max_retries=Retry(
+            total=max_retries, connect=max_retries, read=0, status=0, backoff_factor=0.5,
+            allowed_methods=None))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def chat_bucket(self, chat_id):
+        with self.chat_buckets_lock:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                # Group and channel chat IDs are negative.
+                rate = self.group_rate if int(chat_id) < 0 else self.chat_rate
+                if self.rate_limit_cache is None:
+                    bucket = TokenBucket(rate, 1, self.clock, self.sleep)
+                else:
+                    bucket = SharedRateLimit(self.rate_limit_cache, f'artshow:telegram:rate:{chat_id}', rate,
+                                             self.clock, self.sleep)
+                self.chat_buckets[chat_id] = bucket
+            return bucket
+
+    def call(self, method, params=None, http_method='post'):
+        """Call an API method and return its result, retrying when Telegram
+        asks us to slow down."""
+        attempt = 0
+        while True:
+            response = self.session.request(http_method, f'{self.url}/{method}', data=params,
+                                            timeout=self.timeout)
+            try:
+                body = response.json()
+            except ValueError:
+                body = {'description': response.text}
+            if response.status_code == 200 and body.get('ok', True):
+                return body.get('result')
+
+            retry_after = body.get('parameters', {}).get('retry_after')
+            error = TelegramError(response.status_code, body.get('description', ''), retry_after)
+            if response.status_code != 429 or attempt == self.max_retries:
+                raise error
+            attempt += 1
+            logger.info('Telegram rate limit reached, retrying in %ss', retry_after)
+            self.sleep(retry_after or 1)
+
+    def send_message(self, chat_id, text, parse_mode='HTML'):
+        self.global_bucket.acquire()
+        self.chat_bucket(chat_id).acquire()
+        return self.call('sendMessage', {
+            'chat_id': chat_id,
+            'parse_mode': parse_mode,
+            'text': text,
+        })
+
+    def send_messages(self, messages, parse_mode='HTML'):
+        """Send a list of (chat_id, text) pairs in order, as fast as the rate
+        limits allow. A failure to send one message does not stop the others.
+        Returns a list holding None for each message sent, or the exception
+        that stopped it."""
+        errors = []
+        for chat_id, text in messages:
+            try:
+                self.send_message(chat_id, text, parse_mode)
+            except (TelegramError, requests.RequestException) as e:
+                logger.warning('Failed to send Telegram message to %s: %s', chat_id, e)
+                errors.append(e)
+            else:
+                errors.append(None)
+        return errors
+
+
+# Cache backends whose add() and incr() are atomic across processes.
+ATOMIC_CACHES = (BaseMemcachedCache, RedisCache)
+
+
+@cache
+def client():
+    rate_limit_cache = caches['default']
+    if not isinstance(rate_limit_cache, ATOMIC_CACHES):
+        logger.warning('The cache is not Redis or Memcached, so Telegram rate limits are per process')
+        rate_limit_cache = None
+    return TelegramClient(
+        settings.ARTSHOW_TELEGRAM_BOT_TOKEN,
+        base_url=settings.ARTSHOW_TELEGRAM_API_URL,
+        global_rate=settings.ARTSHOW_TELEGRAM_RATE_LIMIT,
+        chat_rate=settings.ARTSHOW_TELEGRAM_CHAT_RATE_LIMIT,
+        clock=time.time,
+        rate_limit_cache=rate_limit_cache,
+    )
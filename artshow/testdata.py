@@ -4,6 +4,7 @@ import random
 
 from .models import Allocation, Artist, Bid, Bidder, BidderId, Location, Piece, Space
 from peeps.models import Person
+from peeps.search import index_people
 
 
 def distribution(max):
@@ -12,11 +13,14 @@ def distribution(max):
     return random.choices(population, weights=weights)[0]
 
 
-def create(email):
-    # Create 99 artists
+def create(email, num_artists=99, num_bidders=500):
+    """Create a show with the given number of artists and bidders. Each
+    artist has a few spaces, each with a few pieces, and each piece has a few
+    bids, so there are around 15 pieces per artist and 3 bids per piece."""
+    # Create artists
     artist_users = [
         User(username=f'artist{i}', email=email.replace('@', f'+artist{i}@'))
-        for i in range(1, 100)
+        for i in range(1, num_artists + 1)
     ]
     artist_users = User.objects.bulk_create(artist_users)
 
@@ -84,8 +88,8 @@ def create(email):
     pieces = Piece.objects.bulk_create(pieces)
     locations = Location.objects.bulk_create(locations)
 
-    # Create 500 bidders
-    bidder_users = [User(username=f'bidder{i}', email=email.replace('@', f'+bidder{i}@')) for i in range(500)]
+    # Create bidders
+    bidder_users = [User(username=f'bidder{i}', email=email.replace('@', f'+bidder{i}@')) for i in range(num_bidders)]
     bidder_users = User.objects.bulk_create(bidder_users)
 
     bidder_people = [
@@ -98,7 +102,11 @@ def create(email):
     bidders = Bidder.objects.bulk_create(bidders)
 
     bidder_ids = [BidderId(id=str(i).zfill(4), bidder=bidder) for i, bidder in enumerate(bidders, start=1)]
-    BidderId.objects.bulk_create(bidder_ids)
+    bidder_ids = BidderId.objects.bulk_create(bidder_ids)
+
+    # bulk_create() skips the signals that index people for searching.
+    index_people(artist_people + bidder_people)
+    BidderId.index(bidder_ids)
 
     # Create bids
     bids = []
@@ -106,9 +114,8 @@ def create(email):
         num_bids = distribution(6)
         bid = piece.min_bid
         for _ in range(num_bids + 1):
-            bidder = random.choice(bidders)
-            bidder_id = bidder.bidderid_set.first()
-            bids.append(Bid(piece=piece, bidder=bidder, amount=bid, bidderid=bidder_id))
+            bidder_id = random.choice(bidder_ids)
+            bids.append(Bid(piece=piece, bidder=bidder_id.bidder, amount=bid, bidderid=bidder_id))
             bid += 10
     Bid.objects.bulk_create(bids)
 
@@ -116,13 +123,13 @@ def create(email):
 def voice_auction():
     pieces = Piece.objects.filter(status=Piece.StatusInShow, voice_auction=True)
     bids = []
-    bidders = Bidder.objects.prefetch_related('bidderid_set').all()
+    bidders = list(Bidder.objects.prefetch_related('bidderid_set'))
 
     for piece in pieces:
         if random.choices((True, False), weights=(9, 1)):
-            bid = piece.top_bid().amount + 10
+            bid = piece.top_bid_amount + 10
             bidder = random.choice(bidders)
-            bidder_id = bidder.bidderid_set.first()
+            bidder_id = bidder.bidderid_set.all()[0]
             bids.append(Bid(piece=piece, bidder=bidder, amount=bid, bidderid=bidder_id))
         piece.status = Piece.StatusWon
 
@@ -0,0 +1,166 @@
+"""Query count and latency benchmarks for the heaviest pages and jobs.
+
+These are not run with the rest of the tests. Run them by naming the module:
+
+    python manage.py test artshow.tests.benchmarks
+
+The show is built with testdata.create(). Its size and the rest of the run
+are configured through environment variables:
+
+    ARTSHOW_BENCHMARK_ARTISTS   number of artists [99]
+    ARTSHOW_BENCHMARK_BIDDERS   number of bidders [500]
+    ARTSHOW_BENCHMARK_SEED      random seed for the test data [0]
+    ARTSHOW_BENCHMARK_REPEAT    times each benchmark is run [3]
+    ARTSHOW_BENCHMARK_OUTPUT    write the results to this JSON file
+    ARTSHOW_BENCHMARK_BASELINE  fail any benchmark that makes more queries
+                                than it did in this earlier JSON output
+
+Each run of a benchmark is rolled back afterwards, so every run starts from
+the same data.
+"""
+
+import json
+import os
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import tasks, testdata
+from ..models import Artist, Bid, Bidder, BidderId, Piece
+from ..processbatchscan import process_bids
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def load_baseline():
+    path = os.environ.get('ARTSHOW_BENCHMARK_BASELINE')
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)['benchmarks']
+
+
+class Benchmarks(TestCase):
+    fixtures = ['artshowpaymenttypes', 'artshowspaces']
+
+    @classmethod
+    def setUpClass(cls):
+        cls.repeat = env_int('ARTSHOW_BENCHMARK_REPEAT', 3)
+        cls.baseline = load_baseline()
+        cls.results = {}
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(env_int('ARTSHOW_BENCHMARK_SEED', 0))
+        testdata.create('benchmark@example.com',
+                        num_artists=env_int('ARTSHOW_BENCHMARK_ARTISTS', 99),
+                        num_bidders=env_int('ARTSHOW_BENCHMARK_BIDDERS', 500))
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.dataset = {
+            'artists': Artist.objects.count(),
+            'bidders': Bidder.objects.count(),
+            'pieces': Piece.objects.count(),
+            'bids': Bid.objects.count(),
+        }
+
+        # The bidder with the most bids, so the bidder pages have the most to
+        # show.
+        cls.bidder = Bidder.objects.select_related('person__user') \
+            .annotate(bid_count=Count('bid')).order_by('-bid_count').first()
+
+        # A bid scan outbidding the top bid on up to a hundred pieces.
+        bidderids = list(BidderId.objects.all()[:20])
+        pieces = Piece.objects.filter(status=Piece.StatusInShow).select_related('artist') \
+            .order_by('pk')[:100]
+        cls.bid_scan = ''.join(
+            'A%dP%d\nB%s\n%d\nNS\n' % (piece.artist.artistid, piece.pieceid,
+                                       random.choice(bidderids).id, piece.top_bid_amount + 10)
+            for piece in pieces)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        output = {'dataset': cls.dataset, 'benchmarks': cls.results}
+        path = os.environ.get('ARTSHOW_BENCHMARK_OUTPUT')
+        if path:
+            with open(path, 'w') as f:
+                json.dump(output, f, indent=2, sort_keys=True)
+        for name, result in sorted(cls.results.items()):
+            print('%-32s %5d queries %8.1f ms' % (name, result['queries'], result['median_ms']))
+
+    def measure(self, name, func):
+        """Run func the configured number of times, recording the number of
+        queries it makes and how long it takes."""
+        times = []
+        queries = []
+        for i in range(self.repeat):
+            cache.clear()
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    func()
+                    times.append((time.perf_counter() - start) * 1000)
+                transaction.set_rollback(True)
+            queries.append(len(context.captured_queries))
+
+        self.results[name] = {
+            'queries': max(queries),
+            'times_ms': [round(t, 3) for t in times],
+            'min_ms': round(min(times), 3),
+            'median_ms': round(statistics.median(times), 3),
+        }
+        if name in self.baseline:
+            self.assertLessEqual(max(queries), self.baseline[name]['queries'],
+                                 '%s makes more queries than the baseline' % name)
+
+    def get(self, url, user=None):
+        self.client.force_login(user or self.user)
+
+        def func():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            # Streamed responses do their work as they are read.
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return func
+
+    def test_bidder_search(self):
+        # A name fragment, as typed into the cashier's search or a lookup.
+        text = self.bidder.person.name.split()[0][:3]
+        self.measure('Bidder.search', lambda: list(Bidder.search(text)[:20]))
+
+    def test_reports_winning_bidders(self):
+        self.measure('reports.winning_bidders', self.get(reverse('artshow-report-winning-bidders')))
+
+    def test_reports_unsold_pieces(self):
+        self.measure('reports.unsold_pieces', self.get(reverse('artshow-report-unsold-pieces')))
+
+    def test_cashier_bidder(self):
+        self.measure('cashier.cashier_bidder',
+                     self.get(reverse('artshow-cashier-bidder', args=[self.bidder.pk])))
+
+    def test_bid_index(self):
+        self.measure('bid.index', self.get(reverse('artshow-bid'), self.bidder.person.user))
+
+    def test_csvreports_pieces(self):
+        self.measure('csvreports.pieces', self.get(reverse('artshow-pieces-csv')))
+
+    def test_workflows_close_show(self):
+        self.measure('workflows.close_show', tasks.close_show)
+
+    def test_process_bids(self):
+        def func():
+            data, errors = process_bids(self.bid_scan)
+            self.assertEqual(errors, [])
+        self.measure('processbatchscan.process_bids', func)
@@ -1,12 +1,18 @@
+from datetime import timedelta
 from decimal import Decimal
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth.models import Permission, User
+from django.db import IntegrityError
 from django.test import Client, TestCase
 from django.urls import reverse
+from django.utils import timezone
 
+from .. import tasks
 from ..models import (
-    Allocation, Artist, Bid, Bidder, BidderId, Location, Payment, Piece, Space)
+    Allocation, Artist, Bid, Bidder, BidderId, ChequePayment, CloseShowTask, Location, Payment,
+    Piece, Space)
 from peeps.models import Person
 
 
@@ -170,6 +176,51 @@ class ArtistTest(TestCase):
             payment_type_id=settings.ARTSHOW_PAYMENT_SENT_PK)
         self.assertEqual(cheque.amount, Decimal(-18))
 
+        cheque = ChequePayment.objects.get(artist=self.artist_2)
+        self.assertEqual(cheque.amount, Decimal(-18))
+        self.assertEqual(cheque.number, '')
+        self.assertEqual(cheque.description, 'Cheque pending number Payee %s' % cheque.payee)
+
+    def test_settle_dry_run(self):
+        with self.assertNumQueries(11):
+            ledger = Artist.settle(Artist.objects.all(), dry_run=True)
+        self.assertEqual(Payment.objects.count(), 0)
+        self.assertEqual(sorted((payment.artist_id, payment.payment_type_id, payment.amount) for payment in ledger), [
+            (self.artist_1.pk, settings.ARTSHOW_SPACE_FEE_PK, Decimal('-67.50')),
+            (self.artist_1.pk, settings.ARTSHOW_COMMISSION_PK, Decimal(-1)),
+            (self.artist_1.pk, settings.ARTSHOW_SALES_PK, Decimal(10)),
+            (self.artist_2.pk, settings.ARTSHOW_SPACE_FEE_PK, Decimal(-70)),
+            (self.artist_2.pk, settings.ARTSHOW_COMMISSION_PK, Decimal(-2)),
+            (self.artist_2.pk, settings.ARTSHOW_SALES_PK, Decimal(20)),
+            (self.artist_4.pk, settings.ARTSHOW_SPACE_FEE_PK, Decimal(-15)),
+        ])
+        self.assertTrue(all(payment.pk is None for payment in ledger))
+
+        saved = Artist.settle(Artist.objects.all())
+        self.assertEqual(Payment.objects.count(), 7)
+        self.assertEqual(sorted((payment.artist_id, payment.amount) for payment in saved),
+                         sorted((payment.artist_id, payment.amount) for payment in ledger))
+
+    def test_close_show_failure(self):
+        with mock.patch.object(Artist, 'settle', side_effect=RuntimeError("Out of cheques")):
+            with self.assertRaises(RuntimeError):
+                tasks.close_show()
+        task = CloseShowTask.objects.get()
+        self.assertEqual((task.status, task.error), (CloseShowTask.StatusFailed, "Out of cheques"))
+
+        # A failed task doesn't block closing the show again.
+        tasks.close_show()
+        self.assertEqual(CloseShowTask.objects.latest('pk').status, CloseShowTask.StatusComplete)
+
+    def test_close_show_stale(self):
+        task = tasks.start_close_show()
+        with self.assertRaises(IntegrityError):
+            tasks.start_close_show()
+        CloseShowTask.objects.filter(pk=task.pk).update(updated=timezone.now() - timedelta(hours=1))
+        tasks.start_close_show()
+        task.refresh_from_db()
+        self.assertEqual(task.status, CloseShowTask.StatusFailed)
+
     def test_close_show(self):
         user = User.objects.create_user(
             username='test', email='test@example.com', password='test')
@@ -182,8 +233,26 @@ class ArtistTest(TestCase):
         response = c.get(reverse('artshow-workflow-close-show'))
         self.assertEqual(response.status_code, 200)
 
-        response = c.post(reverse('artshow-workflow-close-show'))
-        self.assertEqual(response.status_code, 200)
+        response = c.get(reverse('artshow-workflow-close-show'), {'preview': 1})
+        self.assertEqual(len(response.context['ledger']), 7)
+        self.assertContains(response, 'GP:2, GT:1.5')
+        self.assertEqual(Payment.objects.count(), 0)
+
+        with mock.patch.object(tasks.close_show, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = c.post(reverse('artshow-workflow-close-show'))
+            # A second click before the task has started is refused.
+            second = c.post(reverse('artshow-workflow-close-show'), follow=True)
+        self.assertRedirects(response, reverse('artshow-workflow-close-show'))
+        self.assertContains(second, "The show is already being closed.")
+        task = CloseShowTask.objects.get()
+        delay.assert_called_once_with(task.pk)
+
+        tasks.close_show(task.pk)
+
+        task = CloseShowTask.objects.get()
+        self.assertEqual(task.artist_count, 4)
+        self.assertTrue(task.complete)
 
         self.assertEqual(Payment.objects.count(), 7)
 
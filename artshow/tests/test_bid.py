@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import Client, TestCase
 from django.urls import reverse
 
@@ -9,6 +10,8 @@ from peeps.models import Person
 class BidTests(TestCase):
 
     def setUp(self):
+        cache.clear()
+
         artist_person = Person()
         artist_person.save()
 
@@ -102,7 +105,7 @@ class BidTests(TestCase):
         pieces_not_won = response.context['pieces_not_won']
         self.assertListEqual(pieces_not_won, [self.piece1])
         self.assertEqual(pieces_not_won[0].top_bid, 20)
-        self.assertEqual(pieces_not_won[0].top_bidder, self.bidder2.pk)
+        self.assertEqual(pieces_not_won[0].top_bidder_id, self.bidder2.pk)
 
     def testWinningBid(self):
         self.logIn()
@@ -123,7 +126,7 @@ class BidTests(TestCase):
         pieces_won = response.context['pieces_won']
         self.assertListEqual(pieces_won, [self.piece1])
         self.assertEqual(pieces_won[0].top_bid, 20)
-        self.assertEqual(pieces_won[0].top_bidder, self.bidder.pk)
+        self.assertEqual(pieces_won[0].top_bidder_id, self.bidder.pk)
 
     def testWaitingVoiceAuction(self):
         self.logIn()
@@ -148,7 +151,7 @@ class BidTests(TestCase):
         pieces_in_voice_auction = response.context['pieces_in_voice_auction']
         self.assertListEqual(pieces_in_voice_auction, [self.piece1])
         self.assertEqual(pieces_in_voice_auction[0].top_bid, 60)
-        self.assertEqual(pieces_in_voice_auction[0].top_bidder, self.bidder.pk)
+        self.assertEqual(pieces_in_voice_auction[0].top_bidder_id, self.bidder.pk)
 
     def testWonInVoiceAuction(self):
         self.logIn()
@@ -178,7 +181,7 @@ class BidTests(TestCase):
         pieces_won = response.context['pieces_won']
         self.assertListEqual(pieces_won, [self.piece1])
         self.assertEqual(pieces_won[0].top_bid, 70)
-        self.assertEqual(pieces_won[0].top_bidder, self.bidder.pk)
+        self.assertEqual(pieces_won[0].top_bidder_id, self.bidder.pk)
 
     def testLostInVoiceAuction(self):
         self.logIn()
@@ -208,7 +211,75 @@ class BidTests(TestCase):
         pieces_not_won = response.context['pieces_not_won']
         self.assertListEqual(pieces_not_won, [self.piece1])
         self.assertEqual(pieces_not_won[0].top_bid, 100)
-        self.assertEqual(pieces_not_won[0].top_bidder, self.bidder2.pk)
+        self.assertEqual(pieces_not_won[0].top_bidder_id, self.bidder2.pk)
+
+    def testResultsCached(self):
+        self.logIn()
+        self.register()
+        with self.captureOnCommitCallbacks(execute=True):
+            Bid.objects.bulk_create([
+                Bid(bidder=self.bidder, bidderid=self.bidderid, piece=self.piece1, amount=10),
+            ])
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertListEqual(response.context['pieces_won'], [])
+
+        # The piece is won.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.piece1.apply_won_status()
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('artshow-bid'))
+        self.assertListEqual(response.context['pieces_won'], [self.piece1])
+
+        # Cached, until another bidder outbids them.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('artshow-bid'))
+        self.assertListEqual(response.context['pieces_won'], [self.piece1])
+
+        bid = Bid(bidder=self.bidder2, bidderid=self.bidderid2, piece=self.piece1, amount=20)
+        with self.captureOnCommitCallbacks(execute=True):
+            bid.save()
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertListEqual(response.context['pieces_won'], [])
+        self.assertListEqual(response.context['pieces_not_won'], [self.piece1])
+
+        # Nothing is cleared until the change is committed.
+        with self.captureOnCommitCallbacks() as callbacks:
+            bid.delete()
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertListEqual(response.context['pieces_won'], [])
+        for callback in callbacks:
+            callback()
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertListEqual(response.context['pieces_won'], [self.piece1])
+
+        # Renaming the artist changes how the piece is shown.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.piece1.artist.publicname = 'Renamed'
+            self.piece1.artist.save()
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertEqual(response.context['pieces_won'][0].artistname(), 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.piece1.artist.publicname = ''
+            self.piece1.artist.save()
+        response = self.client.get(reverse('artshow-bid'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.piece1.artist.person.name = 'Artist Person'
+            self.piece1.artist.person.save()
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertEqual(response.context['pieces_won'][0].artistname(), 'Artist Person')
+
+        # Status changes made with a queryset update are seen too.
+        with self.captureOnCommitCallbacks(execute=True):
+            Piece.objects.filter(pk=self.piece1.pk).update(status=Piece.StatusInShow, voice_auction=True)
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertListEqual(response.context['pieces_won'], [])
+        self.assertListEqual(response.context['pieces_in_voice_auction'], [self.piece1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Bid.objects.update(invalid=True)
+        response = self.client.get(reverse('artshow-bid'))
+        self.assertFalse(response.context['show_has_bids'])
 
     def testBidLoggedInAlready(self):
         self.logIn()
@@ -272,3 +272,116 @@ class BidEntryTests(TestCase):
             'locations': ['A1', 'A2'],
         }
         self.assertEqual(response.json(), expected)
+
+    def test_save_all_bids(self):
+        data = {
+            'pieces': [
+                {'artist_id': 1, 'piece_id': 1, 'location': 'a2',
+                 'bids': [
+                     {'bidder': '0365327', 'bid': 5, 'buy_now_bid': False},
+                     {'bidder': '0365327', 'bid': 10, 'buy_now_bid': False},
+                 ]},
+                {'artist_id': 1, 'piece_id': 2, 'location': 'A1',
+                 'bids': [
+                     {'bidder': '0365327', 'bid': 10, 'buy_now_bid': False},
+                     {'bidder': '0365327', 'bid': 15, 'buy_now_bid': False},
+                 ]},
+                {'artist_id': 1, 'piece_id': 3, 'location': 'A2',
+                 'bids': [
+                     {'bidder': '0019', 'bid': 5, 'buy_now_bid': False},
+                 ]},
+                {'artist_id': 1, 'piece_id': 4, 'location': 'A2', 'bids': []},
+                {'artist_id': 2, 'piece_id': 1, 'location': 'A2', 'bids': []},
+            ],
+        }
+        # After the session and permission checks, load the pieces, artists,
+        # bidder IDs and existing bids, then update the pieces, load and
+        # delete one bid and add three, recalculating the top bids after each.
+        updated = Piece.objects.get(pieceid=1).updated
+        with self.assertNumQueries(20):
+            response = self.postJson('/artshow/entry/bids/batch/', data)
+        results = response.json()['results']
+
+        self.assertEqual(results[0]['bids'], data['pieces'][0]['bids'])
+        self.assertEqual(results[0]['location'], 'A2')
+        self.assertIsNotNone(results[0]['last_updated'])
+        self.assertEqual(results[1]['bids'], data['pieces'][1]['bids'])
+        self.assertEqual(results[2], {'error': {
+            'field': 'bidder', 'index': 0, 'message': 'Unassigned bidder ID'}})
+        self.assertEqual(results[3], {'error': {
+            'field': 'piece_id', 'message': 'Invalid piece ID'}})
+        self.assertEqual(results[4], {'error': {
+            'field': 'artist_id', 'message': 'Invalid artist ID'}})
+
+        piece = Piece.objects.get(pieceid=1)
+        self.assertEqual(piece.status, Piece.StatusInShow)
+        self.assertGreater(piece.updated, updated)
+        self.assertEqual(piece.top_bid_amount, 10)
+        self.assertEqual(piece.valid_bid_count, 2)
+        piece = Piece.objects.get(pieceid=2)
+        self.assertEqual(piece.top_bid_amount, 15)
+        self.assertEqual(list(piece.bid_set.values_list('amount', flat=True).order_by('amount')), [10, 15])
+        piece = Piece.objects.get(pieceid=3)
+        self.assertIsNone(piece.bids_updated)
+
+    def test_save_all_bids_invalid(self):
+        data = {
+            'pieces': [
+                {'artist_id': 1, 'piece_id': 2, 'location': 'A1',
+                 'bids': [
+                     {'bidder': '0365327', 'bid': 20, 'buy_now_bid': False},
+                     {'bidder': '0365327', 'bid': 10, 'buy_now_bid': False},
+                 ]},
+                {'artist_id': 1, 'piece_id': 2, 'location': 'A1', 'bids': []},
+            ],
+        }
+        response = self.postJson('/artshow/entry/bids/batch/', data)
+        self.assertEqual(response.json()['results'], [
+            {'error': {'field': 'bid', 'index': 1,
+                       'message': 'New bid must be higher than existing bids'}},
+            {'error': {'field': 'piece_id',
+                       'message': 'Piece entered more than once'}},
+        ])
+        self.assertEqual(Bid.objects.filter(piece__pieceid=2).count(), 2)
+
+        response = self.postJson('/artshow/entry/bids/batch/', {'pieces': [{}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_bids_kept(self):
+        piece = Piece.objects.get(pieceid=2)
+        first, last = piece.bid_set.order_by('amount')
+        data = {
+            'bids': [
+                {'bidder': '0365327', 'bid': 10, 'buy_now_bid': False},
+                {'bidder': '0365327', 'bid': 15, 'buy_now_bid': False},
+                {'bidder': '0365327', 'bid': 20, 'buy_now_bid': False},
+            ],
+            'location': 'A1',
+        }
+        response = self.postJson('/artshow/entry/bids/1/2/', data)
+        self.assertEqual(response.json()['bids'], data['bids'])
+        bids = list(piece.bid_set.order_by('amount'))
+        self.assertEqual(bids[0].pk, first.pk)
+        self.assertEqual(bids[2].pk, last.pk)
+
+        # Removing the middle bid deletes only that bid.
+        del data['bids'][1]
+        response = self.postJson('/artshow/entry/bids/1/2/', data)
+        self.assertEqual(response.json()['bids'], data['bids'])
+        self.assertEqual(list(piece.bid_set.order_by('amount').values_list('pk', flat=True)),
+                         [first.pk, last.pk])
+
+    def test_kept_bids_revalidated(self):
+        # Changing the first bid to more than the second is rejected, even
+        # though the second bid is unchanged.
+        data = {
+            'bids': [
+                {'bidder': '0365327', 'bid': 25, 'buy_now_bid': False},
+                {'bidder': '0365327', 'bid': 20, 'buy_now_bid': False},
+            ],
+            'location': 'A1',
+        }
+        response = self.postJson('/artshow/entry/bids/1/2/', data)
+        self.assertEqual(response.json(), {'error': {
+            'field': 'bid', 'index': 1,
+            'message': 'New bid must be higher than existing bids'}})
@@ -0,0 +1,93 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import (
+    Allocation, Artist, Bid, Bidder, BidderId, Location, Piece, Space
+)
+from peeps.models import Person
+
+
+class CsvReportTests(TestCase):
+    fixtures = ['artshowpaymenttypes', 'artshowspaces']
+
+    def setUp(self):
+        User.objects.create_superuser(
+            username='test', email='test@example.com', password='test')
+        self.client = Client()
+        self.client.login(username='test', password='test')
+
+        person = Person(name='Artist Person')
+        person.save()
+        self.artist = Artist(person=person, publicname='Artist 1', artistid=1)
+        self.artist.save()
+
+        gp = Space.objects.get(shortname='GP')
+        Allocation(artist=self.artist, space=gp, requested=1.5).save()
+        Location(name='A1', type=gp, artist_1=self.artist).save()
+        Location(name='A2', type=gp, artist_1=self.artist, space_is_split=True).save()
+
+        person = Person(name='Bidder Person')
+        person.save()
+        bidder = Bidder(person=person)
+        bidder.save()
+        BidderId(id='0019', bidder=bidder).save()
+
+        for pieceid in range(1, 4):
+            Piece(artist=self.artist, pieceid=pieceid, name='Piece %d' % pieceid,
+                  min_bid=5, location='A1').save()
+        Bid(piece=Piece.objects.get(pieceid=2), bidder=bidder, amount=20).save()
+
+    def get_rows(self, url_name):
+        response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return list(csv.DictReader(content.splitlines()))
+
+    def test_artists(self):
+        rows = self.get_rows('artshow-artists-csv')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['artistname'], 'Artist 1')
+        self.assertEqual(rows[0]['req-GP'], '1.5')
+        self.assertEqual(rows[0]['alloc-GP'], '1.5')
+
+    def test_pieces(self):
+        with self.assertNumQueries(4):
+            rows = self.get_rows('artshow-pieces-csv')
+        self.assertEqual([row['code'] for row in rows], ['1-1', '1-2', '1-3'])
+        self.assertEqual(rows[0]['top_bid'], '')
+        self.assertEqual(rows[0]['bidder_ids'], '')
+        self.assertEqual(rows[1]['top_bid'], '20')
+        self.assertEqual(rows[1]['bought_now'], 'No')
+        self.assertEqual(rows[1]['bidder_name'], 'Bidder Person')
+        self.assertEqual(rows[1]['bidder_ids'], '0019')
+
+    def test_winning_bidders(self):
+        with self.assertNumQueries(4):
+            rows = self.get_rows('artshow-winning-bidders-csv')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['bidder_ids'], '0019')
+        self.assertEqual(rows[0]['bidder_name'], 'Bidder Person')
+        self.assertEqual(rows[0]['code'], '1-2')
+        self.assertEqual(rows[0]['amount'], '20')
+
+    def test_bidders(self):
+        rows = self.get_rows('artshow-bidders-csv')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['primary_bidder_id'], '0019')
+
+    def test_payments(self):
+        Artist.apply_space_fees(Artist.objects.all())
+        rows = self.get_rows('artshow-payments-csv')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['description'], 'GP:1.5')
+
+    def test_cheques(self):
+        Artist.apply_winnings_and_commission(Artist.objects.all())
+        Artist.create_cheques(Artist.objects.all())
+        rows = self.get_rows('artshow-cheques-csv')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['payee'], 'Artist Person')
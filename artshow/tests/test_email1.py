@@ -0,0 +1,42 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from .. import email1
+
+
+class WrapTest(SimpleTestCase):
+    def test_wrap(self):
+        text = "Not wrapped, though this line is longer than the width\n.Wrapped at the last space before the width"
+        self.assertEqual(email1.wrap(text, cols=20),
+                         "Not wrapped, though this line is longer than the width\n"
+                         "Wrapped at the last\nspace before the\nwidth")
+
+    def test_long_word(self):
+        self.assertEqual(email1.wrap(".a-very-long-word then  more", cols=5), "a-very-long-word\nthen\nmore")
+        self.assertEqual(email1.wrap(".a-very-long-word", cols=5), "a-very-long-word")
+
+    def test_always_wrap(self):
+        self.assertEqual(email1.wrap("one two three", cols=8, always_wrap=True), "one two\nthree")
+        self.assertEqual(email1.wrap("no dots here"), "no dots here")
+
+
+class CompileTemplateTest(SimpleTestCase):
+    def setUp(self):
+        email1.compile_template.cache_clear()
+
+    def test_cached(self):
+        context = {'name': '<Artist>'}
+        self.assertEqual(email1.make_email2(context, "Dear {{ name }}"), "Dear <Artist>")
+        self.assertEqual(email1.make_email2(context, "Dear {{ name }}"), "Dear <Artist>")
+        self.assertEqual(email1.compile_template.cache_info().hits, 1)
+        # An edited template is compiled again.
+        self.assertEqual(email1.make_email2(context, "Hi {{ name }}"), "Hi <Artist>")
+        self.assertEqual(email1.compile_template.cache_info().misses, 2)
+        self.assertEqual(email1.make_email2(context, "Dear {{ name }}", autoescape=True), "Dear &lt;Artist&gt;")
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('emailbenchmark', messages=10, pieces=2, stdout=out)
+        self.assertIn("cached: 10 messages", out.getvalue())
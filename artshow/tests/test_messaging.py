@@ -0,0 +1,171 @@
+import smtplib
+from unittest import mock
+
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .. import tasks
+from ..models import Artist, Bid, Bidder, BidderId, BulkMessagingTask, EmailTemplate, Piece
+from peeps.models import Person
+
+
+@override_settings(ARTSHOW_MESSAGING_BATCH_SIZE=2)
+class BulkMessagingTest(TestCase):
+
+    def setUp(self):
+        person = Person(name='Artist', email='artist@example.com')
+        person.save()
+        artist = Artist(person=person, artistid=1)
+        artist.save()
+        self.artist = artist
+
+        self.pieces = []
+        for pieceid in range(1, 4):
+            piece = Piece(artist=artist, pieceid=pieceid, name='Piece %d' % pieceid, location='A1')
+            piece.save()
+            self.pieces.append(piece)
+
+        self.bidders = []
+        for i in range(5):
+            person = Person(name='Bidder %d' % i, email='bidder%d@example.com' % i, email_confirmed=True,
+                            telegram_chat_id=1000 + i)
+            person.save()
+            bidder = Bidder(person=person)
+            bidder.save()
+            BidderId(id='00%d9' % i, bidder=bidder).save()
+            self.bidders.append(bidder)
+
+        # Bidder 0 wins piece 1, and bidder 1 outbids bidder 0 on piece 2.
+        # Piece 3 goes to voice auction.
+        bids = [
+            (0, 0, 10), (0, 1, 10), (1, 1, 20),
+        ] + [(i % 5, 2, 10 * (i + 1)) for i in range(6)]
+        Bid.objects.bulk_create([
+            Bid(bidder=self.bidders[b], bidderid=self.bidders[b].bidderid_set.get(), piece=self.pieces[p], amount=a)
+            for b, p, a in bids
+        ])
+        Piece.objects.apply_won_status()
+
+    def test_results_for_bidders(self):
+        with self.assertNumQueries(1):
+            results = Bidder.results_for_bidders(self.bidders)
+        self.assertEqual(results[self.bidders[0].pk], ([self.pieces[0]], [self.pieces[1]], [self.pieces[2]]))
+        self.assertEqual(results[self.bidders[1].pk], ([self.pieces[1]], [], [self.pieces[2]]))
+        self.assertEqual(results[self.bidders[4].pk], ([], [], [self.pieces[2]]))
+        for bidder in self.bidders:
+            self.assertEqual(bidder.get_results(), results[bidder.pk])
+
+    def test_email_results(self):
+        with mock.patch.object(tasks.send_results_emails, 'delay',
+                               side_effect=tasks.send_results_emails) as delay:
+            tasks.email_results()
+        self.assertEqual(delay.call_count, 3)
+
+        task = BulkMessagingTask.objects.get()
+        self.assertEqual(task.message_count, 5)
+        self.assertEqual(task.sent_count, 5)
+
+        self.assertEqual(len(mail.outbox), 5)
+        message = mail.outbox[0]
+        self.assertEqual(message.to, ['bidder0@example.com'])
+        self.assertIn('You have won 1 piece and 1 piece you bid on moved to the voice auction', message.body)
+        self.assertIn('1-2 - "Piece 2" by Artist, Winning bid: $20', message.body)
+
+    def test_batch_query_count(self):
+        task = BulkMessagingTask(name='Test', message_count=2)
+        task.save()
+        # Find who has already been sent the results, load the bidders, their
+        # bidder IDs and their results, then record who was sent them and
+        # update the progress counter.
+        with self.assertNumQueries(6):
+            tasks.send_results_emails(task.pk, [self.bidders[0].pk, self.bidders[1].pk])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_retry_skips_sent(self):
+        task = BulkMessagingTask.objects.create(name='Test', message_count=3)
+        pks = [bidder.pk for bidder in self.bidders[:3]]
+        send_messages = locmem.EmailBackend.send_messages
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True,
+                               side_effect=[1, smtplib.SMTPServerDisconnected("Gone")]):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                tasks.send_reminder_emails(task.pk, pks)
+        task.refresh_from_db()
+        self.assertEqual(task.sent_count, 1)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True,
+                               side_effect=send_messages) as sent:
+            tasks.send_reminder_emails(task.pk, pks)
+        self.assertEqual([call.args[1][0].to for call in sent.call_args_list],
+                         [['bidder1@example.com'], ['bidder2@example.com']])
+        task.refresh_from_db()
+        self.assertEqual(task.sent_count, 3)
+
+    def test_email_artists(self):
+        other = Artist.objects.create(person=Person.objects.create(name='Other', email='other@example.com'),
+                                      artistid=2)
+        no_email = Artist.objects.create(person=Person.objects.create(name='No Email'), artistid=3)
+        template = EmailTemplate.objects.create(
+            name='Pieces', subject='Your pieces',
+            template='Dear {{ artist.person.name }},\n{% for p in pieces_in_show %}{{ p.name }}\n{% endfor %}'
+                     '{{ signature }}')
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(user)
+
+        with mock.patch.object(tasks.send_artist_emails, 'delay') as delay:
+            response = self.client.post(reverse('admin:artshow_artist_changelist'), {
+                'action': 'send_email',
+                helpers.ACTION_CHECKBOX_NAME: [self.artist.pk, other.pk, no_email.pk],
+                'post': 'yes',
+                'template': template.pk,
+                'send_email': 'Send Email',
+            }, follow=True)
+        self.assertContains(response, 'Sending 2 e-mails.')
+        task = BulkMessagingTask.objects.get()
+        self.assertEqual(task.message_count, 2)
+        delay.assert_called_once_with(task.pk, [self.artist.pk, other.pk], subject='Your pieces',
+                                      template_str=template.template, signature='')
+        self.assertEqual(len(mail.outbox), 0)
+
+        # The template is compiled once, and the artists' pieces and
+        # payments are loaded for the whole batch, along with who has
+        # already been sent it.
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True,
+                               side_effect=[1, smtplib.SMTPServerDisconnected("Gone")]):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                tasks.send_artist_emails(*delay.call_args.args, **delay.call_args.kwargs)
+        self.assertEqual(BulkMessagingTask.objects.get().sent_count, 1)
+        mail.outbox = []
+        with self.assertNumQueries(6):
+            tasks.send_artist_emails(*delay.call_args.args, **delay.call_args.kwargs)
+        self.assertEqual([message.to for message in mail.outbox], [['other@example.com']])
+        # As though the first attempt had sent it.
+        mail.outbox.insert(0, mail.EmailMessage('Your pieces', 'Dear Artist,\nPiece 1\nPiece 2\nPiece 3\n',
+                                                to=['artist@example.com']))
+        self.assertEqual(BulkMessagingTask.objects.get().sent_count, 2)
+        self.assertEqual([message.to for message in mail.outbox], [['artist@example.com'], ['other@example.com']])
+        self.assertEqual(mail.outbox[0].subject, 'Your pieces')
+        self.assertEqual(mail.outbox[0].body, 'Dear Artist,\nPiece 1\nPiece 2\nPiece 3\n')
+
+    @override_settings(ARTSHOW_TELEGRAM_BATCH_SIZE=3)
+    def test_telegram_results(self):
+        with mock.patch.object(tasks.send_results_telegram_messages, 'delay',
+                               side_effect=tasks.send_results_telegram_messages) as delay, \
+                mock.patch.object(tasks.telegram, 'send_messages', side_effect=len) as send_messages:
+            tasks.telegram_results()
+        self.assertEqual(delay.call_count, 2)
+        messages = [message for call in send_messages.call_args_list for message in call.args[0]]
+        self.assertEqual(len(messages), 5)
+        self.assertEqual(messages[0][0], 1000)
+        self.assertEqual(BulkMessagingTask.objects.get().sent_count, 5)
+
+    def test_email_reminder(self):
+        with mock.patch.object(tasks.send_reminder_emails, 'delay',
+                               side_effect=tasks.send_reminder_emails):
+            tasks.email_reminder()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['bidder0@example.com', 'bidder1@example.com'])
+        self.assertIn('you still have 1 piece waiting', mail.outbox[0].body)
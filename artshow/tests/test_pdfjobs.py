@@ -0,0 +1,150 @@
+import datetime
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import Permission, User
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import pdfjobs, pdfreports, tasks
+from ..models import Artist, Bid, Bidder, BidderId, ChequePayment, PdfRenderJob, Piece
+from peeps.models import Person
+
+
+class PdfJobsTest(TestCase):
+    fixtures = ['artshowpaymenttypes']
+
+    def setUp(self):
+        self.artifact_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.artifact_root)
+        settings_override = override_settings(ARTSHOW_PDF_ARTIFACT_ROOT=self.artifact_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user(
+            username='test', email='test@example.com', password='test')
+        user.user_permissions.add(
+            Permission.objects.get(codename='is_artshow_staff'))
+        user.save()
+
+        self.client = Client()
+        self.client.login(username='test', password='test')
+
+    def test_store_artifact(self):
+        digest = pdfjobs.store_artifact(b'%PDF-1.4 test')
+        self.assertTrue(pdfjobs.artifact_exists(digest))
+        self.assertEqual(pdfjobs.store_artifact(b'%PDF-1.4 test'), digest)
+        with open(pdfjobs.artifact_path(digest), 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.4 test')
+
+    def test_winning_bidders_pdf(self):
+        with mock.patch.object(tasks.render_pdf, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('artshow-winning-bidders-pdf'))
+        job = PdfRenderJob.objects.get()
+        self.assertRedirects(response, reverse('artshow-pdf-job', args=(job.pk,)))
+        delay.assert_called_once_with(job.pk)
+
+        response = self.client.get(reverse('artshow-pdf-job-status', args=(job.pk,)))
+        self.assertEqual(response.json(), {'status': 'pending'})
+
+        tasks.render_pdf(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PdfRenderJob.StatusComplete)
+
+        response = self.client.get(reverse('artshow-pdf-job-status', args=(job.pk,)))
+        url = reverse('artshow-pdf-job-download', args=(job.pk,))
+        self.assertEqual(response.json(), {'status': 'complete', 'url': url})
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        # A second request with nothing changed reuses the rendered PDF.
+        with mock.patch.object(tasks.render_pdf, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('artshow-winning-bidders-pdf'))
+        self.assertRedirects(response, reverse('artshow-pdf-job', args=(job.pk,)))
+        delay.assert_not_called()
+
+    def test_winning_bidders_version(self):
+        person = Person.objects.create(name='Artist Person')
+        artist = Artist.objects.create(person=person, artistid=1)
+        piece = Piece.objects.create(artist=artist, pieceid=1, name='Piece', min_bid=5)
+        bidder = Bidder.objects.create(person=Person.objects.create(name='Bidder'))
+        other_bidder = Bidder.objects.create(person=Person.objects.create(name='Other Bidder'))
+        bidderid = BidderId.objects.create(id='0019', bidder=bidder)
+        BidderId.objects.create(id='0027', bidder=other_bidder)
+        Bid.objects.create(bidder=bidder, bidderid=bidderid, piece=piece, amount=10)
+
+        version = pdfreports.winning_bidders_version()
+
+        def assertChanged():
+            nonlocal version
+            new_version = pdfreports.winning_bidders_version()
+            self.assertNotEqual(new_version, version)
+            version = new_version
+
+        # Moving the bid to another bidder with a queryset update.
+        Bid.objects.update(bidder=other_bidder)
+        assertChanged()
+        BidderId.objects.filter(pk='0019').update(bidder=other_bidder)
+        assertChanged()
+        person.name = 'Renamed'
+        person.save()
+        assertChanged()
+        Artist.objects.update(publicname='Public Name')
+        assertChanged()
+        Piece.objects.update(name='Retitled')
+        assertChanged()
+
+    def test_request_pdf(self):
+        with mock.patch.object(tasks.render_pdf, 'delay'):
+            job = pdfjobs.request_pdf('winning_bidders', 'winning-bidders.pdf', {}, [1])
+            self.assertEqual(pdfjobs.request_pdf('winning_bidders', 'winning-bidders.pdf', {}, [1]), job)
+            self.assertNotEqual(pdfjobs.request_pdf('winning_bidders', 'winning-bidders.pdf', {}, [2]), job)
+
+            # A completed job whose artifact has gone missing is rendered again.
+            job.status = PdfRenderJob.StatusComplete
+            job.digest = 'f' * 64
+            job.save()
+            self.assertNotEqual(pdfjobs.request_pdf('winning_bidders', 'winning-bidders.pdf', {}, [1]), job)
+
+    def test_cheques_pdf(self):
+        person = Person(name='Artist', address1='1 Main St', city='Anytown', state='CA', postcode='90000')
+        person.save()
+        artist = Artist(person=person)
+        artist.save()
+        cheque = ChequePayment(artist=artist, amount=Decimal('-123.45'), payee='Artist',
+                               date=datetime.date(2024, 1, 31))
+        cheque.clean()
+        cheque.save()
+
+        with self.settings(ARTSHOW_CHEQUES_AS_PDF=True), \
+                mock.patch.object(tasks.render_pdf, 'delay'):
+            response = self.client.post(reverse('artshow-workflow-print-cheques-print'))
+        job = PdfRenderJob.objects.get()
+        self.assertRedirects(response, reverse('artshow-pdf-job', args=(job.pk,)))
+        self.assertEqual(job.params, {'cheque_ids': [cheque.pk]})
+
+        pdfjobs.render_job(job)
+        self.assertEqual(job.status, PdfRenderJob.StatusComplete)
+        with open(pdfjobs.artifact_path(job.digest), 'rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+
+    def test_failed_job(self):
+        job = PdfRenderJob(kind='cheques', filename='cheques.pdf', params={'bogus': 1})
+        job.save()
+        with self.assertRaises(TypeError):
+            tasks.render_pdf(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PdfRenderJob.StatusFailed)
+
+        response = self.client.get(reverse('artshow-pdf-job-status', args=(job.pk,)))
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertIn('TypeError', response.json()['error'])
+
+        response = self.client.get(reverse('artshow-pdf-job-download', args=(job.pk,)))
+        self.assertEqual(response.status_code, 404)
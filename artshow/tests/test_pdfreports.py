@@ -0,0 +1,63 @@
+from io import BytesIO
+
+from django.contrib.auth.models import Permission, User
+from django.test import Client, TestCase
+from django.urls import reverse
+from pdfrw import PdfReader
+
+from ..models import Artist, Piece
+from ..pdfreports import BID_ENTRY_ROWS_PER_PAGE, bid_entry_rows, bid_entry_to_pdf, truncate_to_width
+from peeps.models import Person
+
+
+class BidEntryWorksheetTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username='test', email='test@example.com', password='test')
+        user.user_permissions.add(
+            Permission.objects.get(codename='is_artshow_staff'))
+        user.save()
+
+        for artistid in (1, 2):
+            person = Person(name='Artist %d' % artistid)
+            person.save()
+            artist = Artist(artistid=artistid, person=person,
+                            publicname='Public %d' % artistid if artistid == 2 else '')
+            artist.save()
+            for pieceid in range(1, 4):
+                Piece(artist=artist, pieceid=pieceid, name='Piece %d' % pieceid,
+                      location='B%d' % pieceid).save()
+
+    def test_bid_entry_rows(self):
+        with self.assertNumQueries(1):
+            rows = list(bid_entry_rows(Piece.objects.order_by('location', 'artist__artistid', 'pieceid')))
+        self.assertEqual(rows[:2], [
+            ('B1', 'Artist 1', 'Piece 1', '1-1'),
+            ('B1', 'Public 2', 'Piece 1', '2-1'),
+        ])
+
+    def test_views(self):
+        c = Client()
+        c.login(username='test', password='test')
+        for name in ('artshow-bid-entry-by-artist-pdf', 'artshow-bid-entry-by-location-pdf'):
+            response = c.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertEqual(len(PdfReader(fdata=response.content).pages), 1)
+
+    def test_pagination(self):
+        rows = [('A1', 'Artist', 'Title', '1-%d' % i) for i in range(BID_ENTRY_ROWS_PER_PAGE * 2 + 1)]
+        output = BytesIO()
+        bid_entry_to_pdf(iter(rows), output)
+        self.assertEqual(len(PdfReader(fdata=output.getvalue()).pages), 3)
+
+        output = BytesIO()
+        bid_entry_to_pdf(iter([]), output)
+        self.assertEqual(len(PdfReader(fdata=output.getvalue()).pages), 1)
+
+    def test_truncate_to_width(self):
+        self.assertEqual(truncate_to_width('Short', 100, 'Helvetica', 10), 'Short')
+        truncated = truncate_to_width('A title far too long to fit in the column', 60, 'Helvetica', 10)
+        self.assertTrue(truncated.endswith('…'))
+        self.assertLess(len(truncated), 20)
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from pdfrw import PdfReader
+from reportlab.pdfgen.canvas import Canvas
+
+from .. import preprint
+from ..models import Artist, Piece
+from peeps.models import Person
+
+
+class PreprintTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.blank = os.path.join(directory, 'blank.pdf')
+        canvas = Canvas(self.blank)
+        canvas.drawString(72, 72, 'Blank form')
+        canvas.showPage()
+        canvas.save()
+
+        settings_override = override_settings(
+            ARTSHOW_BLANK_BID_SHEET=self.blank, ARTSHOW_BLANK_CONTROL_FORM=self.blank,
+            ARTSHOW_PREPRINT_CHUNK_SIZE=4)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        for artistid in (1, 2):
+            person = Person(name='Artist %d' % artistid, address1='1 Main St', city='Anytown')
+            person.save()
+            artist = Artist(artistid=artistid, person=person)
+            artist.save()
+            for pieceid in range(1, 6):
+                Piece(artist=artist, pieceid=pieceid, name='Piece %d' % pieceid, min_bid=10,
+                      buy_now=100 if pieceid % 2 else None, not_for_sale=pieceid == 5).save()
+
+    def page_count(self, data):
+        return len(PdfReader(fdata=data).pages)
+
+    def test_bid_sheets(self):
+        pieces = Piece.objects.order_by('artist__artistid', 'pieceid')
+        for workers in (1, 2):
+            with self.settings(ARTSHOW_PREPRINT_WORKERS=workers):
+                output = BytesIO()
+                with self.assertNumQueries(1):
+                    preprint.bid_sheets(pieces, output)
+            self.assertEqual(self.page_count(output.getvalue()), 10)
+
+    def test_control_forms(self):
+        output = BytesIO()
+        preprint.control_forms(Piece.objects.all(), output)
+        self.assertEqual(self.page_count(output.getvalue()), 2)
+
+    def test_mailing_labels(self):
+        output = BytesIO()
+        preprint.mailing_labels(Artist.objects.all(), output)
+        self.assertEqual(self.page_count(output.getvalue()), 1)
+
+    def test_bid_sheet_pages(self):
+        pages = list(preprint.bid_sheet_pages(Piece.objects.filter(artist=1).order_by('pieceid')))
+        self.assertEqual(pages[0]['code'], '1-1')
+        self.assertEqual(pages[0]['buy_now'], 'Auto Buy: $100')
+        self.assertEqual(pages[1]['buy_now'], 'Auto Buy: N/A')
+        self.assertEqual(pages[4]['not_for_sale'], 'Not For Sale')
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('preprintbenchmark', pages=10, workers=[1, 2], stdout=out)
+        self.assertIn('1 worker: 10 pages', out.getvalue())
+        self.assertIn('2 workers: 10 pages', out.getvalue())
@@ -376,6 +376,28 @@ class BidScanTest(BatchScanTestCase):
         batch = create_and_process_batch(2, "WTF\n")
         self.assertProcessingError(batch, 'unknown line')
 
+    def test_same_piece_twice(self):
+        batch = create_and_process_batch(2, "A1P1\nB1001\n10\nNS\nA1P1\nB1001\n10\nNS\nA1P1\nB1001\n12\nNS\n")
+        self.assertProcessingComplete(batch)
+
+        piece = Piece.objects.get(id=self.piece_nobuynow.id)
+        self.assertEqual(piece.bid_set.count(), 2)
+        self.assertEqual(piece.top_bid_amount, 12)
+
+    def test_second_bid_validated_against_first(self):
+        batch = create_and_process_batch(2, "A1P1\nB1001\n20\nNS\nA1P1\nB1001\n12\nNS\n")
+        self.assertProcessingError(batch, 'line 8: invalid bid')
+        self.assertProcessingError(batch, 'New bid must be higher than existing bids')
+        self.assertTrue(batch.data.splitlines()[7].startswith('NS # invalid bid'))
+
+        piece = Piece.objects.get(id=self.piece_nobuynow.id)
+        self.assertEqual(piece.top_bid().amount, 20)
+
+    def test_query_count_independent_of_length(self):
+        data = "A1P1\nB1001\n10\nNS\nA1P2\nB1001\n15\nNBN\nA1P3\nNFS\n"
+        with self.assertNumQueries(10):
+            processbatchscan.process_bids(data * 20, final_scan=True)
+
 
 class LocationScanTest(BatchScanTestCase):
 
@@ -0,0 +1,71 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .. import profiling
+from ..models import Artist, Piece
+from peeps.models import Person
+
+
+@override_settings(MIDDLEWARE=('artshow.profiling.ProfilingMiddleware',) + tuple(settings.MIDDLEWARE))
+class ProfilingTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='test', email='test@example.com')
+        user.user_permissions.add(Permission.objects.get(codename='is_artshow_staff'))
+        self.client.force_login(user)
+        profiling.clear_profiles()
+        self.addCleanup(profiling.clear_profiles)
+
+        person = Person.objects.create(name='Artist')
+        artist = Artist.objects.create(artistid=1, person=person)
+        for pieceid in range(1, 4):
+            Piece.objects.create(artist=artist, pieceid=pieceid, name='Piece %d' % pieceid)
+
+    def test_profile_recorded(self):
+        with self.assertLogs('artshow.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('artshow-reports'))
+            self.assertEqual(response.status_code, 200)
+            self.client.get(reverse('artshow-bid-entry-by-artist-pdf'))
+
+        pdf, page = profiling.recent_profiles()
+        self.assertEqual(page['view'], 'artshow-reports')
+        self.assertEqual(page['status'], 200)
+        self.assertEqual(page['user'], 'test')
+        self.assertGreater(page['queries'], 0)
+        self.assertGreater(page['template_ms'], 0)
+        self.assertEqual(page['pdf_ms'], 0)
+        self.assertEqual(pdf['view'], 'artshow-bid-entry-by-artist-pdf')
+        self.assertGreater(pdf['pdf_ms'], 0)
+
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logged, page)
+
+        with self.assertLogs('artshow.profiling', 'INFO'):
+            response = self.client.get(reverse('artshow-report-profiling'))
+        self.assertContains(response, 'artshow-bid-entry-by-artist-pdf')
+        self.assertTrue(response.context['enabled'])
+
+    @override_settings(ARTSHOW_PROFILING_BUFFER_SIZE=2)
+    def test_buffer_size(self):
+        with self.assertLogs('artshow.profiling', 'INFO'):
+            for i in range(3):
+                self.client.get(reverse('artshow-reports'))
+        self.assertEqual(len(profiling.recent_profiles()), 2)
+
+    def test_duplicates(self):
+        profile = profiling.Profile()
+        with connection.execute_wrapper(profile):
+            for piece in Piece.objects.order_by('pk'):
+                piece.artist = Artist.objects.get(pk=piece.artist_id)
+            list(Piece.objects.filter(pk__in=[1, 2]))
+            list(Piece.objects.filter(pk__in=[1, 2, 3]))
+        self.assertEqual(profile.queries, 6)
+        duplicates = profile.duplicates()
+        self.assertEqual([duplicate['count'] for duplicate in duplicates], [3, 2])
+        self.assertIn('"artshow_artist"', duplicates[0]['sql'])
+        self.assertIn('IN (...)', duplicates[1]['sql'])
@@ -1,8 +1,10 @@
 from decimal import Decimal
+from unittest import mock
 from django.contrib.auth.models import Permission, User
 from django.test import Client, TestCase
 from django.urls import reverse
-from ..models import Artist, Allocation, Location, Space
+from .. import reports
+from ..models import Artist, Allocation, Bid, Bidder, BidderId, Location, Piece, Space
 from peeps.models import Person
 
 
@@ -99,3 +101,51 @@ class ReportTests(TestCase):
                          ['A2', 'A4'])
         self.assertEqual(response.context['artists'][2].locations,
                          [])
+
+
+class WinningBiddersReportTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='test', email='test@example.com')
+        user.user_permissions.add(Permission.objects.get(codename='is_artshow_staff'))
+        self.client.force_login(user)
+
+        artist = Artist.objects.create(person=Person.objects.create(name='Artist'), artistid=1)
+        pieces = [Piece.objects.create(artist=artist, pieceid=i, name='Piece %d' % i) for i in range(1, 4)]
+
+        bidders = [Bidder.objects.create(person=Person.objects.create(name='Bidder %d' % i)) for i in range(3)]
+        BidderId.objects.bulk_create([
+            BidderId(id='0028', bidder=bidders[0]),
+            BidderId(id='0019', bidder=bidders[0]),
+            BidderId(id='0036', bidder=bidders[2]),
+        ])
+        Bid.objects.create(piece=pieces[1], bidder=bidders[0], bidderid_id='0028', amount=20)
+        Bid.objects.create(piece=pieces[0], bidder=bidders[0], bidderid_id='0019', amount=10)
+        # A winning bidder whose bidder ID has since been removed.
+        Piece.objects.filter(pk=pieces[2].pk).update(top_bidder=bidders[1], top_bid_amount=30)
+
+    def test_winning_bidders(self):
+        with self.assertNumQueries(9):
+            response = self.client.get(reverse('artshow-report-winning-bidders'))
+        bidders = response.context['bidders']
+        self.assertEqual([(bidder['bidder_ids'], [piece.code for piece in bidder['pieces']]) for bidder in bidders], [
+            (['0019', '0028'], ['1-1', '1-2']),
+            (['0036'], []),
+            ([], ['1-3']),
+        ])
+        self.assertContains(response, '<th class="bidder">0036</th>', html=True)
+        self.assertContains(response, 'Bidder 1')
+
+    def test_pages(self):
+        with mock.patch.object(reports, 'WINNING_BIDDERS_PAGE_SIZE', 2):
+            response = self.client.get(reverse('artshow-report-winning-bidders'), {'page': 2, 'format': 'json'})
+        self.assertEqual(response.json(), {
+            'page': 2,
+            'num_pages': 2,
+            'bidders': [{
+                'bidder_ids': [],
+                'name': 'Bidder 1',
+                'pieces': [{'code': '1-3', 'title': 'Piece 3', 'artist': 'Artist', 'amount': '30',
+                            'voice_auction': False}],
+            }],
+        })
@@ -0,0 +1,53 @@
+from io import StringIO
+
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import Bidder, BidderId
+from peeps.models import Person, SearchToken
+
+
+class BidderSearchTest(TestCase):
+    def setUp(self):
+        self.alice = Bidder.objects.create(person=Person.objects.create(name='Alice Example', reg_id='R100'))
+        self.bob = Bidder.objects.create(person=Person.objects.create(name='Bob Example', reg_id='R200'))
+        BidderId.objects.create(id='0019', bidder=self.alice)
+        BidderId.objects.create(id='0027', bidder=self.bob)
+
+    def search(self, text):
+        return [bidder.person.name for bidder in Bidder.search(text)]
+
+    def test_search(self):
+        self.assertEqual(self.search('example'), ['Alice Example', 'Bob Example'])
+        self.assertEqual(self.search('0027'), ['Bob Example'])
+        self.assertEqual(self.search('00'), ['Alice Example', 'Bob Example'])
+        self.assertEqual(self.search('r1'), ['Alice Example'])
+        # A whole bidder ID ranks above a name that only starts with it.
+        carol = Bidder.objects.create(person=Person.objects.create(name='Carol 0019x'))
+        self.assertEqual(self.search('0019'), ['Alice Example', carol.person.name])
+
+    def test_bidder_ids_kept_current(self):
+        bidder_id = BidderId.objects.get(id='0019')
+        bidder_id.bidder = self.bob
+        bidder_id.save()
+        self.assertEqual(self.search('0019'), ['Bob Example'])
+        bidder_id.delete()
+        self.assertEqual(self.search('0019'), [])
+        BidderId.objects.create(id='0035')
+        self.assertEqual(self.search('0035'), [])
+
+    def test_rebuild(self):
+        SearchToken.objects.all().delete()
+        call_command('rebuildsearchindex', stdout=StringIO())
+        self.assertEqual(self.search('0019'), ['Alice Example'])
+        self.assertEqual(self.search('bob'), ['Bob Example'])
+
+    def test_cashier(self):
+        user = User.objects.create_user(username='test')
+        user.user_permissions.add(Permission.objects.get(codename='add_invoice'))
+        self.client.force_login(user)
+        response = self.client.post(reverse('artshow-cashier'), {'text': 'alice'})
+        self.assertEqual(list(response.context['bidders']), [self.alice])
+        self.assertContains(response, '0019')
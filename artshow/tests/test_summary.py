@@ -0,0 +1,91 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import summary
+from ..models import (
+    Artist, Bid, Bidder, BidderId, Piece, Payment, ShowStatistics, ShowStatisticsSnapshot
+)
+from ..conf import settings
+from peeps.models import Person
+
+
+class SummaryTest(TestCase):
+    fixtures = ['artshowpaymenttypes', 'artshowspaces']
+
+    def setUp(self):
+        cache.clear()
+        person = Person.objects.create(name='Artist')
+        self.artist = Artist.objects.create(person=person, artistid=1)
+        self.pieces = [
+            Piece.objects.create(artist=self.artist, pieceid=i, name='Piece %d' % i, adult=i == 2,
+                                 status=Piece.StatusInShow)
+            for i in range(1, 4)
+        ]
+        self.bidder = Bidder.objects.create(person=Person.objects.create(name='Bidder'))
+        self.bidderid = BidderId.objects.create(id='0019', bidder=self.bidder)
+        for piece, amount in ((0, 10), (0, 20), (1, 15)):
+            Bid.objects.create(piece=self.pieces[piece], bidder=self.bidder, bidderid=self.bidderid,
+                               amount=amount)
+
+    def test_piece_statistics(self):
+        stats = summary.get_summary_statistics()['piece_stats']
+        self.assertEqual(stats['pieces_entered_all'], 3)
+        self.assertEqual(stats['bids_all'], 2)
+        self.assertEqual(stats['bids_adult'], 1)
+        self.assertEqual(stats['bidamt_all'], Decimal(35))
+        self.assertEqual(stats['highest_amt_general'], Decimal(20))
+
+    def test_only_changed_sections_calculated(self):
+        summary.get_summary_statistics()
+        with self.assertNumQueries(1):
+            summary.get_summary_statistics()
+
+        updated = dict(ShowStatistics.objects.values_list('section', 'updated'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Bid.objects.create(piece=self.pieces[2], bidder=self.bidder, bidderid=self.bidderid, amount=50)
+        stats = summary.get_summary_statistics()
+        self.assertEqual(stats['piece_stats']['bidamt_all'], Decimal(85))
+        changed = [section for section, time in ShowStatistics.objects.values_list('section', 'updated')
+                   if time != updated[section]]
+        self.assertEqual(changed, ['pieces'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(artist=self.artist, amount=Decimal(5),
+                                   payment_type_id=settings.ARTSHOW_PAYMENT_RECEIVED_PK, date=timezone.now())
+        self.assertEqual(summary.get_summary_statistics()['total_payments'], Decimal(5))
+
+    def test_recompute(self):
+        summary.get_summary_statistics()
+        self.assertEqual(ShowStatisticsSnapshot.objects.count(), 1)
+
+        # A change whose invalidation is never committed, as though it was
+        # lost.
+        Bid.objects.filter(amount=15).update(amount=25)
+        Piece.objects.filter(pk=self.pieces[1].pk).update_top_bids()
+        self.assertEqual(summary.get_summary_statistics()['piece_stats']['bidamt_all'], Decimal(35))
+
+        out = StringIO()
+        call_command('recomputesummary', snapshot=True, stdout=out)
+        self.assertIn("pieces: piece_stats", out.getvalue())
+        self.assertIn("1 value changed.", out.getvalue())
+        self.assertEqual(ShowStatisticsSnapshot.objects.count(), 2)
+        self.assertEqual(summary.get_summary_statistics()['piece_stats']['bidamt_all'], Decimal(45))
+
+    def test_json(self):
+        user = User.objects.create_user(username='test')
+        user.user_permissions.add(Permission.objects.get(codename='is_artshow_staff'))
+        self.client.force_login(user)
+        response = self.client.get(reverse('artshow-summary'))
+        self.assertContains(response, 'sales history')
+        response = self.client.get(reverse('artshow-summary'), {'format': 'json'})
+        data = response.json()
+        self.assertEqual(Decimal(data['statistics']['piece_stats']['bidamt_all']), 35)
+        self.assertEqual([(entry['pieces_with_bids'], Decimal(entry['bid_total'])) for entry in data['history']],
+                         [(2, 35)])
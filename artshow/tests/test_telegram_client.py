@@ -0,0 +1,185 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, override_settings
+
+from .. import telegram_client
+from ..telegram_client import SharedRateLimit, TelegramClient, TelegramError, TokenBucket
+
+
+class StubTelegramServer(ThreadingHTTPServer):
+    """Records the messages sent to it. Answers with the responses queued in
+    self.responses, and then with success. Closing the server waits for its
+    handler threads, which give up on idle connections after a second."""
+    daemon_threads = False
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubTelegramHandler)
+        self.requests = []
+        self.responses = []
+        self.connections = set()
+
+
+class StubTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 1
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        params = {key: value[0] for key, value in parse_qs(self.rfile.read(length).decode()).items()}
+        self.server.requests.append((self.path, params))
+        self.server.connections.add(self.client_address)
+        if self.server.responses:
+            status, body = self.server.responses.pop(0)
+        else:
+            status, body = 200, {'ok': True, 'result': {'message_id': len(self.server.requests)}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(SimpleTestCase):
+
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, 2, clock, clock.sleep)
+        for i in range(4):
+            bucket.acquire()
+        # Two immediately, then one every half second.
+        self.assertEqual(clock.sleeps, [0.5, 0.5])
+        clock.now += 10
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(len(clock.sleeps), 2)
+
+
+class SharedRateLimitTest(SimpleTestCase):
+
+    def test_shared(self):
+        clock = FakeClock()
+        cache = LocMemCache('telegram-client-test', {})
+        cache.clear()
+        # Two processes sending two messages a second between them.
+        limits = [SharedRateLimit(cache, 'global', 2, clock, clock.sleep) for i in range(2)]
+        limits[0].acquire()
+        limits[1].acquire()
+        self.assertEqual(clock.sleeps, [])
+        clock.now = 0.25
+        limits[0].acquire()
+        self.assertEqual(clock.sleeps, [0.75])
+
+        # A slower rate allows one message in a longer window.
+        group = SharedRateLimit(cache, 'group', 20 / 60, clock, clock.sleep)
+        group.acquire()
+        group.acquire()
+        self.assertEqual(clock.sleeps, [0.75, 2])
+
+
+class TelegramClientTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StubTelegramServer()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.clock = FakeClock()
+        self.client = TelegramClient('token', base_url='http://127.0.0.1:%d' % self.server.server_port,
+                                     clock=self.clock, sleep=self.clock.sleep)
+        self.addCleanup(self.client.session.close)
+
+    def test_send_messages(self):
+        messages = [(1000 + i % 3, 'Message %d' % i) for i in range(6)]
+        self.assertEqual(self.client.send_messages(messages), [None] * 6)
+        self.assertEqual([params['text'] for path, params in self.server.requests],
+                         ['Message %d' % i for i in range(6)])
+        self.assertEqual(self.server.requests[0], ('/bottoken/sendMessage', {
+            'chat_id': '1000', 'parse_mode': 'HTML', 'text': 'Message 0'}))
+        # The session keeps its connection open between messages.
+        self.assertEqual(len(self.server.connections), 1)
+        # The second message to the first chat waits a second for that
+        # chat's limit, by which time the other chats are ready again.
+        self.assertEqual(self.clock.sleeps, [1])
+
+    def test_shared_rate_limits(self):
+        cache = LocMemCache('telegram-client-test', {})
+        cache.clear()
+        clients = []
+        for i in range(2):
+            client = TelegramClient('token', base_url='http://127.0.0.1:%d' % self.server.server_port,
+                                    clock=self.clock, sleep=self.clock.sleep, rate_limit_cache=cache)
+            self.addCleanup(client.session.close)
+            clients.append(client)
+        clients[0].send_message(1000, 'First')
+        clients[1].send_message(1000, 'Second')
+        # The second client waits for the chat's limit used by the first.
+        self.assertEqual(self.clock.sleeps, [1])
+
+    def test_retry_after(self):
+        self.server.responses = [
+            (429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 5',
+                   'parameters': {'retry_after': 5}}),
+        ]
+        self.client.send_message(1000, 'Hello')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.clock.sleeps, [5])
+
+    def test_errors(self):
+        self.server.responses = [
+            (403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}),
+        ]
+        with self.assertLogs('artshow.telegram_client', 'WARNING'):
+            errors = self.client.send_messages([(1000, 'Blocked'), (1001, 'Sent')])
+        self.assertIsInstance(errors[0], TelegramError)
+        self.assertEqual(errors[0].status, 403)
+        self.assertIsNone(errors[1])
+
+        self.server.responses = [(429, {'ok': False, 'parameters': {'retry_after': 1}})] * 4
+        with self.assertRaises(TelegramError):
+            self.client.send_message(1002, 'Hello')
+        self.assertEqual(self.clock.sleeps, [1, 1, 1])
+
+
+class ClientTest(SimpleTestCase):
+
+    def setUp(self):
+        telegram_client.client.cache_clear()
+        self.addCleanup(telegram_client.client.cache_clear)
+
+    def test_shared_with_redis(self):
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': 'redis://127.0.0.1:6379'}}):
+            client = telegram_client.client()
+        self.addCleanup(client.session.close)
+        self.assertIsInstance(client.global_bucket, SharedRateLimit)
+
+    def test_per_process_otherwise(self):
+        with self.assertLogs('artshow.telegram_client', 'WARNING'):
+            client = telegram_client.client()
+        self.addCleanup(client.session.close)
+        self.assertIsInstance(client.global_bucket, TokenBucket)
+        self.assertIsInstance(client.chat_bucket(1000), TokenBucket)
@@ -2,7 +2,7 @@ from django.contrib.auth.models import User, Permission
 from django.test import Client, TestCase
 from django.urls import reverse
 
-from .. import testdata
+from .. import tasks, testdata
 
 
 class ManageTests(TestCase):
@@ -21,10 +21,14 @@ class ManageTests(TestCase):
     def testCloseShow(self):
         testdata.create('test@example.com')
 
-        response = self.client.post(reverse('artshow-workflow-close-show'))
+        tasks.close_show()
+        response = self.client.get(reverse('artshow-workflow-close-show'))
         self.assertEqual(response.status_code, 200)
 
         testdata.voice_auction()
 
-        response = self.client.post(reverse('artshow-workflow-close-show'))
+        tasks.close_show()
+        response = self.client.get(reverse('artshow-workflow-close-show'))
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['voice_auction_remaining'], 0)
+        self.assertEqual(response.context['artists_remaining'], 0)
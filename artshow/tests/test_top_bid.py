@@ -0,0 +1,132 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from ..models import Artist, Bid, Bidder, BidderId, Piece
+from peeps.models import Person
+
+
+class TopBidTests(TestCase):
+
+    def setUp(self):
+        person = Person()
+        person.save()
+
+        artist = Artist(person=person, artistid=1)
+        artist.save()
+
+        self.piece = Piece(artist=artist, pieceid=1, min_bid=5, buy_now=50,
+                           status=Piece.StatusInShow, location='A1')
+        self.piece.save()
+
+        self.bidder = Bidder(person=person)
+        self.bidder.save()
+        self.bidderid = BidderId(id='0365327', bidder=self.bidder)
+        self.bidderid.save()
+
+        person2 = Person()
+        person2.save()
+        self.bidder2 = Bidder(person=person2)
+        self.bidder2.save()
+        self.bidderid2 = BidderId(id='0019', bidder=self.bidder2)
+        self.bidderid2.save()
+
+    def assertTopBid(self, amount, bidder, count, buy_now=False):
+        piece = Piece.objects.get(pk=self.piece.pk)
+        self.assertEqual(piece.top_bid_amount, amount)
+        self.assertEqual(piece.top_bidder, bidder)
+        self.assertEqual(piece.top_bid_is_buy_now, buy_now)
+        self.assertEqual(piece.valid_bid_count, count)
+
+    def test_no_bids(self):
+        self.assertTopBid(None, None, 0)
+
+    def test_bid_created(self):
+        Bid(piece=self.piece, bidder=self.bidder, amount=10).save()
+        self.assertTopBid(10, self.bidder, 1)
+        self.assertEqual(self.piece.top_bid_amount, 10)
+
+        Bid(piece=self.piece, bidder=self.bidder2, amount=20).save()
+        self.assertTopBid(20, self.bidder2, 2)
+        self.assertEqual(self.piece.top_bidderid, self.bidderid2)
+
+    def test_bid_invalidated(self):
+        Bid(piece=self.piece, bidder=self.bidder, amount=10).save()
+        bid = Bid(piece=self.piece, bidder=self.bidder2, amount=20)
+        bid.save()
+
+        bid.invalid = True
+        bid.save()
+        self.assertTopBid(10, self.bidder, 1)
+
+    def test_bid_deleted(self):
+        Bid(piece=self.piece, bidder=self.bidder, amount=10).save()
+        bid = Bid(piece=self.piece, bidder=self.bidder2, amount=20)
+        bid.save()
+
+        bid.delete()
+        self.assertTopBid(10, self.bidder, 1)
+
+        Bid.objects.all().delete()
+        self.assertTopBid(None, None, 0)
+
+    def test_bulk_operations(self):
+        Bid.objects.bulk_create([
+            Bid(piece=self.piece, bidder=self.bidder, bidderid=self.bidderid, amount=10),
+            Bid(piece=self.piece, bidder=self.bidder2, bidderid=self.bidderid2, amount=50,
+                buy_now_bid=True),
+        ])
+        self.assertTopBid(50, self.bidder2, 2, buy_now=True)
+
+        Bid.objects.filter(amount=50).update(invalid=True)
+        self.assertTopBid(10, self.bidder, 1)
+
+        # The pieces are updated once, rather than by a signal for each bid.
+        with self.assertNumQueries(5):
+            Bid.objects.all().bulk_delete()
+        self.assertTopBid(None, None, 0)
+        # The post_delete signal is only skipped during the bulk delete.
+        bid = Bid(piece=self.piece, bidder=self.bidder, bidderid=self.bidderid, amount=10)
+        bid.save()
+        bid.delete()
+        self.assertTopBid(None, None, 0)
+
+    def test_stale_piece_save(self):
+        stale_piece = Piece.objects.get(pk=self.piece.pk)
+        Bid(piece=self.piece, bidder=self.bidder, amount=10).save()
+
+        stale_piece.location = 'A2'
+        stale_piece.save()
+        self.assertTopBid(10, self.bidder, 1)
+
+    def test_rebuild_command(self):
+        Bid(piece=self.piece, bidder=self.bidder, amount=10).save()
+        Piece.objects.update(top_bid_amount=None, top_bidder=None, valid_bid_count=0)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuildtopbids', verify=True, stdout=StringIO())
+
+        call_command('rebuildtopbids', stdout=StringIO())
+        self.assertTopBid(10, self.bidder, 1)
+        call_command('rebuildtopbids', verify=True, stdout=StringIO())
+
+    def test_apply_won_status(self):
+        Bid(piece=self.piece, bidder=self.bidder, amount=10).save()
+        unbid = Piece(artist=self.piece.artist, pieceid=2, min_bid=5,
+                      status=Piece.StatusInShow, location='A2')
+        unbid.save()
+
+        self.assertEqual(Piece.objects.apply_won_status(), (1, 0))
+        self.assertEqual(Piece.objects.get(pk=self.piece.pk).status, Piece.StatusWon)
+        self.assertEqual(Piece.objects.get(pk=unbid.pk).status, Piece.StatusInShow)
+
+    def test_apply_voice_auction_status(self):
+        for amount in range(10, 10 + Piece.VOICE_AUCTION_BID_COUNT):
+            Bid(piece=self.piece, bidder=self.bidder, amount=amount).save()
+
+        self.assertEqual(Piece.objects.apply_won_status(), (0, 1))
+        piece = Piece.objects.get(pk=self.piece.pk)
+        self.assertEqual(piece.status, Piece.StatusInShow)
+        self.assertTrue(piece.voice_auction)
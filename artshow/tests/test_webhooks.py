@@ -0,0 +1,172 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from .. import tasks, webhooks
+from ..models import SquareWebhook, TelegramWebhook, WebhookLock
+
+
+def checkout_event(event_id, device_id, checkout_id='checkout'):
+    return {
+        'event_id': event_id,
+        'type': 'terminal.checkout.updated',
+        'data': {'id': checkout_id, 'object': {'checkout': {
+            'id': checkout_id, 'device_options': {'device_id': device_id}}}},
+    }
+
+
+class WebhookQueueTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(tasks.process_webhooks, 'delay')
+        self.delay = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tasks.process_webhooks, 'apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def receive(self, *events):
+        with self.captureOnCommitCallbacks(execute=True):
+            for event in events:
+                webhooks.receive('square', event, event['event_id'], 'device:%s' % event['data']['object']
+                                 ['checkout']['device_options']['device_id'])
+
+    def test_receive_deduplicates(self):
+        self.receive(checkout_event('1', 'a'), checkout_event('1', 'a'), checkout_event('2', 'a'))
+        self.assertEqual(SquareWebhook.objects.count(), 2)
+        self.assertEqual(self.delay.call_count, 2)
+        self.delay.assert_called_with('square')
+
+    def test_drain_in_order(self):
+        self.receive(checkout_event('1', 'a'), checkout_event('2', 'b'), checkout_event('3', 'a'))
+        processed = []
+        with mock.patch.object(webhooks, 'processors',
+                               return_value={'square': lambda body: processed.append(body['event_id'])}):
+            self.assertEqual(webhooks.drain('square'), 3)
+        self.assertEqual(processed, ['1', '2', '3'])
+        self.assertFalse(webhooks.pending('square').exists())
+
+    def test_failure_retried(self):
+        self.receive(checkout_event('1', 'a'), checkout_event('2', 'b'), checkout_event('3', 'a'))
+        processed = []
+
+        def process(body):
+            if body['event_id'] == '1' and processed.count('fail') < 2:
+                processed.append('fail')
+                raise ValueError('Broken')
+            processed.append(body['event_id'])
+
+        with mock.patch.object(webhooks, 'processors', return_value={'square': process}), \
+                self.assertLogs('artshow.webhooks', 'WARNING'):
+            self.assertEqual(webhooks.drain('square'), 1)
+            webhook = SquareWebhook.objects.get(event_id='1')
+            self.assertFalse(webhook.failed)
+            self.assertEqual(webhook.attempts, 1)
+            self.apply_async.assert_called_once_with(('square',), eta=webhook.retry_at)
+
+            # Nothing is retried until it is due.
+            self.assertEqual(webhooks.drain('square'), 0)
+            self.assertEqual(processed, ['fail', '2'])
+
+            # The retry delay doubles.
+            first_retry_at = webhook.retry_at
+            SquareWebhook.objects.filter(pk=webhook.pk).update(retry_at=now())
+            self.assertEqual(webhooks.drain('square'), 0)
+            webhook.refresh_from_db()
+            self.assertEqual(webhook.attempts, 2)
+            self.assertGreater(webhook.retry_at - now(), first_retry_at - now())
+
+            SquareWebhook.objects.filter(pk=webhook.pk).update(retry_at=now())
+            self.assertEqual(webhooks.drain('square'), 2)
+        self.assertEqual(processed, ['fail', '2', 'fail', '1', '3'])
+        self.assertFalse(webhooks.pending('square').exists())
+
+    @override_settings(ARTSHOW_WEBHOOK_RETRIES=0)
+    def test_failure_holds_later_webhooks(self):
+        self.receive(checkout_event('1', 'a'), checkout_event('2', 'b'), checkout_event('3', 'a'))
+        processed = []
+
+        def process(body):
+            if body['event_id'] == '1' and not processed:
+                processed.append('fail')
+                raise ValueError('Broken')
+            processed.append(body['event_id'])
+
+        with mock.patch.object(webhooks, 'processors', return_value={'square': process}), \
+                self.assertLogs('artshow.webhooks', 'ERROR'):
+            self.assertEqual(webhooks.drain('square'), 1)
+            self.assertEqual(processed, ['fail', '2'])
+            failed = webhooks.failed('square').get()
+            self.assertIn('ValueError: Broken', failed.error)
+
+            # The drain skips the failed webhook and everything behind it.
+            self.assertEqual(webhooks.drain('square'), 0)
+
+            out = StringIO()
+            call_command('replaywebhooks', 'square', stdout=out)
+            self.assertIn('Processed 1 webhook, 0 still failed, 0 pending.', out.getvalue())
+        self.assertEqual(processed, ['fail', '2', '1', '3'])
+
+    @override_settings(ARTSHOW_WEBHOOK_RETRIES=0)
+    def test_discard(self):
+        self.receive(checkout_event('1', 'a'), checkout_event('2', 'a'))
+        processed = []
+
+        def process(body):
+            if body['event_id'] == '1':
+                raise ValueError('Broken')
+            processed.append(body['event_id'])
+
+        with mock.patch.object(webhooks, 'processors', return_value={'square': process}), \
+                self.assertLogs('artshow.webhooks', 'ERROR'):
+            webhooks.drain('square')
+            out = StringIO()
+            call_command('replaywebhooks', 'square', list=True, stdout=out)
+            self.assertIn('device:a: ValueError: Broken', out.getvalue())
+            call_command('replaywebhooks', 'square', discard=True, stdout=StringIO())
+        self.assertEqual(processed, ['2'])
+        self.assertFalse(webhooks.failed('square').exists())
+
+    def test_drain_locked(self):
+        self.receive(checkout_event('1', 'a'))
+        token = webhooks.acquire_lock('square')
+        self.assertIsNone(webhooks.acquire_lock('square'))
+        self.assertIsNone(webhooks.drain('square'))
+        self.assertIsNone(webhooks.replay('square'))
+        self.assertTrue(webhooks.pending('square').exists())
+        # Another kind has a lock of its own.
+        self.assertIsNotNone(webhooks.acquire_lock('telegram'))
+
+        # A lock left behind by a drain that died expires.
+        WebhookLock.objects.filter(kind='square').update(expires=now() - timedelta(seconds=1))
+        with mock.patch.object(webhooks, 'processors', return_value={'square': lambda body: None}):
+            self.assertEqual(webhooks.drain('square'), 1)
+        # The drain released the lock, and the old holder cannot renew it.
+        self.assertFalse(webhooks.renew_lock('square', token))
+        self.assertIsNotNone(webhooks.acquire_lock('square'))
+
+
+@override_settings(ARTSHOW_TELEGRAM_WEBHOOK_SECRET='secret')
+class TelegramWebhookViewTest(TestCase):
+
+    def test_webhook_queued(self):
+        update = {'update_id': 7, 'message': {'chat': {'id': 42}, 'text': 'Hello'}}
+        with mock.patch.object(tasks.process_webhooks, 'delay') as delay, \
+                mock.patch('artshow.telegram.send_message') as send_message, \
+                self.captureOnCommitCallbacks(execute=True):
+            for i in range(2):
+                response = self.client.post(reverse('telegram-webhook'), json.dumps(update),
+                                            content_type='application/json',
+                                            headers={'X-Telegram-Bot-Api-Secret-Token': 'secret'})
+                self.assertEqual(response.status_code, 200)
+        # Nothing is sent until the queue is drained.
+        send_message.assert_not_called()
+        delay.assert_called_once_with('telegram')
+        webhook = TelegramWebhook.objects.get()
+        self.assertEqual((webhook.event_id, webhook.ordering_key), ('7', 'chat:42'))
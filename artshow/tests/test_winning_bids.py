@@ -0,0 +1,89 @@
+from io import BytesIO
+
+from django.contrib.auth.models import Permission, User
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Artist, Bid, Bidder, BidderId, Piece
+from ..pdfreports import render_winning_bidders
+from peeps.models import Person
+
+
+class WinningBidsTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username='test', email='test@example.com', password='test')
+        user.user_permissions.add(
+            Permission.objects.get(codename='is_artshow_staff'),
+            Permission.objects.get(codename='add_invoice'))
+        user.save()
+
+        person = Person(name='Artist')
+        person.save()
+        artist = Artist(person=person, artistid=1)
+        artist.save()
+
+        self.bidders = []
+        for bidder_id in ('0019', '0027', '0035'):
+            person = Person(name='Bidder %s' % bidder_id)
+            person.save()
+            bidder = Bidder(person=person)
+            bidder.save()
+            BidderId(id=bidder_id, bidder=bidder).save()
+            self.bidders.append(bidder)
+
+        self.pieces = []
+        for pieceid in range(1, 7):
+            piece = Piece(artist=artist, pieceid=pieceid, name='Piece %d' % pieceid,
+                          min_bid=5, status=Piece.StatusWon)
+            piece.save()
+            self.pieces.append(piece)
+
+        # Each bidder tops two pieces and is outbid on a third.
+        for i, piece in enumerate(self.pieces):
+            winner = self.bidders[i % 3]
+            loser = self.bidders[(i + 1) % 3]
+            Bid(piece=piece, bidder=loser, bidderid=loser.bidderid_set.get(), amount=10).save()
+            Bid(piece=piece, bidder=winner, bidderid=winner.bidderid_set.get(), amount=20).save()
+
+        self.pieces[3].status = Piece.StatusSold
+        self.pieces[3].save()
+
+    def test_top_bids(self):
+        bidder = self.bidders[0]
+        top_bids = bidder.top_bids()
+        self.assertEqual([bid.piece for bid in top_bids], [self.pieces[0], self.pieces[3]])
+        self.assertTrue(all(bid.is_top_bid for bid in top_bids))
+
+        unsold = bidder.top_bids(unsold_only=True)
+        self.assertEqual([bid.piece for bid in unsold], [self.pieces[0]])
+
+    def test_top_bids_for_bidders(self):
+        with self.assertNumQueries(1):
+            results = Bidder.top_bids_for_bidders(self.bidders)
+            for bidder in self.bidders:
+                for bid in results[bidder.pk]:
+                    bid.piece.artistname()
+        self.assertEqual(sum(len(bids) for bids in results.values()), 6)
+
+    def test_invalid_bid_is_not_top_bid(self):
+        bid = Bid.objects.get(piece=self.pieces[0], amount=20)
+        bid.invalid = True
+        bid.save()
+        self.assertEqual(self.bidders[0].top_bids(), [Bid.objects.get(piece=self.pieces[3], amount=20)])
+        self.assertIn(self.pieces[0], [bid.piece for bid in self.bidders[1].top_bids()])
+
+    def test_cashier_bidder(self):
+        c = Client()
+        c.login(username='test', password='test')
+        with self.assertNumQueries(10):
+            response = c.get(reverse('artshow-cashier-bidder', args=(self.bidders[0].pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['available_bids']), 1)
+
+    def test_winning_bidders_pdf(self):
+        output = BytesIO()
+        with self.assertNumQueries(3):
+            render_winning_bidders(output)
+        self.assertTrue(output.getvalue().startswith(b'%PDF'))
@@ -4,11 +4,11 @@ from reportlab.lib.styles import ParagraphStyle
 from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.units import inch
 from reportlab.platypus import Frame, Paragraph
-import cgi
+import html
 
 
 def escape(s):
-    s = cgi.escape(s)
+    s = html.escape(s, quote=False)
     # For some reason the layout will eat the first char if its a space or &nbsp;, so we add another one in.
     if s[0:1] == " ":
         s = " " + s
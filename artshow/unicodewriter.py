@@ -31,7 +31,7 @@ class UnicodeDictWriter(object):
 
     def writerow(self, drow):
         row = [drow.get(field, '') for field in self.fields]
-        self.writer.writerow([str(s) for s in row])
+        return self.writer.writerow([str(s) for s in row])
 
     def writerows(self, rows):
         for row in rows:
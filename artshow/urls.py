@@ -9,7 +9,9 @@ from . import bid_entry
 from . import bidderreg
 from . import cashier
 from . import csvreports
+from . import pdfjobs
 from . import pdfreports
+from . import profiling
 from . import reports
 from . import square
 from . import telegram
@@ -26,6 +28,8 @@ urlpatterns = [
             name='artshow-bulk-add-bids'),
     re_path(r'^entry/bids/mobile/$', bid_entry.bid_entry,
             name='artshow-mobile-bid-entry'),
+    re_path(r'^entry/bids/batch/$', bid_entry.save_all_bids,
+            name='artshow-bid-entry-batch'),
     re_path(r'^entry/bids/(?P<artist_id>\d+)/(?P<piece_id>\d+)/$',
             bid_entry.bids),
     re_path(r'^entry/auction_bids/(?P<adult>[yn])/$',
@@ -64,6 +68,8 @@ urlpatterns = [
             name='artshow-report-percentiles'),
     re_path(r'^reports/allocations-waiting/$', reports.allocations_waiting,
             name='artshow-report-allocations-waiting'),
+    re_path(r'^reports/profiling/$', profiling.profiles,
+            name='artshow-report-profiling'),
     re_path(r'^cashier/$', cashier.cashier, name='artshow-cashier'),
     re_path(r'^cashier/bidder/(?P<bidder_id>\d+)/$', cashier.cashier_bidder,
             name='artshow-cashier-bidder'),
@@ -83,12 +89,24 @@ urlpatterns = [
             cashier.payment_cancel, name='artshow-cashier-payment-cancel'),
     re_path(r'^reports/winning-bidders-pdf/$', pdfreports.winning_bidders,
             name='artshow-winning-bidders-pdf'),
+    re_path(r'^reports/pdf/(?P<job_id>\d+)/$', pdfjobs.job,
+            name='artshow-pdf-job'),
+    re_path(r'^reports/pdf/(?P<job_id>\d+)/status/$', pdfjobs.job_status,
+            name='artshow-pdf-job-status'),
+    re_path(r'^reports/pdf/(?P<job_id>\d+)/download/$', pdfjobs.job_download,
+            name='artshow-pdf-job-download'),
     re_path(r'^reports/bid-entry-by-location-pdf/$',
-            pdfreports.bid_entry_by_location),
+            pdfreports.bid_entry_by_location,
+            name='artshow-bid-entry-by-location-pdf'),
+    re_path(r'^reports/bid-entry-by-artist-pdf/$',
+            pdfreports.bid_entry_by_artist,
+            name='artshow-bid-entry-by-artist-pdf'),
     re_path(r'^reports/artists-csv/$', csvreports.artists,
             name='artshow-artists-csv'),
     re_path(r'^reports/pieces-csv/$', csvreports.pieces,
             name='artshow-pieces-csv'),
+    re_path(r'^reports/winning-bidders-csv/$', csvreports.winning_bidders,
+            name='artshow-winning-bidders-csv'),
     re_path(r'^reports/bidders-csv/$', csvreports.bidders,
             name='artshow-bidders-csv'),
     re_path(r'^reports/payments-csv/$', csvreports.payments,
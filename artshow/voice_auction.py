@@ -6,6 +6,7 @@ from django.contrib.auth.decorators import permission_required
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
 from .models import Piece, Bid, BidderId
 
@@ -82,6 +83,7 @@ AuctionBidFormSet = formset_factory(AuctionBidForm, extra=0)
 
 
 @permission_required('artshow.is_artshow_staff')
+@transaction.atomic
 def auction_bids(request, adult):
     adult = adult == "y"
     pieces = Piece.objects.filter(voice_auction=True, status=Piece.StatusInShow, adult=adult).order_by("order",
@@ -0,0 +1,230 @@
+# Artshow Jockey
+# See file COPYING for licence details
+
+"""Queued processing of incoming webhooks.
+
+The webhook views only check the request and store it with receive(), so the
+provider gets its response straight away. The process_webhooks task then
+drains the stored webhooks of that kind in the order they arrived.
+
+A webhook whose event ID has already been received is dropped, since
+providers may deliver an event more than once. Only one drain or replay of
+each kind runs at a time, holding that kind's WebhookLock row. If a webhook fails it is tried again by a later drain, after
+a delay that doubles each time, up to ARTSHOW_WEBHOOK_RETRIES times. Later
+webhooks with the same ordering key (for example the same Square terminal)
+wait behind it. If it still fails it is marked as failed, and they are held
+until it is replayed or discarded with the replaywebhooks command.
+
+process_webhooks is routed to its own Celery queue, so that webhooks are not
+held up behind long tasks such as closing the show. See CELERY_TASK_ROUTES.
+"""
+
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Min, Q
+from django.utils.timezone import now
+
+from .conf import settings
+from .models import SquareWebhook, TelegramWebhook, WebhookLock
+
+logger = logging.getLogger(__name__)
+
+MODELS = {
+    'square': SquareWebhook,
+    'telegram': TelegramWebhook,
+}
+
+# Webhooks loaded at a time while draining.
+BATCH_SIZE = 100
+
+# Seconds after which a drain that has died without releasing its lock is
+# assumed to have gone. The lock is renewed before each batch.
+LOCK_TIMEOUT = 10 * 60
+
+
+def processors():
+    """Map each kind of webhook to the function that processes its body."""
+    from . import square, telegram
+    return {
+        'square': square.process_webhook,
+        'telegram': telegram.process_update,
+    }
+
+
+def receive(kind, body, event_id=None, ordering_key=''):
+    """Store a webhook and queue it for processing. Returns False if an event
+    with the same ID has already been received."""
+    from . import tasks
+    model = MODELS[kind]
+    event_id = None if event_id is None else str(event_id)
+    if event_id is not None and model.objects.filter(event_id=event_id).exists():
+        return False
+    try:
+        with transaction.atomic():
+            model.objects.create(timestamp=now(), body=body, event_id=event_id,
+                                 ordering_key=ordering_key)
+    except IntegrityError:
+        # Another delivery of the same event got there first.
+        return False
+    transaction.on_commit(lambda: tasks.process_webhooks.delay(kind))
+    return True
+
+
+def process(kind, webhook, processor=None):
+    """Process a single webhook, recording whether it succeeded. A webhook
+    that fails is given a time to retry at, unless it has run out of retries
+    or has already been marked as failed, when it is marked as failed.
+    Returns True on success."""
+    processor = processor or processors()[kind]
+    webhook.attempts += 1
+    try:
+        with transaction.atomic():
+            processor(webhook.body)
+    except Exception:
+        webhook.error = traceback.format_exc()
+        if not webhook.failed and webhook.attempts <= settings.ARTSHOW_WEBHOOK_RETRIES:
+            delay = settings.ARTSHOW_WEBHOOK_RETRY_DELAY * 2 ** (webhook.attempts - 1)
+            logger.warning('Failed to process %s webhook %d, retrying in %d seconds',
+                           kind, webhook.pk, delay, exc_info=True)
+            webhook.retry_at = now() + timedelta(seconds=delay)
+        else:
+            logger.exception('Failed to process %s webhook %d', kind, webhook.pk)
+            webhook.failed = True
+            webhook.retry_at = None
+        webhook.save(update_fields=['attempts', 'retry_at', 'failed', 'error'])
+        return False
+    webhook.processed = now()
+    webhook.failed = False
+    webhook.retry_at = None
+    webhook.save(update_fields=['processed', 'attempts', 'retry_at', 'failed'])
+    return True
+
+
+def acquire_lock(kind):
+    """Take the drain lock for a kind of webhook. Returns a token to renew
+    and release it with, or None if another drain holds it. The lock is
+    taken with a single UPDATE, so only one process can get it, and expires
+    after LOCK_TIMEOUT seconds in case its holder dies."""
+    WebhookLock.objects.get_or_create(kind=kind)
+    token = uuid.uuid4().hex
+    current = now()
+    taken = WebhookLock.objects.filter(Q(expires__isnull=True) | Q(expires__lt=current), kind=kind) \
+        .update(token=token, expires=current + timedelta(seconds=LOCK_TIMEOUT))
+    return token if taken else None
+
+
+def renew_lock(kind, token):
+    """Extend the lock. Returns False if it has expired and been taken by
+    another drain."""
+    return bool(WebhookLock.objects.filter(kind=kind, token=token)
+                .update(expires=now() + timedelta(seconds=LOCK_TIMEOUT)))
+
+
+def release_lock(kind, token):
+    WebhookLock.objects.filter(kind=kind, token=token).update(token='', expires=None)
+
+
+def drain(kind):
+    """Process every pending webhook of a kind, oldest first. Returns the
+    number processed, or None if another drain or replay is already
+    running."""
+    token = acquire_lock(kind)
+    if token is None:
+        return None
+    try:
+        count, last_pk = drain_locked(kind, token)
+    finally:
+        release_lock(kind, token)
+    queue_remaining(kind, last_pk)
+    return count
+
+
+def drain_locked(kind, token):
+    """Drain webhooks while holding the lock. Returns the number processed
+    and the pk of the last webhook looked at."""
+    model = MODELS[kind]
+    processor = processors()[kind]
+    count = 0
+    last_pk = 0
+    started = now()
+    held_keys = set(model.objects.filter(failed=True, processed__isnull=True)
+                    .exclude(ordering_key='').values_list('ordering_key', flat=True))
+    while True:
+        batch = list(model.objects.filter(processed__isnull=True, failed=False, pk__gt=last_pk)
+                     .order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            break
+        if not renew_lock(kind, token):
+            logger.error('Lost the lock while draining %s webhooks', kind)
+            break
+        for webhook in batch:
+            last_pk = webhook.pk
+            if webhook.ordering_key in held_keys:
+                continue
+            if webhook.retry_at is not None and webhook.retry_at > started:
+                # Not due to be retried yet.
+                success = False
+            else:
+                success = process(kind, webhook, processor)
+            if success:
+                count += 1
+            elif webhook.ordering_key:
+                held_keys.add(webhook.ordering_key)
+    return count, last_pk
+
+
+def queue_remaining(kind, last_pk):
+    """Queue drains for webhooks left pending after a drain."""
+    from . import tasks
+    # A webhook stored just before the lock was released will have had its
+    # own drain turned away.
+    if pending(kind).filter(pk__gt=last_pk).exists():
+        tasks.process_webhooks.delay(kind)
+    retry_at = pending(kind).aggregate(Min('retry_at'))['retry_at__min']
+    if retry_at is not None:
+        tasks.process_webhooks.apply_async((kind,), eta=retry_at)
+
+
+def pending(kind):
+    return MODELS[kind].objects.filter(processed__isnull=True, failed=False)
+
+
+def failed(kind):
+    return MODELS[kind].objects.filter(processed__isnull=True, failed=True)
+
+
+def replay(kind, pks=None, discard=False):
+    """Process failed webhooks again, oldest first, or mark them as processed
+    without processing them if discard is True. Webhooks held behind them are
+    then drained. Returns the number of failed webhooks that succeeded or were
+    discarded, or None if a drain is running."""
+    token = acquire_lock(kind)
+    if token is None:
+        return None
+    try:
+        webhooks = failed(kind).order_by('pk')
+        if pks:
+            webhooks = webhooks.filter(pk__in=pks)
+        count = 0
+        processor = processors()[kind]
+        held_keys = set()
+        for webhook in webhooks:
+            if discard:
+                webhook.processed = now()
+                webhook.save(update_fields=['processed'])
+                count += 1
+            elif webhook.ordering_key in held_keys:
+                continue
+            elif process(kind, webhook, processor):
+                count += 1
+            elif webhook.ordering_key:
+                held_keys.add(webhook.ordering_key)
+        _, last_pk = drain_locked(kind, token)
+    finally:
+        release_lock(kind, token)
+    queue_remaining(kind, last_pk)
+    return count
@@ -1,7 +1,8 @@
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q, Sum
 from django.forms.models import inlineformset_factory, modelformset_factory
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
@@ -11,10 +12,10 @@ from django.views.decorators.http import require_POST
 from .conf import settings
 from .mod11codes import make_check
 from .models import (
-    Artist, BidderId, BulkMessagingTask, ChequePayment, Location, Piece, Space,
-    SquareTerminal
+    Artist, BidderId, BulkMessagingTask, ChequePayment, CloseShowTask, Location,
+    Payment, PaymentType, Piece, Space, SquareTerminal
 )
-from . import square, tasks
+from . import pdfjobs, square, tasks
 
 
 @permission_required('artshow.is_artshow_staff')
@@ -442,59 +443,59 @@ def create_bidder_ids(request):
 @permission_required('artshow.is_artshow_staff')
 def close_show(request):
     if request.method == 'POST':
-        # Apply won/voice auction status.
-        for piece in Piece.objects.filter(status=Piece.StatusInShow):
-            piece.apply_won_status()
-
-    artists_total = 0
-    voice_auction_remaining = 0
-    artists_processed = 0
-    artists_remaining = 0
-    for artist in Artist.objects.all():
-        artists_total += 1
-
-        # Skip artists who still have pieces in voice auction.
-        if artist.piece_set.filter(status=Piece.StatusInShow,
-                                   voice_auction=True).exists():
-            voice_auction_remaining += 1
-            continue
-
-        if artist.payment_set.filter(
-                payment_type_id__in=(settings.ARTSHOW_SPACE_FEE_PK,
-                                     settings.ARTSHOW_COMMISSION_PK,
-                                     settings.ARTSHOW_SALES_PK)).exists():
-            artists_processed += 1
-            continue
-
-        if request.method == 'POST':
-            artist_queryset = Artist.objects.filter(pk=artist.pk)
-            Artist.apply_space_fees(artist_queryset)
-            Artist.apply_winnings_and_commission(artist_queryset)
-            Artist.create_cheques(artist_queryset)
-            artists_processed += 1
+        try:
+            task = tasks.start_close_show()
+        except IntegrityError:
+            messages.error(request, "The show is already being closed.")
         else:
-            artists_remaining += 1
+            transaction.on_commit(lambda: tasks.close_show.delay(task.pk))
+            messages.info(request, "Closing the show. Refresh this page to see progress.")
+        return redirect('artshow-workflow-close-show')
+
+    CloseShowTask.fail_stale()
+    active_tasks = list(CloseShowTask.objects.filter(status=CloseShowTask.StatusRunning))
+    last_task = CloseShowTask.objects.order_by('-started', '-pk').first()
+    failed_task = last_task if last_task and last_task.status == CloseShowTask.StatusFailed else None
+
+    artist_counts = Artist.objects.with_close_show_status().aggregate(
+        artists_total=Count('pk'),
+        voice_auction_remaining=Count('pk', filter=Q(awaiting_voice_auction=True)),
+        artists_processed=Count('pk', filter=Q(awaiting_voice_auction=False,
+                                               payments_applied=True)),
+        artists_remaining=Count('pk', filter=Q(awaiting_voice_auction=False,
+                                               payments_applied=False)),
+    )
+    piece_counts = Piece.objects.aggregate(
+        pieces_not_in_show=Count('pk', filter=Q(status=Piece.StatusNotInShow)),
+        pieces_in_show=Count('pk', filter=Q(status=Piece.StatusInShow,
+                                            voice_auction=False)),
+        pieces_awaiting_voice_auction=Count('pk', filter=Q(status=Piece.StatusInShow,
+                                                           voice_auction=True)),
+        pieces_won=Count('pk', filter=Q(status=Piece.StatusWon)),
+        pieces_sold=Count('pk', filter=Q(status=Piece.StatusSold)),
+        pieces_returned=Count('pk', filter=Q(status=Piece.StatusReturned)),
+    )
 
     c = {
-        'pieces_not_in_show':
-            Piece.objects.filter(status=Piece.StatusNotInShow).count(),
-        'pieces_in_show':
-            Piece.objects.filter(status=Piece.StatusInShow,
-                                 voice_auction=False).count(),
-        'pieces_awaiting_voice_auction':
-            Piece.objects.filter(status=Piece.StatusInShow,
-                                 voice_auction=True).count(),
-        'pieces_won':
-            Piece.objects.filter(status=Piece.StatusWon).count(),
-        'pieces_sold':
-            Piece.objects.filter(status=Piece.StatusSold).count(),
-        'pieces_returned':
-            Piece.objects.filter(status=Piece.StatusReturned).count(),
-        'artists_total': artists_total,
-        'voice_auction_remaining': voice_auction_remaining,
-        'artists_processed': artists_processed,
-        'artists_remaining': artists_remaining,
+        'active_tasks': active_tasks,
+        'failed_task': failed_task,
+        **piece_counts,
+        **artist_counts,
     }
+
+    if request.GET.get('preview') and not active_tasks:
+        # The payments that closing the show would make for the artists that
+        # are ready, worked out without saving them.
+        artist_ids = list(Artist.objects.with_close_show_status().filter(
+            awaiting_voice_auction=False, payments_applied=False).values_list('pk', flat=True))
+        ledger = Artist.settle(Artist.objects.filter(pk__in=artist_ids), dry_run=True)
+        artists = Artist.objects.select_related('person').in_bulk({payment.artist_id for payment in ledger})
+        payment_types = PaymentType.objects.in_bulk()
+        for payment in ledger:
+            payment.artist = artists[payment.artist_id]
+            payment.payment_type = payment_types[payment.payment_type_id]
+        c['ledger'] = sorted(ledger, key=lambda payment: payment.artist_id)
+
     return render(request, 'artshow/workflows_close_show.html', c)
 
 
@@ -524,6 +525,19 @@ def print_cheques(request):
 def print_cheques_print(request):
     cheques = ChequePayment.objects.filter(number='')
 
+    if settings.ARTSHOW_CHEQUES_AS_PDF:
+        cheque_ids = sorted(cheques.values_list('pk', flat=True))
+        version = [
+            list(cheques.order_by('pk').values_list('pk', 'payee', 'amount', 'date', 'artist__person__address1',
+                                                    'artist__person__address2', 'artist__person__city',
+                                                    'artist__person__state', 'artist__person__postcode',
+                                                    'artist__person__country')),
+            Payment.objects.filter(artist__in=cheques.values('artist')).aggregate(
+                Max('pk'), Count('pk'), Sum('amount')),
+        ]
+        job = pdfjobs.request_pdf('cheques', 'cheques.pdf', {'cheque_ids': cheque_ids}, version)
+        return redirect('artshow-pdf-job', job_id=job.pk)
+
     c = {
         'cheques': cheques,
         'print': True,
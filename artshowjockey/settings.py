@@ -2,6 +2,7 @@
 from email.utils import getaddresses
 from environs import Env, EnvError
 import os
+import tempfile
 
 env = Env()
 env.read_env()
@@ -22,6 +23,17 @@ MANAGERS = ADMINS
 
 DATABASES = {'default': env.dj_db_url('DATABASE_URL')}
 
+# The cache is shared by every web and task worker process, so that a change
+# made in one process invalidates what the others have cached. Production
+# sites should set CACHE_URL to Redis or Memcached. The file cache used by
+# default is slow with many entries, and once it holds MAX_ENTRIES every
+# write deletes a third of them at random, so it is given room for a cached
+# results page for every bidder.
+CACHES = {'default': env.dj_cache_url(
+    'CACHE_URL', default='file://' + os.path.join(tempfile.gettempdir(), 'artshowjockey-cache'))}
+if CACHES['default']['BACKEND'] == 'django.core.cache.backends.filebased.FileBasedCache':
+    CACHES['default'].setdefault('OPTIONS', {}).setdefault('MAX_ENTRIES', 20000)
+
 try:
     email = env.dj_email_url("EMAIL_URL")
     EMAIL_HOST = email["EMAIL_HOST"]
@@ -54,6 +66,11 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {
     'queue_name_prefix':
         env.str('CELERY_QUEUE_PREFIX', default='artshowjockey-'),
 }
+# Webhooks have a worker of their own, so that they are not held up behind
+# long tasks. See supervisord.conf.
+CELERY_TASK_ROUTES = {
+    'artshow.tasks.process_webhooks': {'queue': 'webhooks'},
+}
 
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
@@ -153,6 +170,11 @@ MIDDLEWARE = (
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
+# Record the queries and timings of each request. See artshow.profiling.
+ARTSHOW_PROFILING = env.bool('ARTSHOW_PROFILING', default=False)
+if ARTSHOW_PROFILING:
+    MIDDLEWARE = ('artshow.profiling.ProfilingMiddleware',) + MIDDLEWARE
+
 ROOT_URLCONF = 'artshowjockey.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -213,10 +235,15 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'artshow.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 
-TEST_RUNNER = 'django.test.runner.DiscoverRunner'
+TEST_RUNNER = 'artshowjockey.testrunner.TestRunner'
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 AJAX_LOOKUP_CHANNELS = {
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class PeepsConfig(AppConfig):
+    name = 'peeps'
+
+    def ready(self):
+        from . import signals  # noqa: F401
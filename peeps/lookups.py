@@ -1,17 +1,17 @@
 from ajax_select import LookupChannel
 from django.utils.html import escape
 from django.apps import apps
-from django.db.models import Q
 from django.conf import settings
 from django.urls import reverse
 
+from .search import search
+
 
 class PersonLookup(LookupChannel):
     model = apps.get_model(*settings.ARTSHOW_PERSON_CLASS.split('.', 1))
 
     def get_query(self, q, request):
-        return self.model.objects.filter(
-            Q(name__icontains=q) | Q(email__istartswith=q) | Q(reg_id__istartswith=q)).order_by('name')
+        return search(self.model.objects.all(), q).order_by('-search_rank', 'name')
 
     def get_result(self, obj):
         """ result is the simple text that is the completion of what the person typed """
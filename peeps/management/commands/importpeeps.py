@@ -1,46 +1,153 @@
-from optparse import make_option
-import sqlite3
 import csv
+import difflib
 import re
+from collections import defaultdict
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from ...models import Person
+from ...search import index_people, tokenize
+
+TARGETS = ("name", "address1", "address2", "city", "state", "country",
+           "postcode", "phone", "email", "reg_id", "comment")
+
+ADDRESS_FIELDS = ("address1", "address2", "city", "state", "country", "postcode")
+
+DECISION_FIELDS = ("action", "confidence", "match", "person_id", "person_name", "reg_name") + TARGETS
+
+# How confident a match on each field is. Matches on email or phone are
+# scaled by how similar the names are, as people sharing a household often
+# share an address and phone number. A match on name alone can be no better
+# than 0.9.
+EMAIL_CONFIDENCE = (0.6, 0.4)
+PHONE_CONFIDENCE = (0.5, 0.4)
+NAME_CONFIDENCE = 0.9
+
+# Registration rows compared with a person when matching by name, taken from
+# those sharing the person's least common name words.
+MAX_NAME_CANDIDATES = 200
+
+_non_digit_re = re.compile(r'\D')
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def normalize_phone(phone):
+    """The last ten digits, so that numbers written with and without a
+    country code match."""
+    digits = _non_digit_re.sub('', phone)
+    return digits[-10:] if len(digits) >= 7 else ''
+
+
+def name_key(name):
+    """The words of a name in order, so that "Smith, Jane" and "Jane Smith"
+    are the same."""
+    return ' '.join(sorted(tokenize(name)))
+
+
+class Registrations:
+    """The rows of a registration export, indexed by reg ID, email address,
+    phone number and the words of their names."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_reg_id = {}
+        self.name_keys = []
+        self.by_name = defaultdict(list)
+        self.by_email = defaultdict(list)
+        self.by_phone = defaultdict(list)
+        self.by_name_word = defaultdict(list)
+        for index, row in enumerate(rows):
+            if row['reg_id']:
+                self.by_reg_id[row['reg_id']] = index
+            email = normalize_email(row['email'])
+            if email:
+                self.by_email[email].append(index)
+            phone = normalize_phone(row['phone'])
+            if phone:
+                self.by_phone[phone].append(index)
+            key = name_key(row['name'])
+            self.name_keys.append(key)
+            if key:
+                self.by_name[key].append(index)
+            for word in set(key.split()):
+                self.by_name_word[word].append(index)
+
+    def best_by_name(self, name, candidates):
+        """Find the row among candidates with the most similar name. Returns
+        its index and the similarity, from 0 to 1."""
+        key = name_key(name)
+        if not key:
+            return None, 0.0
+        best, best_similarity = None, 0.0
+        matcher = difflib.SequenceMatcher(None, b=key)
+        for index in candidates:
+            row_key = self.name_keys[index]
+            if row_key == key:
+                return index, 1.0
+            matcher.set_seq1(row_key)
+            # The quick upper bounds rule out most candidates without
+            # working out the full ratio.
+            if matcher.real_quick_ratio() > best_similarity and matcher.quick_ratio() > best_similarity:
+                similarity = matcher.ratio()
+                if similarity > best_similarity:
+                    best, best_similarity = index, similarity
+        return best, best_similarity
+
+    def name_candidates(self, name):
+        buckets = sorted((self.by_name_word.get(word, []) for word in set(tokenize(name))), key=len)
+        candidates = set()
+        for bucket in buckets[:2]:
+            candidates.update(bucket[:MAX_NAME_CANDIDATES])
+        return candidates
+
+    def match(self, person):
+        """Find the registration row for person. Returns the index of the
+        row, the field it was matched on, and the confidence of the match, or
+        None if nothing was found."""
+        if person.reg_id and person.reg_id in self.by_reg_id:
+            return self.by_reg_id[person.reg_id], 'reg_id', 1.0
+
+        matches = []
+        email = normalize_email(person.email)
+        if email in self.by_email:
+            index, similarity = self.best_by_name(person.name, self.by_email[email])
+            if index is None:
+                index = self.by_email[email][0]
+            matches.append((index, 'email', EMAIL_CONFIDENCE[0] + EMAIL_CONFIDENCE[1] * similarity))
+        phone = normalize_phone(person.phone)
+        if phone in self.by_phone:
+            index, similarity = self.best_by_name(person.name, self.by_phone[phone])
+            if index is None:
+                index = self.by_phone[phone][0]
+            matches.append((index, 'phone', PHONE_CONFIDENCE[0] + PHONE_CONFIDENCE[1] * similarity))
+        # A match by name can't do better than these.
+        if not any(confidence >= NAME_CONFIDENCE for index, field, confidence in matches):
+            candidates = self.by_name.get(name_key(person.name)) or self.name_candidates(person.name)
+            index, similarity = self.best_by_name(person.name, candidates)
+            if index is not None:
+                matches.append((index, 'name', NAME_CONFIDENCE * similarity))
+        if not matches:
+            return None
+        return max(matches, key=lambda match: match[2])
 
 
-class UnicodeCsvReader(object):
-    def __init__(self, f, encoding="utf-8", **kwargs):
-        self.csv_reader = csv.reader(f, **kwargs)
-        self.encoding = encoding
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        # read and split the csv row into fields
-        row = next(self.csv_reader)
-        # now decode
-        return [str(cell, self.encoding) for cell in row]
-
-    @property
-    def line_num(self):
-        return self.csv_reader.line_num
-
-
-class UnicodeDictReader(csv.DictReader):
-    def __init__(self, f, encoding="utf-8", fieldnames=None, **kwds):
-        csv.DictReader.__init__(self, f, fieldnames=fieldnames, **kwds)
-        self.reader = UnicodeCsvReader(f, encoding=encoding, **kwds)
-
-
-# noinspection PyUnusedLocal
-def map_reset(self, option, opt_str, value, parser):
-    parser.values.map = []
+class Command(BaseCommand):
+    help = """Merge a registration export into the people already in the database.
 
+    Each person is matched to a row of the export by reg ID, and failing that
+    by email address, phone number or a similar name, with a confidence score.
+    Matches at or above --min-confidence update the person: the reg ID is
+    set, and the address, phone and email are filled in where they are blank.
+    Rows that match nobody create people with --create.
 
-class Command(BaseCommand):
-    args = 'infile'
-    help = "Monitor connected scanner"
+    The decisions can be written to a CSV file with --decisions-out, reviewed
+    and edited, and applied later with --decisions, without the export. The
+    action column is update, create, review or skip, and only update and
+    create are applied. The name column is the name the person will have."""
 
     default_map = [
         "firstname=name",
@@ -83,170 +190,186 @@ class Command(BaseCommand):
         "comment=comment",
     ]
 
-    targets = ("name", "address1", "address2", "city", "state", "country",
-               "postcode", "phone", "email", "reg_id", "comment")
-
     map_re = re.compile(r"(?P<source>[\w ]+)=(?P<target>\w+)$")
 
-    option_list = BaseCommand.option_list + (
-        make_option("--map", type="string", action="append", default=default_map,
-                    help="add a new map. sourcename=targetname."),
-        make_option("--map-reset", action="callback", callback=map_reset, help="clear the map"),
-        make_option("--comment", type="string", default="", help="add this comment"),
-        make_option("-n", "--dry-run", action="store_true", default=False, help="show results, Don't update DB"),
-        make_option("-o", "--results", type="string", default=None, help="write results to file"),
-        make_option("-i", "--input", type="string", default=None,
-                    help="read previous results to assist in decisions from file"),
-        make_option("--dialect", type="string", default="excel", help="csv dialect [%default]"),
-        make_option("--encoding", type="string", default="utf-8", help="encoding [%default]"),
-    )
+    def add_arguments(self, parser):
+        parser.add_argument("infile", nargs="?", help="Registration export to merge")
+        parser.add_argument(
+            "--map", action="append", default=[],
+            help="Add a column mapping, sourcename=targetname. May be given more than once")
+        parser.add_argument(
+            "--map-reset", action="store_true",
+            help="Don't use the default column mappings")
+        parser.add_argument(
+            "--comment", default="",
+            help="Comment for people created from rows without one")
+        parser.add_argument(
+            "--min-confidence", type=float, default=0.8,
+            help="Matches less confident than this are left for review [%(default)s]")
+        parser.add_argument(
+            "--create", action="store_true",
+            help="Create people for rows that match nobody")
+        parser.add_argument(
+            "-n", "--dry-run", action="store_true",
+            help="Find the matches but don't update the database")
+        parser.add_argument(
+            "-o", "--decisions-out",
+            help="Write the decisions to this CSV file")
+        parser.add_argument(
+            "-i", "--decisions",
+            help="Apply the decisions in this CSV file rather than merging an export")
+        parser.add_argument("--dialect", default="excel", help="CSV dialect [%(default)s]")
+        parser.add_argument("--encoding", default="utf-8", help="Encoding [%(default)s]")
 
     def handle(self, *args, **options):
-
-        mapping = self.convert_mapping(options['map'])
-        db = self.read_reg_csv(args[0], mapping, options['dialect'], options['encoding'])
-
-        if options['results']:
-            results = open(options['results'], "w")
+        if options['decisions']:
+            decisions = self.read_decisions(options['decisions'], options['encoding'])
+        elif options['infile']:
+            mapping = self.convert_mapping(([] if options['map_reset'] else self.default_map) + options['map'])
+            registrations = Registrations(self.read_reg_csv(options['infile'], mapping, options['dialect'],
+                                                            options['encoding']))
+            decisions = self.decide(registrations, options['min_confidence'], options['create'],
+                                    options['comment'])
         else:
-            results = None
-
-        self.merge_peeps(db, dry_run=options['dry_run'], results=results, comment=options['comment'])
-
-    def print_person(self, person):
-        print("Person ID:%s  Name:%s  RegID:%s  Comment:%s" % (person.id, person.name, person.reg_id, person.comment))
-        print("Address:%s  Address2:%s  City:%s  State:%s  Country:%s  Postcode:%s" % (
-            person.address1, person.address2, person.city, person.state, person.country, person.postcode))
-        print("Phone:%s  Email:%s" % (person.phone, person.email))
-        print()
-
-    def print_person_summary(self, person):
-        print("Person ID:%s  Name:%s  RegID:%s  Comment:%s" % (person.id, person.name, person.reg_id, person.comment))
-
-    def row_into_person(self, result):
-        p = Person(name=result[0], address1=result[1], address2=result[2], city=result[3], state=result[4],
-                   country=result[5],
-                   postcode=result[6], phone=result[7], email=result[8], reg_id=result[9], comment=result[10])
-        return p
-
-    def merge_peeps(self, db, dry_run=False, results=None, comment=None):
-
-        print()
-
-        for person in Person.objects.all():
-
-            if person.reg_id == "":
-                print("Missing Reg ID for:")
-                self.print_person_summary(person)
-                csv_person = None
+            raise CommandError("Give a registration export or --decisions.")
+
+        counts = defaultdict(int)
+        for decision in decisions:
+            counts[decision['action']] += 1
+        self.stdout.write(", ".join("%d to %s" % (counts[action], action)
+                                    for action in ('update', 'create', 'review', 'skip')))
+
+        if options['decisions_out']:
+            self.write_decisions(options['decisions_out'], decisions)
+        if not options['dry_run']:
+            updated, created = self.apply(decisions)
+            self.stdout.write(self.style.SUCCESS("Updated %d and created %d people." % (updated, created)))
+
+    def decide(self, registrations, min_confidence, create, comment):
+        """Match every person to the registrations. Each row goes to the
+        person who matched it most confidently, and anyone else who matched
+        it is left for review."""
+        matches = []
+        for person in Person.objects.only('pk', 'name', 'reg_id', 'email', 'phone').order_by('pk'):
+            match = registrations.match(person)
+            if match is not None:
+                matches.append((person, *match))
+        matches.sort(key=lambda match: -match[3])
+
+        decisions = []
+        claimed = set()
+        for person, index, field, confidence in matches:
+            row = registrations.rows[index]
+            if index not in claimed and confidence >= min_confidence:
+                action = 'update'
             else:
-                results = db.execute("select * from person where reg_id=?", (person.reg_id, ))
-                result = results.fetchone()
-                if result:
-                    csv_person = self.row_into_person(result)
-                else:
-                    print("Reg ID not found for:")
-                    self.print_person_summary(person)
-                    csv_person = None
-
-            if csv_person is None:
-                results = db.execute("select * from person where name like ?", (person.name[:4] + "%", ))
-                results = results.fetchall()
-                results = [self.row_into_person(row) for row in results]
-                print("Database search:", len(results), "possibilities found")
-                for index, found_person in enumerate(results):
-                    print("Option", index + 1, ":")
-                    self.print_person(found_person)
-                response = input("Option (or 0 for none): ")
-                while True:
+                action = 'review'
+            claimed.add(index)
+            decisions.append(dict(row, action=action, confidence='%.2f' % confidence, match=field,
+                                  person_id=person.pk, person_name=person.name, reg_name=row['name'],
+                                  name=person.name))
+
+        # Rows that were only matched for review are not created either.
+        for index, row in enumerate(registrations.rows):
+            if index not in claimed:
+                decisions.append(dict(row, action='create' if create else 'skip', confidence='', match='',
+                                      person_id='', person_name='', reg_name=row['name'],
+                                      comment=row['comment'] or comment))
+        return decisions
+
+    @transaction.atomic
+    def apply(self, decisions):
+        updates = [d for d in decisions if d['action'] == 'update']
+        people = Person.objects.in_bulk([int(d['person_id']) for d in updates])
+        # People are updated in groups that changed the same fields, as each
+        # field updated makes bulk_update() build a CASE over every person.
+        changed = defaultdict(list)
+        for decision in updates:
+            person = people.get(int(decision['person_id']))
+            if person is None:
+                continue
+            values = {}
+            if decision['reg_id']:
+                values['reg_id'] = decision['reg_id']
+            if decision['name']:
+                values['name'] = decision['name']
+            if not any(getattr(person, field) for field in ADDRESS_FIELDS):
+                values.update((field, decision[field]) for field in ADDRESS_FIELDS)
+            if not person.phone:
+                values['phone'] = decision['phone']
+            if not person.email:
+                values['email'] = decision['email']
+            fields = tuple(sorted(field for field, value in values.items() if getattr(person, field) != value))
+            for field in fields:
+                setattr(person, field, values[field])
+            if fields:
+                changed[fields].append(person)
+        for fields, group in changed.items():
+            Person.objects.bulk_update(group, fields, batch_size=1000)
+        changed = [person for group in changed.values() for person in group]
+
+        created = Person.objects.bulk_create([
+            Person(**{field: decision[field] for field in TARGETS})
+            for decision in decisions if decision['action'] == 'create'
+        ], batch_size=1000)
+
+        # bulk_update() and bulk_create() skip the signals that index people
+        # for searching.
+        index_people(changed + created)
+        return len(changed), len(created)
+
+    def write_decisions(self, filename, decisions):
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, DECISION_FIELDS)
+            writer.writeheader()
+            for decision in sorted(decisions, key=lambda d: (d['action'], d['confidence'] or '1', d['name'])):
+                writer.writerow(decision)
+
+    def read_decisions(self, filename, encoding):
+        with open(filename, newline="", encoding=encoding) as f:
+            reader = csv.DictReader(f)
+            missing = set(DECISION_FIELDS) - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError("%s is missing the columns %s." % (filename, ", ".join(sorted(missing))))
+            decisions = []
+            for row in reader:
+                decision = dict(row, action=row['action'].strip().lower())
+                if decision['action'] == 'update':
                     try:
-                        index = int(response)
-                        if index == 0:
-                            break
-                        csv_person = results[index - 1]
-                    except (ValueError, IndexError):
-                        print("Invalid Option")
-                    else:
-                        break
-                print()
-
-            if csv_person is not None:
-                person.reg_id = csv_person.reg_id
-                if person.name != csv_person.name:
-                    print("CSV Entry found, but names mismatch")
-                    self.print_person_summary(person)
-                    while True:
-                        print("Database:", person.name, " CSV:", csv_person.name)
-                        print("  1) Keep Database Name:", person.name)
-                        print("  2) Use CSV Name:", csv_person.name)
-                        print("  3) Enter Anew")
-                        response = input("Option: ")
-                        if response == "1":
-                            break
-                        elif response == "2":
-                            person.name = csv_person.name
-                            break
-                        elif response == "3":
-                            new_name = input("Enter Name: ")
-                            if new_name:
-                                person.name = new_name
-                            break
-                        else:
-                            print("Invalid Option")
-                    print()
-                if not (person.address1 or person.address2 or person.city
-                        or person.state or person.country or person.postcode):
-                    person.address1 = csv_person.address1
-                    person.address2 = csv_person.address2
-                    person.city = csv_person.city
-                    person.state = csv_person.state
-                    person.country = csv_person.country
-                    person.postcode = csv_person.postcode
-                if not person.phone:
-                    person.phone = csv_person.phone
-                if not person.email:
-                    person.email = csv_person.email
-                person.save()
+                        decision['person_id'] = int(decision['person_id'])
+                    except (TypeError, ValueError):
+                        raise CommandError("%s line %d: update needs the person_id of the person to update."
+                                           % (filename, reader.line_num))
+                decisions.append(decision)
+            return decisions
 
     def convert_mapping(self, map):
         mapping = []
         for s in map:
             mo = self.map_re.match(s)
             if not mo:
-                raise ValueError("mapping %s is not in expected form" % s)
+                raise CommandError("mapping %s is not in expected form" % s)
             source = mo.group('source').lower()
             target = mo.group('target').lower()
-            if target not in self.targets:
-                raise ValueError("target %s is not valid" % target)
+            if target not in TARGETS:
+                raise CommandError("target %s is not valid" % target)
             mapping.append((source, target))
         return mapping
 
     def read_reg_csv(self, filename, mapping, dialect, encoding):
-
-        infile = open(filename)
-        csvfile = UnicodeDictReader(infile, dialect=dialect, encoding=encoding)
-        fieldnames = csvfile.fieldnames
-        fieldnames = [x.lower() for x in fieldnames]
-        csvfile.fieldnames = fieldnames
-
-        db = sqlite3.connect(":memory:")
-        db.execute(
-            "create table person ( name text, address1 text, address2 text, city text, state text, country text, postcode text, phone text, email text, reg_id text primary key, comment text )")
-        db.execute("create index table_name_idx on person ( name )")
-        db.execute("create index table_email_idx on person ( email )")
-
-        for row in csvfile:
-            values = dict(((t, "") for t in self.targets))
-            for source, target in mapping:
-                value = row.get(source, '')
-                value = value.strip()
-                if value:
-                    if values[target]:
-                        values[target] += " " + value
-                    else:
-                        values[target] = value
-            values['reg_id'] = values['reg_id'].replace(' ', '-')
-            db.execute("insert into person values ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )",
-                       tuple(values[t] for t in self.targets))
-
-        return db
+        rows = []
+        with open(filename, newline="", encoding=encoding) as infile:
+            csvfile = csv.DictReader(infile, dialect=dialect)
+            csvfile.fieldnames = [x.lower() for x in csvfile.fieldnames]
+            for row in csvfile:
+                values = dict(((t, "") for t in TARGETS))
+                for source, target in mapping:
+                    value = (row.get(source) or '').strip()
+                    if value:
+                        if values[target]:
+                            values[target] += " " + value
+                        else:
+                            values[target] = value
+                values['reg_id'] = values['reg_id'].replace(' ', '-')
+                rows.append(values)
+        return rows
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from peeps import search
+
+
+def index_people(apps, schema_editor):
+    Person = apps.get_model('peeps', 'Person')
+    SearchToken = apps.get_model('peeps', 'SearchToken')
+    texts = {person.pk: search.person_texts(person)
+             for person in Person.objects.only(*search.PERSON_FIELDS).iterator()}
+    SearchToken.objects.bulk_create(search.build_tokens(texts, SearchToken), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peeps', '0007_person_telegram_chat_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=20)),
+                ('token', models.CharField(db_index=True, max_length=100)),
+                ('weight', models.PositiveSmallIntegerField()),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='peeps.person')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['person', 'field'], name='peeps_searc_person__9822e6_idx')],
+            },
+        ),
+        migrations.RunPython(index_people, migrations.RunPython.noop),
+    ]
@@ -56,3 +56,20 @@ class Person (models.Model):
 
     class Meta:
         verbose_name_plural = "People"
+
+
+class SearchToken (models.Model):
+    """A normalized word from one of a person's searchable fields. See
+    peeps.search."""
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='search_tokens')
+    field = models.CharField(max_length=20)
+    token = models.CharField(max_length=100, db_index=True)
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['person', 'field']),
+        ]
+
+    def __str__(self):
+        return "%s: %s" % (self.field, self.token)
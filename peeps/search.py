@@ -0,0 +1,109 @@
+"""Indexed search for people.
+
+Each person's name, email address and reg ID are split into normalized words
+that are stored as SearchToken rows, kept current when the person is saved.
+Other apps can add tokens of their own fields with replace_tokens(), as
+artshow does for bidder IDs. A search matches people with a token starting
+with every word searched for, using the index on SearchToken.token rather
+than scanning the people, and ranks them by the weight of the fields that
+matched, doubled for a whole word.
+
+People created with bulk_create() are not indexed until index_people() is
+called for them.
+"""
+
+import re
+import unicodedata
+
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Value as V, When
+
+from .models import SearchToken
+
+# The weight of a match in each field. A match in more than one field counts
+# the best.
+WEIGHTS = {
+    'bidder_id': 8,
+    'reg_id': 6,
+    'name': 4,
+    'email': 2,
+}
+
+# The Person fields that are indexed, and the field of the index each is
+# stored as.
+PERSON_FIELDS = {
+    'name': 'name',
+    'preferred_name': 'name',
+    'email': 'email',
+    'reg_id': 'reg_id',
+}
+
+# Words searched for beyond this are ignored.
+MAX_WORDS = 5
+
+_word_re = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Fold case and remove accents."""
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    """Split text into normalized words. Words that were joined by
+    punctuation, such as the parts of a reg ID like "AB-123", are also
+    returned run together so that they can be searched for either way."""
+    words = _word_re.findall(normalize(text or ''))
+    tokens = [word[:100] for word in words]
+    if len(words) > 1 and not re.search(r'\s', text):
+        tokens.append(''.join(words)[:100])
+    return tokens
+
+
+def build_tokens(texts, model=SearchToken):
+    """Make the SearchToken objects for texts, which maps the pk of each
+    person to a list of (field, text) pairs."""
+    tokens = []
+    for person_id, pairs in texts.items():
+        seen = set()
+        for field, text in pairs:
+            for token in tokenize(text):
+                if (field, token) not in seen:
+                    seen.add((field, token))
+                    tokens.append(model(person_id=person_id, field=field, token=token,
+                                        weight=WEIGHTS[field]))
+    return tokens
+
+
+def replace_tokens(fields, texts):
+    """Replace the tokens of the given index fields for some people. texts is
+    as for build_tokens()."""
+    SearchToken.objects.filter(person__in=list(texts), field__in=fields).delete()
+    SearchToken.objects.bulk_create(build_tokens(texts), batch_size=1000)
+
+
+def person_texts(person):
+    return [(field, getattr(person, name)) for name, field in PERSON_FIELDS.items()]
+
+
+def index_people(people):
+    replace_tokens(set(PERSON_FIELDS.values()), {person.pk: person_texts(person) for person in people})
+
+
+def search(queryset, text, person='pk'):
+    """Filter queryset to the people, or the rows related to a person through
+    the field named by person, that match every word of text, and annotate
+    each with its search_rank. The queryset is not ordered."""
+    words = list(dict.fromkeys(tokenize(text)))[:MAX_WORDS]
+    rank = V(0, output_field=IntegerField())
+    if not words:
+        return queryset.annotate(search_rank=rank).none()
+    for word in words:
+        matches = SearchToken.objects.filter(token__startswith=word)
+        queryset = queryset.filter(**{person + '__in': matches.values('person')})
+        best = matches.filter(person=OuterRef(person)).annotate(
+            score=Case(When(token=word, then=F('weight') * 2), default=F('weight'),
+                       output_field=IntegerField())
+        ).order_by('-score').values('score')[:1]
+        rank = rank + Subquery(best)
+    return queryset.annotate(search_rank=rank)
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import search
+from .models import Person
+
+
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and search.PERSON_FIELDS.keys().isdisjoint(update_fields):
+        return
+    search.index_people([instance])
@@ -5,8 +5,18 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import csv
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 
+from .models import Person
+from .search import search, tokenize
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +24,119 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.jose = Person.objects.create(name='José Smith', email='jose@example.com', reg_id='AB-123')
+        self.smithers = Person.objects.create(name='Waylon Smithers', email='ws@example.com', reg_id='AB-456')
+
+    def search(self, text):
+        return [p.name for p in search(Person.objects.all(), text).order_by('-search_rank', 'name')]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('José Smith'), ['jose', 'smith'])
+        self.assertEqual(tokenize('AB-123'), ['ab', '123', 'ab123'])
+
+    def test_search(self):
+        self.assertEqual(self.search('smith'), ['José Smith', 'Waylon Smithers'])
+        self.assertEqual(self.search('smi'), ['José Smith', 'Waylon Smithers'])
+        self.assertEqual(self.search('jose sm'), ['José Smith'])
+        self.assertEqual(self.search('ab12'), ['José Smith'])
+        self.assertEqual(self.search('ab-4'), ['Waylon Smithers'])
+        self.assertEqual(self.search('ws@'), ['Waylon Smithers'])
+        self.assertEqual(self.search('nobody'), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_kept_current(self):
+        self.jose.name = 'Joseph Bloggs'
+        self.jose.save()
+        self.assertEqual(self.search('smith'), ['Waylon Smithers'])
+        self.assertEqual(self.search('blog'), ['Joseph Bloggs'])
+        self.jose.save(update_fields=['comment'])
+        self.assertEqual(self.search('blog'), ['Joseph Bloggs'])
+
+
+class ImportPeepsTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.export = os.path.join(self.dir.name, 'export.csv')
+        with open(self.export, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['RegID', 'FirstName', 'LastName', 'Email', 'Phone', 'City'])
+            writer.writerow(['R1', 'Alice', 'Example', 'alice@example.com', '555-0101', 'Springfield'])
+            writer.writerow(['R2', 'Robert', 'Smith', 'bob@example.com', '+1 (555) 555-0102', 'Shelbyville'])
+            writer.writerow(['R3', 'Carol', 'Jones', 'carol@example.com', '', 'Ogdenville'])
+            writer.writerow(['R4', 'Dan', 'Brown', 'dan@example.com', '', 'North Haverbrook'])
+        self.alice = Person.objects.create(name='Alice E.', reg_id='R1')
+        self.bob = Person.objects.create(name='Bob Smith', phone='555.555.0102', email='BOB@example.com')
+        self.carol = Person.objects.create(name='Carole Jones', city='Capital City')
+        self.other = Person.objects.create(name='Someone Else')
+
+    def call(self, *args, **options):
+        out = StringIO()
+        call_command('importpeeps', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_decisions(self):
+        decisions_file = os.path.join(self.dir.name, 'decisions.csv')
+        out = self.call(self.export, dry_run=True, decisions_out=decisions_file)
+        self.assertIn("3 to update, 0 to create, 0 to review, 1 to skip", out)
+        self.assertEqual(Person.objects.filter(reg_id='').count(), 3)
+        with open(decisions_file, newline='') as f:
+            decisions = {row['reg_id']: row for row in csv.DictReader(f)}
+        self.assertEqual((decisions['R1']['match'], decisions['R1']['confidence']), ('reg_id', '1.00'))
+        self.assertEqual((decisions['R2']['match'], decisions['R2']['person_id']), ('email', str(self.bob.pk)))
+        self.assertEqual((decisions['R3']['match'], decisions['R3']['person_id']), ('name', str(self.carol.pk)))
+        self.assertEqual(decisions['R4']['action'], 'skip')
+
+        # Review the decisions: leave Carol alone, rename Bob and create Dan.
+        decisions['R3']['action'] = 'skip'
+        decisions['R2']['name'] = 'Robert Smith'
+        decisions['R4']['action'] = 'create'
+        with open(decisions_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, list(decisions['R1']))
+            writer.writeheader()
+            writer.writerows(decisions.values())
+        out = self.call(decisions=decisions_file)
+        self.assertIn("Updated 2 and created 1 people.", out)
+
+        self.bob.refresh_from_db()
+        self.assertEqual((self.bob.name, self.bob.reg_id, self.bob.city, self.bob.email),
+                         ('Robert Smith', 'R2', 'Shelbyville', 'BOB@example.com'))
+        self.alice.refresh_from_db()
+        self.assertEqual((self.alice.name, self.alice.email, self.alice.phone),
+                         ('Alice E.', 'alice@example.com', '555-0101'))
+        self.assertEqual(Person.objects.get(reg_id='R4').name, 'Dan Brown')
+        self.assertEqual(search(Person.objects.all(), 'dan brown').get().reg_id, 'R4')
+
+    def test_update_without_person(self):
+        decisions_file = os.path.join(self.dir.name, 'decisions.csv')
+        self.call(self.export, dry_run=True, decisions_out=decisions_file)
+        with open(decisions_file, newline='') as f:
+            decisions = list(csv.DictReader(f))
+        # Dan was not matched, and is switched to update without saying who.
+        index = next(i for i, decision in enumerate(decisions) if decision['reg_id'] == 'R4')
+        decisions[index]['action'] = 'update'
+        with open(decisions_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, list(decisions[0]))
+            writer.writeheader()
+            writer.writerows(decisions)
+        with self.assertRaisesMessage(CommandError, 'line %d: update needs the person_id' % (index + 2)):
+            self.call(decisions=decisions_file)
+        # Nothing was imported.
+        self.assertEqual(Person.objects.filter(reg_id='').count(), 3)
+
+    def test_repeatable(self):
+        self.call(self.export, create=True)
+        self.carol.refresh_from_db()
+        self.assertEqual((self.carol.reg_id, self.carol.city), ('R3', 'Capital City'))
+        self.assertEqual(Person.objects.count(), 5)
+        out = self.call(self.export, create=True)
+        self.assertIn("4 to update, 0 to create", out)
+        self.assertEqual(Person.objects.count(), 5)
+
+    def test_low_confidence(self):
+        out = self.call(self.export, min_confidence=0.95, dry_run=True)
+        self.assertIn("1 to update, 0 to create, 2 to review", out)
@@ -1,8 +1,16 @@
-from django.db import models
+import uuid
+
+from django.core.cache import cache
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+# Announcement counts are cached for at most this many seconds, so that
+# announcements that start or expire are picked up.
+COUNTS_CACHE_TIMEOUT = 60
+
 
 class AnnouncementManager(models.Manager):
 
@@ -37,6 +45,24 @@ class Announcement(models.Model):
         except AnnouncementSeen.DoesNotExist:
             ann_seen = AnnouncementSeen(announcement=self, user=user)
             ann_seen.save()
+            key = Announcement.counts_cache_key(user)
+            transaction.on_commit(lambda: cache.delete(key))
+
+    @staticmethod
+    def counts_cache_key(user):
+        # Every user's counts are invalidated together by replacing the
+        # generation when announcements change.
+        generation = cache.get('tinyannounce:generation')
+        if generation is None:
+            cache.add('tinyannounce:generation', uuid.uuid4().hex, None)
+            generation = cache.get('tinyannounce:generation')
+        return 'tinyannounce:counts:%s:%s' % (generation, user.pk)
+
+    @staticmethod
+    def invalidate_counts(**kwargs):
+        # Only once the change is committed, so that a request reading the
+        # old rows in the meantime cannot cache them again.
+        transaction.on_commit(lambda: cache.delete('tinyannounce:generation'))
 
     def __str__(self):
         return "%s by %s" % (self.subject, self.author)
@@ -54,3 +80,7 @@ class AnnouncementSeen(models.Model):
 
     def __str__(self):
         return "%s seen by %s" % (self.announcement.subject, self.user)
+
+
+post_save.connect(Announcement.invalidate_counts, sender=Announcement)
+post_delete.connect(Announcement.invalidate_counts, sender=Announcement)
@@ -10,8 +10,7 @@ register = template.Library()
 def announcements_available(context):
     user = context['request'].user
     announcements = Announcement.objects.active()
-    total, new, new_and_important = \
-        get_announcement_counts(user, announcements)
+    total, new, new_and_important = get_announcement_counts(user)
     return {'announcements': announcements,
             'total': total,
             'new': new,
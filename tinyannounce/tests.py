@@ -5,7 +5,15 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from datetime import timedelta
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from .models import Announcement
+from .views import get_announcement_counts
 
 
 class SimpleTest(TestCase):
@@ -14,3 +22,44 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class AnnouncementCountsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='staff')
+        now = timezone.now()
+        self.announcements = [
+            Announcement.objects.create(subject='Subject %d' % i, author=self.user, important=i % 2 == 0,
+                                        created=now - timedelta(hours=1))
+            for i in range(6)
+        ]
+        Announcement.objects.create(subject='Expired', author=self.user, created=now - timedelta(hours=2),
+                                    expires=now - timedelta(hours=1))
+        self.announcements[0].mark_seen(self.user)
+
+    def test_counts(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_announcement_counts(self.user), (6, 5, 2))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_announcement_counts(self.user), (6, 5, 2))
+        self.assertEqual(get_announcement_counts(AnonymousUser()), (0, 0, 0))
+        self.assertEqual(get_announcement_counts(self.user, Announcement.objects.filter(important=True)),
+                         (3, 2, 2))
+
+    def test_invalidation(self):
+        get_announcement_counts(self.user)
+        # Nothing is cleared until the change is committed.
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.announcements[2].mark_seen(self.user)
+        self.assertEqual(get_announcement_counts(self.user), (6, 5, 2))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_announcement_counts(self.user), (6, 4, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Announcement.objects.create(subject='New', author=self.user, important=True,
+                                        created=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(get_announcement_counts(self.user), (7, 5, 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.announcements[4].delete()
+        self.assertEqual(get_announcement_counts(self.user), (6, 4, 1))
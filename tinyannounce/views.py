@@ -1,15 +1,40 @@
-from .models import Announcement
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, Exists, Min, OuterRef, Q
+from django.utils import timezone
+
+from .models import COUNTS_CACHE_TIMEOUT, Announcement, AnnouncementSeen
+
+
+def count_announcements(user, announcements):
+    """Count the announcements, those the user has not seen, and those that
+    are also important, in one query. Also returns the earliest time any of
+    them expires."""
+    seen = Exists(AnnouncementSeen.objects.filter(announcement=OuterRef('pk'), user=user))
+    counts = announcements.order_by().aggregate(
+        total=Count('pk'),
+        new=Count('pk', filter=~seen),
+        new_and_important=Count('pk', filter=~seen & Q(important=True)),
+        next_expiry=Min('expires'),
+    )
+    return (counts['total'], counts['new'], counts['new_and_important']), counts['next_expiry']
 
 
 def get_announcement_counts(user, announcements=None):
-    if announcements is None:
-        announcements = Announcement.objects.active()
-    total = new = new_and_important = 0
-    if user and user.is_authenticated:
-        for a in announcements:
-            total += 1
-            if not a.is_seen_by(user):
-                new += 1
-                if a.important:
-                    new_and_important += 1
-    return total, new, new_and_important
+    if not (user and user.is_authenticated):
+        return 0, 0, 0
+    if announcements is not None:
+        return count_announcements(user, announcements)[0]
+
+    # The counts of the active announcements are cached until the user sees
+    # one, announcements are added or changed, or one expires.
+    key = Announcement.counts_cache_key(user)
+    counts = cache.get(key)
+    if counts is None:
+        counts, next_expiry = count_announcements(user, Announcement.objects.active())
+        timeout = COUNTS_CACHE_TIMEOUT
+        if next_expiry is not None:
+            timeout = min(timeout, (next_expiry - timezone.now()) // timedelta(seconds=1) + 1)
+        cache.set(key, counts, max(timeout, 1))
+    return tuple(counts)